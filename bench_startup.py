@@ -0,0 +1,122 @@
+"""Startup benchmark for the nightly sync.
+
+Measures, in fresh interpreters:
+
+- import time: wall time of `import script`, and which heavy optional modules it loaded
+- time to first request: from process spawn until the sync sends its first HTTP request
+
+The first-request run uses dummy credentials and stops the process at the first
+outgoing request (requests or httpx), so it needs no network access.
+
+    python bench_startup.py --runs 10
+    python bench_startup.py --json > bench_output.txt
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Modules that should only load when the code path that needs them runs
+HEAVY_MODULES = ["cherrypy", "webbrowser", "supabase", "gotrue", "postgrest", "pytz", "numpy", "cryptography"]
+
+IMPORT_CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import script
+elapsed = time.perf_counter() - start
+print(json.dumps({"import_secs": elapsed, "loaded": sorted(m for m in %r if m in sys.modules)}))
+""" % (HEAVY_MODULES,)
+
+FIRST_REQUEST_CHILD = """
+import json, os, sys, time
+import httpx, requests
+
+def first_request(*args, **kwargs):
+    print(json.dumps({"first_request_at": time.time()}))
+    sys.stdout.flush()
+    os._exit(0)
+
+requests.Session.send = first_request
+httpx.Client.send = first_request
+import script
+script.main([])
+"""
+
+def run_child(code, env):
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    # The child logs to stderr; the measurement is the last stdout line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def bench_env(state_dir):
+    env = dict(os.environ)
+    env.update({
+        "GITHUB_ACTIONS": "true",  # skip .env loading so the run is reproducible
+        "FITBIT_CLIENT_ID": "bench",
+        "FITBIT_CLIENT_SECRET": "bench",
+        "SUPABASE_URL": "http://127.0.0.1:9",
+        # create_client only accepts JWT-shaped keys
+        "SUPABASE_SERVICE_ROLE_KEY": "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.bench",
+        "SUPABASE_USER_EMAIL": "bench@example.com",
+        "SUPABASE_USER_PASSWORD": "bench",
+        "FITBIT_STATE_DIR": state_dir
+    })
+    return env
+
+def summarize(samples):
+    return {
+        "runs": len(samples),
+        "median_ms": round(statistics.median(samples) * 1000, 1),
+        "min_ms": round(min(samples) * 1000, 1),
+        "max_ms": round(max(samples) * 1000, 1)
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark sync startup time.")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        env = bench_env(state_dir)
+        import_samples, process_samples, first_request_samples = [], [], []
+        loaded = []
+        for _ in range(args.runs):
+            spawned_at = time.time()
+            result = run_child(IMPORT_CHILD, env)
+            process_samples.append(time.time() - spawned_at)
+            import_samples.append(result["import_secs"])
+            loaded = result["loaded"]
+
+            spawned_at = time.time()
+            result = run_child(FIRST_REQUEST_CHILD, env)
+            first_request_samples.append(result["first_request_at"] - spawned_at)
+
+    report = {
+        "python": sys.version.split()[0],
+        "import_script": summarize(import_samples),
+        "process_import_script": summarize(process_samples),
+        "time_to_first_request": summarize(first_request_samples),
+        "heavy_modules_loaded_at_import": loaded
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for name in ("import_script", "process_import_script", "time_to_first_request"):
+            stats = report[name]
+            print(f"{name:<24} median {stats['median_ms']:>8} ms  (min {stats['min_ms']}, max {stats['max_ms']}, n={stats['runs']})")
+        print(f"heavy modules loaded at import: {', '.join(loaded) or 'none'}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
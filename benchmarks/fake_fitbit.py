@@ -0,0 +1,250 @@
+"""Local stand-in for the Fitbit Web API.
+
+Serves the endpoints the sync uses from the recorded payloads in fixtures/,
+with per-user, per-date values derived from a seeded RNG so every run sees the
+same data. The user is taken from the bearer token ("token-<user_id>").
+Latency and an hourly per-user rate limit (with Fitbit's rate-limit headers and
+429 responses) are configurable.
+"""
+import copy
+import json
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from benchmarks.http_stub import StubServer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+DATE = r"(\d{4}-\d{2}-\d{2})"
+ROUTES = [
+    ("activities_day", re.compile(rf"^/1/user/-/activities/date/{DATE}\.json$")),
+    ("sleep_day", re.compile(rf"^/1(?:\.2)?/user/-/sleep/date/{DATE}\.json$")),
+    ("sleep_range", re.compile(rf"^/1(?:\.2)?/user/-/sleep/date/{DATE}/{DATE}\.json$")),
+    ("heart_intraday", re.compile(rf"^/1/user/-/activities/heart/date/{DATE}/1d/1min\.json$")),
+    ("azm_range", re.compile(rf"^/1/user/-/activities/active-zone-minutes/date/{DATE}/{DATE}\.json$")),
+    ("time_series", re.compile(rf"^/1/user/-/activities/(steps|heart)/date/{DATE}/{DATE}\.json$")),
+    ("activity_list", re.compile(r"^/1/user/-/activities/list\.json$")),
+    ("profile", re.compile(r"^/1/user/-/profile\.json$")),
+]
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name)) as f:
+        return f.read()
+
+def render(template, date_str):
+    return json.loads(template.replace("{date}", date_str))
+
+def date_range(start_str, end_str):
+    day = datetime.strptime(start_str, "%Y-%m-%d")
+    end = datetime.strptime(end_str, "%Y-%m-%d")
+    while day <= end:
+        yield day.strftime("%Y-%m-%d")
+        day += timedelta(days=1)
+
+def day_profile(user_id, date_str):
+    """Deterministic daily values for one user and date."""
+    rng = random.Random(f"{user_id}:{date_str}")
+    deep, light, rem, wake = rng.randint(40, 110), rng.randint(180, 300), rng.randint(50, 130), rng.randint(20, 70)
+    return {
+        "steps": rng.randint(1500, 18000),
+        "rhr": rng.randint(50, 70),
+        "zones": {"Fat Burn": rng.randint(0, 180), "Cardio": rng.randint(0, 40), "Peak": rng.randint(0, 10)},
+        "sleep": {"deep": deep, "light": light, "rem": rem, "wake": wake},
+        "activities": rng.randint(0, 2)
+    }
+
+class FakeFitbit(StubServer):
+    """Fitbit API stand-in; see the module docstring."""
+
+    def __init__(self, latency=0.0, rate_limit_per_hour=None):
+        super().__init__(latency)
+        self.rate_limit_per_hour = rate_limit_per_hour
+        self.throttled = 0
+        self._windows = {}
+        self._window_lock = threading.Lock()
+        self.templates = {
+            name: load_fixture(f"{name}.json")
+            for name in ("activities_date", "sleep_date", "heart_intraday", "activity_list_entry")
+        }
+
+    def _rate_limit(self, user_id):
+        """Return (allowed, headers) for one request against the user's hourly window."""
+        if not self.rate_limit_per_hour:
+            return True, {}
+        now = time.time()
+        with self._window_lock:
+            window_start, used = self._windows.get(user_id, (now, 0))
+            if now - window_start >= 3600:
+                window_start, used = now, 0
+            allowed = used < self.rate_limit_per_hour
+            if allowed:
+                used += 1
+            else:
+                self.throttled += 1
+            self._windows[user_id] = (window_start, used)
+        reset = max(1, int(window_start + 3600 - now))
+        return allowed, {
+            "Fitbit-Rate-Limit-Limit": str(self.rate_limit_per_hour),
+            "Fitbit-Rate-Limit-Remaining": str(self.rate_limit_per_hour - used),
+            "Fitbit-Rate-Limit-Reset": str(reset)
+        }
+
+    def handle(self, method, path, query, headers, body):
+        if path == "/oauth2/token" and method == "POST":
+            self.count_route("token")
+            return 200, {}, self.refresh_response(body)
+
+        authorization = headers.get("Authorization", "")
+        if not authorization.startswith("Bearer token-"):
+            return 401, {}, {"errors": [{"errorType": "invalid_token"}]}
+        user_id = authorization[len("Bearer token-"):]
+
+        for route, pattern in ROUTES:
+            match = pattern.match(path)
+            if match:
+                break
+        else:
+            return 404, {}, {"errors": [{"errorType": "not_found", "message": path}]}
+
+        self.count_route(route)
+        allowed, limit_headers = self._rate_limit(user_id)
+        if not allowed:
+            limit_headers["Retry-After"] = limit_headers["Fitbit-Rate-Limit-Reset"]
+            return 429, limit_headers, {"errors": [{"errorType": "system", "message": "Too Many Requests"}]}
+        payload = getattr(self, route)(user_id, *match.groups(), query=query)
+        return 200, limit_headers, payload
+
+    def refresh_response(self, body):
+        user_id = re.search(rb"refresh_token=refresh-([^&]+)", body or b"")
+        user_id = user_id.group(1).decode("utf8") if user_id else "unknown"
+        return {
+            "access_token": f"token-{user_id}",
+            "refresh_token": f"refresh-{user_id}",
+            "expires_in": 28800,
+            "token_type": "Bearer",
+            "user_id": user_id
+        }
+
+    def _zones(self, template_zones, profile):
+        zones = copy.deepcopy(template_zones)
+        for zone in zones:
+            if zone["name"] in profile["zones"]:
+                zone["minutes"] = profile["zones"][zone["name"]]
+        return zones
+
+    def activities_day(self, user_id, date_str, query):
+        profile = day_profile(user_id, date_str)
+        data = render(self.templates["activities_date"], date_str)
+        data["summary"]["steps"] = profile["steps"]
+        data["summary"]["restingHeartRate"] = profile["rhr"]
+        data["summary"]["heartRateZones"] = self._zones(data["summary"]["heartRateZones"], profile)
+        template = data["activities"][0]
+        data["activities"] = []
+        for i in range(profile["activities"]):
+            activity = dict(template, logId=template["logId"] + i, duration=template["duration"] + 60000 * i)
+            data["activities"].append(activity)
+        return data
+
+    def _sleep_record(self, user_id, date_str):
+        profile = day_profile(user_id, date_str)
+        data = render(self.templates["sleep_date"], date_str)
+        record = data["sleep"][0]
+        for stage, minutes in profile["sleep"].items():
+            record["levels"]["summary"][stage]["minutes"] = minutes
+        asleep = sum(minutes for stage, minutes in profile["sleep"].items() if stage != "wake")
+        record["minutesAsleep"] = asleep
+        record["minutesAwake"] = profile["sleep"]["wake"]
+        record["timeInBed"] = asleep + profile["sleep"]["wake"]
+        data["summary"].update({
+            "stages": dict(profile["sleep"]),
+            "totalMinutesAsleep": asleep,
+            "totalTimeInBed": record["timeInBed"]
+        })
+        return data
+
+    def sleep_day(self, user_id, date_str, query):
+        return self._sleep_record(user_id, date_str)
+
+    def sleep_range(self, user_id, start_str, end_str, query):
+        records = []
+        for date_str in date_range(start_str, end_str):
+            records.extend(self._sleep_record(user_id, date_str)["sleep"])
+        return {"sleep": records}
+
+    def _heart_day(self, user_id, date_str):
+        profile = day_profile(user_id, date_str)
+        day = render(self.templates["heart_intraday"], date_str)
+        entry = day["activities-heart"][0]
+        entry["value"]["restingHeartRate"] = profile["rhr"]
+        entry["value"]["heartRateZones"] = self._zones(entry["value"]["heartRateZones"], profile)
+        return day
+
+    def heart_intraday(self, user_id, date_str, query):
+        day = self._heart_day(user_id, date_str)
+        profile = day_profile(user_id, date_str)
+        rng = random.Random(f"{user_id}:{date_str}:intraday")
+        bpm = profile["rhr"] + 10
+        dataset = []
+        for minute in range(1440):
+            bpm = min(200, max(profile["rhr"] - 5, bpm + rng.randint(-4, 4)))
+            dataset.append({"time": f"{minute // 60:02d}:{minute % 60:02d}:00", "value": bpm})
+        day["activities-heart-intraday"]["dataset"] = dataset
+        return day
+
+    def time_series(self, user_id, resource, start_str, end_str, query):
+        if resource == "steps":
+            return {"activities-steps": [
+                {"dateTime": date_str, "value": str(day_profile(user_id, date_str)["steps"])}
+                for date_str in date_range(start_str, end_str)
+            ]}
+        return {"activities-heart": [
+            self._heart_day(user_id, date_str)["activities-heart"][0]
+            for date_str in date_range(start_str, end_str)
+        ]}
+
+    def azm_range(self, user_id, start_str, end_str, query):
+        days = []
+        for date_str in date_range(start_str, end_str):
+            zones = day_profile(user_id, date_str)["zones"]
+            days.append({"dateTime": date_str, "value": {
+                "fatBurnActiveZoneMinutes": zones["Fat Burn"],
+                "cardioActiveZoneMinutes": zones["Cardio"] * 2,
+                "peakActiveZoneMinutes": zones["Peak"] * 2,
+                "activeZoneMinutes": zones["Fat Burn"] + 2 * (zones["Cardio"] + zones["Peak"])
+            }})
+        return {"activities-active-zone-minutes": days}
+
+    def activity_list(self, user_id, query):
+        after_date = query.get("afterDate", ["2000-01-01"])[0]
+        offset = int(query.get("offset", ["0"])[0])
+        limit = int(query.get("limit", ["20"])[0])
+        today = datetime.now().strftime("%Y-%m-%d")
+        activities = []
+        template = self.templates["activity_list_entry"]
+        for date_str in date_range(after_date, today):
+            for i in range(day_profile(user_id, date_str)["activities"]):
+                entry = render(template, date_str)
+                entry["logId"] += i
+                entry["duration"] += 60000 * i
+                activities.append(entry)
+                if len(activities) >= offset + limit + 1:
+                    break
+            if len(activities) >= offset + limit + 1:
+                break
+        page = activities[offset:offset + limit]
+        next_url = ""
+        if len(activities) > offset + limit:
+            next_url = (
+                f"{self.url}/1/user/-/activities/list.json"
+                f"?afterDate={after_date}&sort=asc&offset={offset + limit}&limit={limit}"
+            )
+        return {
+            "activities": page,
+            "pagination": {"afterDate": after_date, "limit": limit, "next": next_url, "offset": offset, "previous": "", "sort": "asc"}
+        }
+
+    def profile(self, user_id, query):
+        return {"user": {"encodedId": user_id, "timezone": "Australia/Sydney", "offsetFromUTCMillis": 36000000}}
@@ -0,0 +1,203 @@
+"""Local stand-in for Supabase (PostgREST and the auth endpoints the sync uses).
+
+Tables live in memory. Only the PostgREST subset the sync relies on is
+implemented: select with eq/neq/gt/gte/lt/lte/in filters, order and limit;
+insert; upsert (Prefer resolution=merge-duplicates with on_conflict);
+filtered PATCH and DELETE. Unique keys are enforced per table.
+"""
+import base64
+import json
+import threading
+import time
+from urllib.parse import unquote
+from benchmarks.http_stub import StubServer
+
+# Unique key per table, mirroring supabase_migrations.sql
+UNIQUE_KEYS = {
+    "fitbit_data": ("user_id", "date"),
+    "fitbit_tokens": ("user_id",),
+    "fitbit_intraday_heart": ("user_id", "date"),
+    "fitbit_rollups": ("user_id", "period", "period_start"),
+}
+
+OPERATORS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "gt": lambda a, b: a is not None and a > b,
+    "gte": lambda a, b: a is not None and a >= b,
+    "lt": lambda a, b: a is not None and a < b,
+    "lte": lambda a, b: a is not None and a <= b,
+    "in": lambda a, b: a in b,
+}
+
+RESERVED_PARAMS = ("select", "order", "limit", "offset", "on_conflict", "columns")
+
+def _b64(data):
+    return base64.urlsafe_b64encode(json.dumps(data).encode("utf8")).rstrip(b"=").decode("ascii")
+
+def make_jwt(claims):
+    """Unsigned JWT-shaped token; the client only decodes the payload."""
+    return f"{_b64({'alg': 'HS256', 'typ': 'JWT'})}.{_b64(claims)}.bench"
+
+def _coerce(value, example):
+    """Convert a filter value from the query string to the column's type."""
+    if isinstance(example, bool):
+        return value == "true"
+    if isinstance(example, int):
+        return int(value)
+    if isinstance(example, float):
+        return float(value)
+    return value
+
+class FakeSupabase(StubServer):
+    """Supabase stand-in; see the module docstring."""
+
+    def __init__(self, latency=0.0, user_id="00000000-0000-0000-0000-000000000001"):
+        super().__init__(latency)
+        self.user_id = user_id
+        self.tables = {}
+        self.rows_written = 0
+        self._tables_lock = threading.Lock()
+
+    def seed(self, table, rows):
+        with self._tables_lock:
+            stored = self.tables.setdefault(table, [])
+            stored.extend(dict(row) for row in rows)
+
+    def rows(self, table):
+        with self._tables_lock:
+            return [dict(row) for row in self.tables.get(table, [])]
+
+    def handle(self, method, path, query, headers, body):
+        if path.startswith("/auth/v1/"):
+            self.count_route(f"auth:{path[len('/auth/v1/'):]}")
+            return self.handle_auth(method, path[len("/auth/v1/"):], query)
+        if not path.startswith("/rest/v1/"):
+            return 404, {}, {"message": path}
+
+        table = path[len("/rest/v1/"):]
+        self.count_route(f"{method} {table}")
+        payload = json.loads(body) if body else None
+        prefer = headers.get("Prefer", "")
+        with self._tables_lock:
+            rows = self.tables.setdefault(table, [])
+            if method == "GET":
+                return 200, {}, self.select(rows, query)
+            if method == "POST":
+                return self.write(table, rows, payload, query, prefer)
+            if method == "PATCH":
+                return 200, {}, self.update(rows, query, payload)
+            if method == "DELETE":
+                matched = self.filter(rows, query)
+                self.tables[table] = [row for row in rows if not any(row is m for m in matched)]
+                return 200, {}, matched
+        return 405, {}, {"message": method}
+
+    def filter(self, rows, query):
+        conditions = []
+        for column, values in query.items():
+            if column in RESERVED_PARAMS:
+                continue
+            for value in values:
+                op, _, operand = unquote(value).partition(".")
+                if op == "in":
+                    operand = operand.strip("()").split(",")
+                conditions.append((column, op, operand))
+
+        def matches(row):
+            for column, op, operand in conditions:
+                current = row.get(column)
+                if op == "in":
+                    expected = [_coerce(item, current) for item in operand]
+                else:
+                    expected = _coerce(operand, current)
+                if not OPERATORS[op](current, expected):
+                    return False
+            return True
+
+        return [row for row in rows if matches(row)]
+
+    def select(self, rows, query):
+        result = self.filter(rows, query)
+        for order in reversed(query.get("order", [""])[0].split(",")):
+            if order:
+                column, _, direction = order.partition(".")
+                result.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=direction.startswith("desc"))
+        offset = int(query.get("offset", ["0"])[0])
+        limit = query.get("limit")
+        result = result[offset:offset + int(limit[0])] if limit else result[offset:]
+        columns = query.get("select", ["*"])[0]
+        if columns != "*":
+            names = columns.split(",")
+            result = [{name: row.get(name) for name in names} for row in result]
+        return [dict(row) for row in result]
+
+    def write(self, table, rows, payload, query, prefer):
+        records = payload if isinstance(payload, list) else [payload]
+        key_columns = query.get("on_conflict", [",".join(UNIQUE_KEYS.get(table, ()))])[0].split(",")
+        key_columns = [column for column in key_columns if column]
+        upsert = "resolution=merge-duplicates" in prefer
+        index = {tuple(row.get(column) for column in key_columns): row for row in rows} if key_columns else {}
+        written = []
+        for record in records:
+            key = tuple(record.get(column) for column in key_columns)
+            existing = index.get(key) if key_columns else None
+            if existing is not None:
+                if not upsert:
+                    return 409, {}, {"code": "23505", "message": f"duplicate key value violates unique constraint on {table}"}
+                existing.update(record)
+                written.append(dict(existing))
+            else:
+                row = dict(record)
+                if table == "fitbit_activities":
+                    row.setdefault("id", len(rows) + 1)
+                rows.append(row)
+                if key_columns:
+                    index[key] = row
+                written.append(dict(row))
+        self.rows_written += len(written)
+        return 201, {}, written if "return=representation" in prefer else None
+
+    def update(self, rows, query, payload):
+        # filter() returns the stored row objects, so they are updated in place
+        matched = self.filter(rows, query)
+        for row in matched:
+            row.update(payload)
+        self.rows_written += len(matched)
+        return [dict(row) for row in matched]
+
+    def reset_stats(self):
+        super().reset_stats()
+        with self._tables_lock:
+            self.rows_written = 0
+
+    def session(self):
+        expires_at = int(time.time()) + 3600
+        return {
+            "access_token": make_jwt({"sub": self.user_id, "exp": expires_at, "role": "authenticated"}),
+            "refresh_token": "bench-refresh",
+            "expires_in": 3600,
+            "expires_at": expires_at,
+            "token_type": "bearer",
+            "user": self.user()
+        }
+
+    def user(self):
+        return {
+            "id": self.user_id,
+            "aud": "authenticated",
+            "role": "authenticated",
+            "email": "bench@example.com",
+            "app_metadata": {},
+            "user_metadata": {},
+            "created_at": "2024-01-01T00:00:00Z"
+        }
+
+    def handle_auth(self, method, endpoint, query):
+        if endpoint == "token":
+            return 200, {}, self.session()
+        if endpoint == "user":
+            return 200, {}, self.user()
+        if endpoint == "logout":
+            return 204, {}, None
+        return 404, {}, {"message": endpoint}
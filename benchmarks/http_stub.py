@@ -0,0 +1,89 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+class StubServer(object):
+    """Minimal threaded HTTP server for local API stand-ins.
+
+    Subclasses implement handle(method, path, query, headers, body) and return
+    (status, headers, payload). Every request is counted and delayed by
+    `latency` seconds to mimic a network round trip.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self.bytes_sent = 0
+        self.routes = {}
+        self._stats_lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _dispatch(self):
+                parts = urlsplit(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                if stub.latency:
+                    time.sleep(stub.latency)
+                status, headers, payload = stub.handle(
+                    self.command, parts.path, parse_qs(parts.query, keep_blank_values=True), self.headers, body
+                )
+                data = b"" if payload is None else (
+                    payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf8")
+                )
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+                with stub._stats_lock:
+                    stub.requests += 1
+                    stub.bytes_sent += len(data)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = _dispatch
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def count_route(self, route):
+        with self._stats_lock:
+            self.routes[route] = self.routes.get(route, 0) + 1
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.requests = 0
+            self.bytes_sent = 0
+            self.routes = {}
+
+    def stats(self):
+        with self._stats_lock:
+            return {"requests": self.requests, "bytes_sent": self.bytes_sent, "routes": dict(self.routes)}
+
+    def handle(self, method, path, query, headers, body):
+        raise NotImplementedError
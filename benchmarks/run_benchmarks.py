@@ -0,0 +1,202 @@
+"""Offline end-to-end benchmarks for the sync.
+
+Starts local stand-ins for the Fitbit API and Supabase, seeds them for a
+scenario and runs `script.py` against them in a fresh process, so the whole
+pipeline (auth, token handling, fetches, diffing and writes) is measured
+without network access or real credentials.
+
+Scenarios:
+
+- day: one user, one missing day (the nightly path)
+- backfill_90: one user, a 90-day gap (the range path)
+- users_100: 100 users with one missing day each (`--all-users`)
+
+    python -m benchmarks.run_benchmarks
+    python -m benchmarks.run_benchmarks --scenario backfill_90 --latency-ms 50 --runs 3
+    python -m benchmarks.run_benchmarks --rerun
+    python -m benchmarks.run_benchmarks --json > bench_output.txt
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from benchmarks.fake_fitbit import FakeFitbit
+from benchmarks.fake_supabase import FakeSupabase
+from fitbit_utils import get_yesterday_date, format_date
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Scenario name -> (number of users, days missing per user, extra script arguments)
+SCENARIOS = {
+    "day": (1, 1, []),
+    "backfill_90": (1, 90, []),
+    "users_100": (100, 1, ["--all-users"]),
+}
+
+def seed(supabase, users, missing_days):
+    """Give every user tokens and a last recorded day `missing_days` before yesterday."""
+    last_date = format_date(get_yesterday_date() - timedelta(days=missing_days))
+    user_ids = [supabase.user_id] + [f"bench-user-{i:04d}" for i in range(1, users)]
+    supabase.seed("fitbit_tokens", [{
+        "user_id": user_id,
+        "access_token": f"token-{user_id}",
+        "refresh_token": f"refresh-{user_id}",
+        "fitbit_expires_at": time.time() + 8 * 3600,
+        "updated_at": "2024-01-01T00:00:00"
+    } for user_id in user_ids])
+    supabase.seed("fitbit_data", [{
+        "user_id": user_id,
+        "date": last_date,
+        "steps": 1000,
+        "heart_rate": 60,
+        "sleep": "7h0min",
+        "sleep_minutes": 420,
+        "fat_burn_minutes": 0,
+        "cardio_minutes": 0,
+        "peak_minutes": 0
+    } for user_id in user_ids])
+    return user_ids
+
+def script_env(fitbit, supabase, state_dir, args):
+    env = dict(os.environ)
+    env.update({
+        "GITHUB_ACTIONS": "true",  # skip .env loading so only the stand-ins are used
+        "FITBIT_CLIENT_ID": "bench",
+        "FITBIT_CLIENT_SECRET": "bench",
+        "FITBIT_API_ENDPOINT": fitbit.url,
+        # The stand-ins speak plain HTTP, which oauthlib otherwise refuses
+        "OAUTHLIB_INSECURE_TRANSPORT": "1",
+        "SUPABASE_URL": supabase.url,
+        # create_client only accepts JWT-shaped keys
+        "SUPABASE_SERVICE_ROLE_KEY": "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.bench",
+        "SUPABASE_USER_EMAIL": "bench@example.com",
+        "SUPABASE_USER_PASSWORD": "bench",
+        "FITBIT_STATE_DIR": state_dir,
+        "SYNC_REPORT_PATH": os.path.join(state_dir, "run_report.json")
+    })
+    if args.rate_limit:
+        env["FITBIT_RATE_LIMIT_PER_HOUR"] = str(args.rate_limit)
+    return env
+
+def run_sync(fitbit, supabase, state_dir, script_args, args):
+    """Run script.py once and return (exit code, wall seconds, run report)."""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "script.py"] + script_args,
+        cwd=REPO_DIR,
+        env=script_env(fitbit, supabase, state_dir, args),
+        capture_output=True,
+        text=True
+    )
+    wall_secs = time.perf_counter() - started
+    if result.returncode != 0 and args.verbose:
+        sys.stderr.write(result.stderr)
+    try:
+        with open(os.path.join(state_dir, "run_report.json")) as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        report = {"counters": []}
+    return result.returncode, wall_secs, report
+
+def run_scenario(name, args):
+    """Run one scenario against fresh stand-ins and return its measurements."""
+    users, missing_days, script_args = SCENARIOS[name]
+    fitbit = FakeFitbit(latency=args.latency_ms / 1000, rate_limit_per_hour=args.rate_limit).start()
+    supabase = FakeSupabase(latency=args.latency_ms / 1000).start()
+    try:
+        seed(supabase, users, missing_days)
+        with tempfile.TemporaryDirectory() as state_dir:
+            exit_code, wall_secs, report = run_sync(fitbit, supabase, state_dir, script_args, args)
+
+            def counter(name, **labels):
+                return sum(
+                    entry["value"] for entry in report["counters"]
+                    if entry["name"] == name and all(entry["labels"].get(k) == v for k, v in labels.items())
+                )
+
+            fitbit_stats, supabase_stats = fitbit.stats(), supabase.stats()
+            measurements = {
+                "exit_code": exit_code,
+                "wall_secs": wall_secs,
+                "fitbit_requests": fitbit_stats["requests"],
+                "fitbit_bytes": fitbit_stats["bytes_sent"],
+                "fitbit_throttled": fitbit.throttled,
+                "fitbit_routes": fitbit_stats["routes"],
+                "db_round_trips": supabase_stats["requests"],
+                "db_rows_written": supabase.rows_written,
+                "db_routes": supabase_stats["routes"],
+                "users_ok": counter("users_synced_total", status="ok"),
+                "days_stored": len(supabase.rows("fitbit_data")) - users
+            }
+
+            if args.rerun:
+                # Same data and state again: the trailing re-sync window is fetched again (the journal
+                # never skips it) and nothing is written, since no content hash changed
+                fitbit.reset_stats()
+                supabase.reset_stats()
+                exit_code, wall_secs, report = run_sync(fitbit, supabase, state_dir, script_args, args)
+                measurements["rerun"] = {
+                    "exit_code": exit_code,
+                    "wall_ms": round(wall_secs * 1000, 1),
+                    "fitbit_requests": fitbit.stats()["requests"],
+                    "db_round_trips": supabase.stats()["requests"],
+                    "db_rows_written": supabase.rows_written
+                }
+        return measurements
+    finally:
+        fitbit.stop()
+        supabase.stop()
+
+def summarize(name, runs):
+    walls = [run["wall_secs"] for run in runs]
+    last = runs[-1]
+    return {
+        "scenario": name,
+        "runs": len(runs),
+        "failed_runs": sum(run["exit_code"] != 0 for run in runs),
+        "wall_median_ms": round(statistics.median(walls) * 1000, 1),
+        "wall_min_ms": round(min(walls) * 1000, 1),
+        **{key: value for key, value in last.items() if key not in ("exit_code", "wall_secs")}
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the sync end to end against local stand-ins.")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append", help="scenario to run (repeatable, default: all)")
+    parser.add_argument("--runs", type=int, default=1, help="fresh runs per scenario")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added latency per request on both stand-ins")
+    parser.add_argument("--rate-limit", type=int, default=None, help="Fitbit requests per user per hour (default: unlimited)")
+    parser.add_argument("--rerun", action="store_true", help="sync a second time against the same data and report that run too")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show the sync's output for failed runs")
+    args = parser.parse_args(argv)
+
+    results = []
+    for name in args.scenario or list(SCENARIOS):
+        runs = [run_scenario(name, args) for _ in range(args.runs)]
+        results.append(summarize(name, runs))
+
+    if args.json:
+        print(json.dumps({"python": sys.version.split()[0], "latency_ms": args.latency_ms, "scenarios": results}, indent=2))
+    else:
+        print(f"{'scenario':<12} {'wall ms':>9} {'fitbit req':>10} {'fitbit KB':>10} {'429s':>5} {'db trips':>9} {'rows':>6} {'days':>5} {'failed':>6}")
+        for result in results:
+            print(
+                f"{result['scenario']:<12} {result['wall_median_ms']:>9} {result['fitbit_requests']:>10} "
+                f"{result['fitbit_bytes'] / 1024:>10.1f} {result['fitbit_throttled']:>5} {result['db_round_trips']:>9} "
+                f"{result['db_rows_written']:>6} {result['days_stored']:>5} {result['failed_runs']:>6}"
+            )
+            if "rerun" in result:
+                rerun = result["rerun"]
+                print(
+                    f"{'  rerun':<12} {rerun['wall_ms']:>9} {rerun['fitbit_requests']:>10} {'':>10} {'':>5} "
+                    f"{rerun['db_round_trips']:>9} {rerun['db_rows_written']:>6}"
+                )
+    return 1 if any(result["failed_runs"] for result in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
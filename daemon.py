@@ -0,0 +1,200 @@
+"""Long-running sync daemon.
+
+Keeps the Supabase client and each user's Fitbit client (with its HTTP
+connection pool, tokens and rate-limit state) alive between syncs, and syncs
+every user shortly after midnight in the timezone of their Fitbit profile.
+SIGINT/SIGTERM stop it cleanly: in-flight syncs stop starting fetches and
+write what they already have, queued ones are skipped, and the run report is
+written before exiting.
+
+    python daemon.py
+    python daemon.py --all-users --workers 16 --delay-minutes 90
+"""
+import argparse
+import signal
+import sys
+import threading
+import time
+import traceback
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from fitbit_auth import load_config, get_fitbit_instance
+from fitbit_daily_data import fetch_user_timezone
+from fitbit_utils import DEFAULT_TIMEZONE, get_local_now
+from sync_metrics import reset_run_report
+from supabase_utils import (
+    get_supabase_client,
+    authenticate_supabase,
+    list_fitbit_users,
+    cleanup_supabase_client
+)
+from script import sync_user, log_summary, write_run_report, stop_requested
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Retry delays for users whose sync was cut short by the rate limit, or failed
+DEFERRED_RETRY_SECS = 15 * 60
+FAILED_RETRY_SECS = 30 * 60
+
+# How often the user list is re-read in --all-users mode
+REFRESH_USERS_SECS = 60 * 60
+
+# Longest sleep between schedule checks, so new users and stop requests are noticed
+MAX_IDLE_SECS = 60
+
+class SyncDaemon(object):
+    """Syncs users on their own local-day schedule with warm clients.
+
+    `user_ids` fixes the users to sync; None means every user with a row in
+    fitbit_tokens, re-read every REFRESH_USERS_SECS.
+    """
+
+    def __init__(self, config, supabase, user_ids=None, workers=1, delay_minutes=60):
+        self.config = config
+        self.supabase = supabase
+        self.fixed_user_ids = user_ids
+        self.workers = max(workers, 1)
+        self.delay = timedelta(minutes=delay_minutes)
+        self.stop_event = threading.Event()
+        self.clients = {}
+        self.timezones = {}
+        self.next_run = {}
+        self._users_refreshed_at = 0
+
+    def stop(self, signum=None, frame=None):
+        """Ask the daemon to exit once in-flight syncs wind down (usable as a signal handler)."""
+        logger.info("Stop requested, finishing in-flight syncs...")
+        self.stop_event.set()
+        # In-flight syncs start no new fetches and rate-limit waits end early
+        stop_requested.set()
+
+    def refresh_users(self):
+        """Pick up added users (due immediately) and forget removed ones."""
+        user_ids = self.fixed_user_ids if self.fixed_user_ids is not None else list_fitbit_users(self.supabase)
+        self._users_refreshed_at = time.time()
+        for user_id in user_ids:
+            self.next_run.setdefault(user_id, time.time())
+        for user_id in set(self.next_run) - set(user_ids):
+            logger.info(f"User {user_id} no longer has Fitbit tokens, removing from schedule")
+            self.next_run.pop(user_id, None)
+            self.clients.pop(user_id, None)
+            self.timezones.pop(user_id, None)
+
+    def next_day_boundary(self, user_id):
+        """Return when the user's next local day has started plus the configured delay, as a timestamp."""
+        now = get_local_now(self.timezones.get(user_id))
+        tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        # localize() picks the right UTC offset for that date, across DST changes
+        return (now.tzinfo.localize(tomorrow) + self.delay).timestamp()
+
+    def sync(self, user_id):
+        """Sync one user with their warm client and schedule their next sync."""
+        if self.stop_event.is_set():
+            return None
+        client = self.clients.get(user_id)
+        if client is None:
+            try:
+                client = get_fitbit_instance(self.config, self.supabase, user_id, stop_requested)
+            except Exception as e:
+                logger.error(f"Error creating Fitbit client for user {user_id}: {type(e).__name__}")
+                logger.debug(f"Error details: {traceback.format_exc()}")
+                self.next_run[user_id] = time.time() + FAILED_RETRY_SECS
+                return {"user_id": user_id, "status": "failed", "error": type(e).__name__}
+            self.clients[user_id] = client
+
+        try:
+            # Users travel, so the timezone is read again before every sync
+            self.timezones[user_id] = fetch_user_timezone(client) or self.timezones.get(user_id)
+        except Exception as e:
+            logger.warning(f"Could not read timezone for user {user_id}: {type(e).__name__}")
+        summary = sync_user(self.config, self.supabase, user_id, client, self.timezones.get(user_id))
+
+        if summary["status"] == "failed":
+            # Build a fresh client next time in case its tokens were revoked
+            self.clients.pop(user_id, None)
+            self.next_run[user_id] = time.time() + FAILED_RETRY_SECS
+        elif summary["status"] == "deferred":
+            self.next_run[user_id] = time.time() + DEFERRED_RETRY_SECS
+        else:
+            self.next_run[user_id] = self.next_day_boundary(user_id)
+        logger.info(
+            f"Next sync for user {user_id} at "
+            f"{datetime.fromtimestamp(self.next_run[user_id]).astimezone().isoformat(timespec='minutes')} "
+            f"({self.timezones.get(user_id) or DEFAULT_TIMEZONE})"
+        )
+        return summary
+
+    def run_due(self):
+        """Sync every user whose next run has come, as one reported batch."""
+        now = time.time()
+        due = sorted(user_id for user_id, next_run in self.next_run.items() if next_run <= now)
+        if not due:
+            return []
+        reset_run_report()
+        logger.info(f"Syncing {len(due)} due user(s)...")
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            summaries = [summary for summary in executor.map(self.sync, due) if summary]
+        log_summary(summaries)
+        write_run_report(self.config)
+        return summaries
+
+    def run(self):
+        """Run until stop() is called."""
+        while not self.stop_event.is_set():
+            if time.time() - self._users_refreshed_at >= REFRESH_USERS_SECS:
+                try:
+                    self.refresh_users()
+                except Exception as e:
+                    logger.error(f"Error listing users: {type(e).__name__}")
+            self.run_due()
+
+            next_run = min(self.next_run.values(), default=time.time() + MAX_IDLE_SECS)
+            self.stop_event.wait(min(max(next_run - time.time(), 1), MAX_IDLE_SECS))
+        logger.info("Sync daemon stopped")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Keep syncing Fitbit data into Supabase at each user's local midnight.")
+    parser.add_argument(
+        "--all-users",
+        action="store_true",
+        help="sync every user with a row in fitbit_tokens instead of the signed-in user"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="number of users synced in parallel (default: FITBIT_USER_CONCURRENCY)"
+    )
+    parser.add_argument(
+        "--delay-minutes",
+        type=int,
+        default=None,
+        help="minutes after local midnight to sync each user (default: FITBIT_DAEMON_DELAY_MINUTES)"
+    )
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = load_config()
+    supabase = get_supabase_client()
+    try:
+        user_ids = None if args.all_users else [authenticate_supabase(supabase)]
+        daemon = SyncDaemon(
+            config,
+            supabase,
+            user_ids,
+            workers=args.workers or config["sync"]["user_concurrency"],
+            delay_minutes=args.delay_minutes if args.delay_minutes is not None
+                else config["sync"]["daemon_delay_minutes"]
+        )
+        signal.signal(signal.SIGINT, daemon.stop)
+        signal.signal(signal.SIGTERM, daemon.stop)
+        daemon.run()
+        return 0
+    finally:
+        cleanup_supabase_client()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""Export fitbit_data and fitbit_activities history to CSV or Parquet.
+
+Rows are streamed from Supabase one page at a time (keyset pagination on
+user_id, then date) and written as they arrive, so memory use stays flat no
+matter how many users or years are exported. Parquet output needs pyarrow
+(`pip install pyarrow`).
+
+    python export.py --all-users --output-dir export
+    python export.py --format parquet --start 2024-01-01 --end 2024-12-31
+"""
+import argparse
+import csv
+import os
+import sys
+import logging
+from supabase_utils import (
+    get_supabase_client,
+    authenticate_supabase,
+    cleanup_supabase_client,
+    iter_table_users,
+    iter_user_rows,
+    FITBIT_DATA_COLUMNS
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Exported columns per table, and whether a table can hold several rows per date
+EXPORT_TABLES = {
+    "fitbit_data": (["user_id", "date"] + FITBIT_DATA_COLUMNS, True),
+    "fitbit_activities": (
+        ["user_id", "date", "activity_name", "duration", "calories", "distance", "start_time"],
+        False
+    )
+}
+
+# Column types for Parquet; every other column is written as a string
+INTEGER_COLUMNS = set(FITBIT_DATA_COLUMNS) - {"sleep"} | {"duration", "calories"}
+FLOAT_COLUMNS = {"distance"}
+
+# Rows per CSV flush / Parquet row group
+BATCH_ROWS = 10_000
+
+def iter_export_rows(supabase, table, user_ids, start_date=None, end_date=None, page_size=1000):
+    """Yield the exported columns of every row of table for each user, in (user_id, date) order."""
+    columns, unique_dates = EXPORT_TABLES[table]
+    for user_id in user_ids:
+        yield from iter_user_rows(
+            supabase, table, user_id, ",".join(columns), start_date, end_date, page_size, unique_dates
+        )
+
+def iter_batches(rows, size):
+    """Group a row stream into lists of at most size rows."""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def write_csv(rows, path, columns):
+    """Stream rows into a CSV file and return how many were written."""
+    count = 0
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        for batch in iter_batches(rows, BATCH_ROWS):
+            writer.writerows(batch)
+            count += len(batch)
+    return count
+
+def write_parquet(rows, path, columns):
+    """Stream rows into a Parquet file, one row group per batch, and return how many were written."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    def column_type(column):
+        if column in INTEGER_COLUMNS:
+            return pa.int64()
+        if column in FLOAT_COLUMNS:
+            return pa.float64()
+        return pa.string()
+
+    schema = pa.schema([(column, column_type(column)) for column in columns])
+    count = 0
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for batch in iter_batches(rows, BATCH_ROWS):
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            count += len(batch)
+    return count
+
+WRITERS = {
+    "csv": write_csv,
+    "parquet": write_parquet
+}
+
+def export_table(supabase, table, user_ids, output_dir, file_format="csv", start_date=None, end_date=None,
+                 page_size=1000):
+    """Export one table to <output_dir>/<table>.<format> and return the number of rows written."""
+    columns, _ = EXPORT_TABLES[table]
+    path = os.path.join(output_dir, f"{table}.{file_format}")
+    # Write to a temporary file so an interrupted export never leaves a truncated file behind
+    tmp_path = path + ".tmp"
+    rows = iter_export_rows(supabase, table, user_ids, start_date, end_date, page_size)
+    count = WRITERS[file_format](rows, tmp_path, columns)
+    os.replace(tmp_path, path)
+    logger.info(f"Exported {count} rows from {table} to {path}")
+    return count
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export Fitbit history from Supabase to CSV or Parquet.")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="csv", help="output format (default: csv)")
+    parser.add_argument("--output-dir", default="export", help="directory for the exported files (default: export)")
+    parser.add_argument(
+        "--table",
+        choices=sorted(EXPORT_TABLES),
+        action="append",
+        help="table to export (repeatable, default: all)"
+    )
+    parser.add_argument("--start", help="first date to export (YYYY-MM-DD)")
+    parser.add_argument("--end", help="last date to export (YYYY-MM-DD)")
+    parser.add_argument("--page-size", type=int, default=1000, help="rows per request (default: 1000)")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--user-id", help="user to export (default: the signed-in user)")
+    group.add_argument("--all-users", action="store_true", help="export every user with rows in the table")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            logger.error("Parquet export needs pyarrow: pip install pyarrow")
+            return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    supabase = get_supabase_client()
+    try:
+        user_id = None if args.all_users else args.user_id or authenticate_supabase(supabase)
+        for table in args.table or list(EXPORT_TABLES):
+            user_ids = iter_table_users(supabase, table) if args.all_users else [user_id]
+            export_table(
+                supabase, table, user_ids, args.output_dir, args.format, args.start, args.end, args.page_size
+            )
+        return 0
+    finally:
+        cleanup_supabase_client()
+
+if __name__ == "__main__":
+    sys.exit(main())
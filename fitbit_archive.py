@@ -0,0 +1,76 @@
+import glob
+import gzip
+import json
+import os
+import re
+import threading
+import logging
+from datetime import datetime, timezone
+from fitbit_cache import ResponseCache
+
+logger = logging.getLogger(__name__)
+
+# First YYYY-MM-DD in a request path, used to index the response by date
+DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+class ResponseArchive(object):
+    """Append-only, gzip-compressed archive of raw Fitbit responses for one user.
+
+    Records are JSON lines, each written as its own gzip member, in one file per
+    month: <archive_dir>/<user_id>/<YYYY-MM>.jsonl.gz. A record holds the request
+    path, the first date in it, when it was fetched and the raw response.
+    """
+
+    def __init__(self, archive_dir, user_id):
+        self.user_dir = os.path.join(archive_dir, user_id)
+        os.makedirs(self.user_dir, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def install(self, fitbit_client):
+        """Archive every GET response the client receives."""
+        make_request = fitbit_client.make_request
+
+        def archiving_make_request(url, *args, **kwargs):
+            response = make_request(url, *args, **kwargs)
+            if not args and 'data' not in kwargs and kwargs.get('method', 'GET').upper() == 'GET':
+                try:
+                    self.record(url, response)
+                except OSError as e:
+                    logger.warning(f"Could not archive Fitbit response: {e}")
+            return response
+
+        fitbit_client.make_request = archiving_make_request
+        fitbit_client.response_archive = self
+        return fitbit_client
+
+    def record(self, url, response, fetched_at=None):
+        """Append one raw response to the archive."""
+        path = ResponseCache.make_key(url)
+        match = DATE_PATTERN.search(path)
+        fetched_at = fetched_at or datetime.now(timezone.utc).isoformat()
+        date_str = match.group(0) if match else fetched_at[:10]
+        line = json.dumps({
+            "path": path,
+            "date": date_str,
+            "fetched_at": fetched_at,
+            "response": response
+        }, separators=(',', ':')) + "\n"
+        with self._lock:
+            with gzip.open(os.path.join(self.user_dir, f"{date_str[:7]}.jsonl.gz"), "ab") as f:
+                f.write(line.encode("utf8"))
+
+    def iter_records(self, end_date=None):
+        """Yield archived records, oldest month first, skipping records dated after end_date.
+
+        Range responses are indexed by their first date, so earlier months are
+        always read: they can still cover days inside a requested range.
+        """
+        for path in sorted(glob.glob(os.path.join(self.user_dir, "*.jsonl.gz"))):
+            if end_date and os.path.basename(path)[:7] > end_date[:7]:
+                continue
+            with gzip.open(path, "rt", encoding="utf8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    if end_date and record["date"] > end_date:
+                        continue
+                    yield record
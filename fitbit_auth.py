@@ -1,9 +1,15 @@
-import gather_keys_oauth2 as Oauth2
 import json
 import fitbit
 import os
 from dotenv import load_dotenv
-from supabase_utils import get_fitbit_tokens, update_fitbit_tokens
+from supabase_utils import update_fitbit_tokens
+from fitbit_tokens import TokenManager
+from fitbit_cache import ResponseCache
+from fitbit_rate_limit import RateLimiter
+from fitbit_archive import ResponseArchive
+from http_transport import mount
+from fitbit_utils import get_state_dir
+from sync_metrics import get_run_report
 import logging
 
 logger = logging.getLogger(__name__)
@@ -28,6 +34,51 @@ def load_config():
         "fitbit_api_keys": {
             "client_id": os.getenv("FITBIT_CLIENT_ID"),
             "client_secret": os.getenv("FITBIT_CLIENT_SECRET")
+        },
+        # Key for the encrypted local token cache; the client secret never lands in the state dir
+        "token_cache_key": os.getenv("FITBIT_TOKEN_CACHE_KEY") or os.getenv("FITBIT_CLIENT_SECRET"),
+        # Override for the Fitbit API base URL, e.g. a local stand-in for benchmarks
+        "fitbit_api_endpoint": os.getenv("FITBIT_API_ENDPOINT"),
+        "sync": {
+            # Longest gap (in days) a single run will backfill
+            "backfill_max_days": int(os.getenv("FITBIT_BACKFILL_MAX_DAYS", "365")),
+            # Trailing days re-fetched every run to pick up late device syncs (1 fetches yesterday only)
+            "resync_days": int(os.getenv("FITBIT_RESYNC_DAYS", "7")),
+            # Maximum number of Fitbit fetches in flight at once (1 runs them sequentially)
+            "fetch_concurrency": int(os.getenv("FITBIT_FETCH_CONCURRENCY", "4")),
+            # Number of users synced in parallel by `script.py --all-users`
+            "user_concurrency": int(os.getenv("FITBIT_USER_CONCURRENCY", "8")),
+            # Fitbit request budget per user per hour, and the longest pause before deferring work
+            "rate_limit_per_hour": int(os.getenv("FITBIT_RATE_LIMIT_PER_HOUR", "150")),
+            "rate_limit_max_wait": int(os.getenv("FITBIT_RATE_LIMIT_MAX_WAIT", "60")),
+            # Where raw responses are archived for offline reprocessing (None when FITBIT_ARCHIVE=0)
+            "archive_dir": None if os.getenv("FITBIT_ARCHIVE", "1") == "0"
+                else os.getenv("FITBIT_ARCHIVE_DIR") or os.path.join(get_state_dir(), "archive"),
+            # Where 1-minute heart rate series are kept (None unless FITBIT_INTRADAY=1; the
+            # series is only fetched when they are), and whether they are also uploaded to Supabase
+            "intraday_dir": None if os.getenv("FITBIT_INTRADAY", "0") == "0"
+                else os.getenv("FITBIT_INTRADAY_DIR") or os.path.join(get_state_dir(), "intraday"),
+            "intraday_upload": os.getenv("FITBIT_INTRADAY_UPLOAD", "0") == "1",
+            # Checkpoints of fetched and written days so an interrupted run resumes where it stopped
+            # (None when FITBIT_JOURNAL=0), and how long they are reused
+            "journal_path": None if os.getenv("FITBIT_JOURNAL", "1") == "0"
+                else os.getenv("FITBIT_JOURNAL_PATH") or os.path.join(get_state_dir(), "journal.sqlite"),
+            "journal_max_age_hours": int(os.getenv("FITBIT_JOURNAL_MAX_AGE_HOURS", "6")),
+            # How long after each user's local midnight `daemon.py` syncs them
+            "daemon_delay_minutes": int(os.getenv("FITBIT_DAEMON_DELAY_MINUTES", "60")),
+            # JSON run report (always written) and optional Prometheus textfile
+            "report_path": os.getenv("SYNC_REPORT_PATH") or os.path.join(get_state_dir(), "run_report.json"),
+            "prometheus_textfile": os.getenv("SYNC_PROMETHEUS_TEXTFILE")
+        },
+        "subscriptions": {
+            # Subscriber ID and verification code from the app's settings at dev.fitbit.com
+            "subscriber_id": os.getenv("FITBIT_SUBSCRIBER_ID"),
+            "verify_code": os.getenv("FITBIT_SUBSCRIBER_VERIFY_CODE"),
+            "port": int(os.getenv("FITBIT_SUBSCRIBER_PORT", "8081")),
+            # Quiet period after the last notification for a (user, date, collection) before
+            # it is fetched, and the longest a burst of notifications can postpone the fetch
+            "debounce_secs": int(os.getenv("FITBIT_NOTIFY_DEBOUNCE_SECS", "60")),
+            "max_delay_secs": int(os.getenv("FITBIT_NOTIFY_MAX_DELAY_SECS", "600"))
         }
     }
 
@@ -43,39 +94,76 @@ def update_tokens(supabase, user_id, new_tokens):
     )
     logger.info("Tokens updated successfully")
 
-def get_fitbit_instance(credentials, supabase, user_id):
+def get_fitbit_instance(credentials, supabase, user_id, stop_event=None):
     client_id = credentials["fitbit_api_keys"]["client_id"]
     client_secret = credentials["fitbit_api_keys"]["client_secret"]
     
-    # Get tokens from Supabase
-    tokens = get_fitbit_tokens(supabase, user_id)
+    # Get tokens from the local cache, or Supabase when they are close to expiring
+    token_manager = TokenManager(
+        supabase, user_id, os.path.join(get_state_dir(), "tokens"), credentials["token_cache_key"]
+    )
+    with get_run_report().span("token_load", user_id=user_id):
+        tokens = token_manager.load()
     if not tokens:
         if os.getenv('GITHUB_ACTIONS'):
             raise Exception("No Fitbit tokens found in database. Please run the authentication process locally first.")
         else:
             raise Exception("No Fitbit tokens found in database. Please authenticate first.")
-    
-    access_token = tokens["access_token"]
-    refresh_token = tokens["refresh_token"]
 
     def token_update_callback(new_token):
         """Callback function to handle token refresh."""
         logger.info("Received new Fitbit token")
-        update_tokens(supabase, user_id, new_token)
+        token_manager.store(new_token)
 
-    return fitbit.Fitbit(
+    fitbit_client = fitbit.Fitbit(
         client_id,
         client_secret,
-        access_token=access_token,
-        refresh_token=refresh_token,
+        access_token=tokens["access_token"],
+        refresh_token=tokens["refresh_token"],
+        expires_at=tokens["expires_at"],
         refresh_cb=token_update_callback
     )
+    # Share pooled keep-alive connections, timeouts and retries with every other client
+    mount(fitbit_client.client.session)
+    api_endpoint = credentials.get("fitbit_api_endpoint")
+    if api_endpoint:
+        fitbit_client.API_ENDPOINT = api_endpoint
+        fitbit_client.client.refresh_token_url = f"{api_endpoint}/oauth2/token"
+
+    with get_run_report().span("token_refresh", user_id=user_id):
+        token_manager.ensure_fresh(fitbit_client)
+    get_run_report().instrument_fitbit(fitbit_client, user_id)
+
+    # Pace requests against the user's hourly quota, persisted between runs
+    rate_limiter = RateLimiter(
+        os.path.join(get_state_dir(), f"rate_limit_{user_id}.json"),
+        requests_per_hour=credentials["sync"]["rate_limit_per_hour"],
+        max_wait=credentials["sync"]["rate_limit_max_wait"],
+        stop_event=stop_event
+    )
+    rate_limiter.install(fitbit_client)
+    # Outside the rate limiter, so a retry with reloaded tokens is paced too
+    token_manager.install(fitbit_client)
+
+    # Keep every raw response that actually came over the network
+    if credentials["sync"]["archive_dir"]:
+        ResponseArchive(credentials["sync"]["archive_dir"], user_id).install(fitbit_client)
+    if credentials["sync"]["intraday_dir"]:
+        from intraday_store import IntradayStore
+        IntradayStore(credentials["sync"]["intraday_dir"], user_id).install(fitbit_client)
+
+    # Share identical responses between extractors for the rest of the run.
+    # Installed last so cache hits never spend quota.
+    return ResponseCache().install(fitbit_client)
 
 def authenticate_fitbit(credentials, supabase, user_id):
     """Authenticate and return a Fitbit client instance."""
     if os.getenv('GITHUB_ACTIONS'):
         raise Exception("Authentication must be performed locally. Please run the authentication process on your local machine first.")
         
+    # The OAuth web server (cherrypy, webbrowser) is only needed here, never in the nightly sync
+    import gather_keys_oauth2 as Oauth2
+
     client_id = credentials["fitbit_api_keys"]["client_id"]
     client_secret = credentials["fitbit_api_keys"]["client_secret"]
 
@@ -0,0 +1,76 @@
+import threading
+import logging
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache(object):
+    """Per-run memoization of Fitbit GET requests.
+
+    Every Fitbit client method (activities, sleep, intraday_time_series,
+    time_series, ...) goes through make_request, and the request path encodes
+    the endpoint, date and detail level. Caching on that path lets several
+    extractors share one response for the lifetime of the client.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._responses = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def install(self, fitbit_client):
+        """Wrap the client's make_request with the cache and return the client."""
+        make_request = fitbit_client.make_request
+
+        def cached_make_request(url, *args, **kwargs):
+            # Only plain GETs are cached; anything carrying data is passed through untouched.
+            # Collection resources like activities() pass data=None positionally for a GET.
+            if any(arg is not None for arg in args) or 'data' in kwargs \
+                    or kwargs.get('method', 'GET').upper() != 'GET':
+                return make_request(url, *args, **kwargs)
+            return self.get_or_fetch(self.make_key(url), lambda: make_request(url, **kwargs))
+
+        fitbit_client.make_request = cached_make_request
+        fitbit_client.response_cache = self
+        return fitbit_client
+
+    @staticmethod
+    def make_key(url):
+        """Key a request on its path and query string, i.e. (endpoint, date, detail level)."""
+        parts = urlsplit(url)
+        return parts.path + ('?' + parts.query if parts.query else '')
+
+    def get_or_fetch(self, key, fetch):
+        """Return the cached response for key, calling fetch at most once per key."""
+        with self._lock:
+            if key in self._responses:
+                self.hits += 1
+                return self._responses[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Concurrent callers for the same key wait here for the first fetch
+        with key_lock:
+            with self._lock:
+                if key in self._responses:
+                    self.hits += 1
+                    return self._responses[key]
+                self.misses += 1
+            response = fetch()
+            with self._lock:
+                self._responses[key] = response
+            return response
+
+    def clear(self):
+        """Drop every cached response, e.g. before the next sync of a long-lived client."""
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self._responses = {}
+            self._key_locks = {}
+
+    def stats(self):
+        """Return hit and miss counts since the cache was created or cleared."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
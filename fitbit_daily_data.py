@@ -1,65 +1,238 @@
-from fitbit_utils import calculate_sleep_metrics
+from fitbit_utils import calculate_sleep_metrics, format_date
+from fitbit_rate_limit import RateLimitDeferred
 from datetime import datetime, timedelta
 
+def fetch_user_timezone(fitbit_client):
+    """Fetch the timezone name (e.g. Australia/Sydney) set in the user's Fitbit profile, or None."""
+    profile = fitbit_client.user_profile_get()
+    return profile.get('user', {}).get('timezone') if profile else None
+
 def fetch_steps_yesterday(fitbit_client, date):
     """Fetch steps data for a specific date."""
     return fitbit_client.activities(date=date)
 
 def fetch_sleep_yesterday(fitbit_client, date):
-    """Fetch sleep data for a specific date."""
-    sleep_data = fitbit_client.sleep(date=date)
-    if sleep_data and 'sleep' in sleep_data and sleep_data['sleep']:
-        total_sleep_minutes = sum(sleep['minutesAsleep'] for sleep in sleep_data['sleep'])
-        hours = total_sleep_minutes // 60
-        minutes = total_sleep_minutes % 60
-        return f"{hours}h{minutes}min"
-    return "0h0min"
+    """Fetch sleep totals and stage minutes for a specific date."""
+    # v1.2 reports sleep stages (deep/light/REM/wake); v1 only has the classic summary
+    url = _api_url(fitbit_client, "sleep/date/{0}.json".format(format_date(date)), version="1.2")
+    return parse_sleep_fields(fitbit_client.make_request(url))
+
+def parse_sleep_fields(sleep_data):
+    """Extract sleep totals and stage minutes from a one-day sleep response, or None if there was no sleep."""
+    if sleep_data and sleep_data.get('sleep'):
+        return sleep_fields(sleep_data['sleep'])
+    return None
+
+def sleep_fields(sleep_logs):
+    """Sum one day's sleep logs into fitbit_data fields: the formatted total plus numeric minutes per stage."""
+    fields = dict.fromkeys(SLEEP_STAGE_COLUMNS.values(), 0)
+    total_minutes = 0
+    for sleep in sleep_logs:
+        total_minutes += sleep['minutesAsleep']
+        for stage, summary in sleep.get('levels', {}).get('summary', {}).items():
+            column = SLEEP_STAGE_COLUMNS.get(stage)
+            if column:
+                fields[column] += summary.get('minutes', 0)
+    fields['sleep'] = f"{total_minutes // 60}h{total_minutes % 60}min"
+    fields['sleep_minutes'] = total_minutes
+    return fields
 
 def fetch_rhr_yesterday(fitbit_client, date):
     """Fetch resting heart rate data for a specific date."""
-    heart_data = fitbit_client.intraday_time_series('activities/heart', base_date=date, detail_level='1min')
+    # The daily summary series carries restingHeartRate without the 1,440-point intraday dataset
+    heart_data = fitbit_client.time_series('activities/heart', base_date=date, end_date=date)
+    return parse_rhr(heart_data)
+
+def parse_rhr(heart_data):
+    """Extract the resting heart rate from an activities/heart response."""
     if heart_data and 'activities-heart' in heart_data and heart_data['activities-heart']:
-        return heart_data['activities-heart'][0]['value']['restingHeartRate']
+        return heart_data['activities-heart'][0]['value'].get('restingHeartRate', 0)
     return 0
 
 def fetch_active_zone_minutes(fitbit_client, date):
     """Fetch active zone minutes for a specific date."""
     try:
-        # Get active zone minutes data
-        zone_data = fitbit_client.intraday_time_series('activities/heart', base_date=date, detail_level='1min')
-        if zone_data and 'activities-heart-intraday' in zone_data:
-            # Calculate total minutes in each zone
-            zones = {
-                'fat_burn': 0,
-                'cardio': 0,
-                'peak': 0
-            }
-            
-            for minute in zone_data['activities-heart-intraday']['dataset']:
-                if minute['value'] >= 140:  # Peak zone
-                    zones['peak'] += 1
-                elif minute['value'] >= 120:  # Cardio zone
-                    zones['cardio'] += 1
-                elif minute['value'] >= 100:  # Fat burn zone
-                    zones['fat_burn'] += 1
-            
-            return zones
+        return fetch_azm_range(fitbit_client, date, date).get(format_date(date), dict(NO_ZONE_MINUTES))
+    except RateLimitDeferred:
+        raise
     except Exception as e:
         print(f"Error fetching active zone minutes: {e}")
-    return {'fat_burn': 0, 'cardio': 0, 'peak': 0}
+    return dict(NO_ZONE_MINUTES)
+
+def fetch_intraday_heart(fitbit_client, date):
+    """Fetch the 1-minute heart rate series for a date and return its number of readings.
+
+    Only worth the request when an IntradayStore is installed on the client,
+    which keeps the series as the response passes through.
+    """
+    heart_data = fitbit_client.intraday_time_series('activities/heart', base_date=date, detail_level='1min')
+    return len(heart_data.get('activities-heart-intraday', {}).get('dataset', []))
 
 def fetch_activities(fitbit_client, date):
     """Fetch activities for a specific date."""
     try:
-        activities = fitbit_client.activities(date=date)
-        if activities and 'activities' in activities:
-            return [{
-                'name': activity['name'],
-                'duration': activity['duration'],
-                'calories': activity['calories'],
-                'distance': activity.get('distance', 0),
-                'start_time': activity['startTime']
-            } for activity in activities['activities']]
+        return parse_activities(fitbit_client.activities(date=date))
+    except RateLimitDeferred:
+        raise
     except Exception as e:
         print(f"Error fetching activities: {e}")
     return []
+
+def parse_activity_summary(activities_data):
+    """Extract steps and resting heart rate from a daily activities response."""
+    summary = (activities_data or {}).get('summary', {})
+    return {
+        'steps': summary.get('steps', 0),
+        'heart_rate': summary.get('restingHeartRate', 0)
+    }
+
+def parse_activities(activities):
+    """Extract the logged activities from a daily activities response."""
+    if activities and 'activities' in activities:
+        return [{
+            'name': activity['name'],
+            'duration': activity['duration'],
+            'calories': activity['calories'],
+            'distance': activity.get('distance', 0),
+            'start_time': activity['startTime']
+        } for activity in activities['activities']]
+    return []
+
+# Fitbit caps most date-range endpoints (sleep in particular) at 100 days per call
+MAX_RANGE_DAYS = 100
+
+# Sleep stage names (stages and classic summaries) and the fitbit_data columns they are stored in
+SLEEP_STAGE_COLUMNS = {
+    'deep': 'deep_sleep_minutes',
+    'light': 'light_sleep_minutes',
+    'rem': 'rem_sleep_minutes',
+    'wake': 'wake_minutes',
+    'awake': 'wake_minutes'
+}
+
+# Heart rate zone names as reported in the activities/heart time series
+HEART_ZONE_KEYS = {
+    'Fat Burn': 'fat_burn',
+    'Cardio': 'cardio',
+    'Peak': 'peak'
+}
+
+# Zone minutes of a day without any
+NO_ZONE_MINUTES = {'fat_burn': 0, 'cardio': 0, 'peak': 0}
+
+# Active Zone Minutes fields and the zones they count; cardio and peak minutes earn 2 AZM each
+AZM_FIELDS = {
+    'fatBurnActiveZoneMinutes': ('fat_burn', 1),
+    'cardioActiveZoneMinutes': ('cardio', 2),
+    'peakActiveZoneMinutes': ('peak', 2)
+}
+
+def _api_url(fitbit_client, path, version=None):
+    """Build a Fitbit API URL for the authenticated user."""
+    return "{0}/{1}/user/-/{2}".format(
+        fitbit_client.API_ENDPOINT,
+        version or fitbit_client.API_VERSION,
+        path
+    )
+
+def fetch_steps_range(fitbit_client, start_date, end_date):
+    """Fetch daily step totals for a date range, keyed by date string."""
+    steps_data = fitbit_client.time_series('activities/steps', base_date=start_date, end_date=end_date)
+    return parse_steps_range(steps_data)
+
+def parse_steps_range(steps_data):
+    """Extract daily step totals from an activities/steps time series, keyed by date string."""
+    return {
+        day['dateTime']: int(day['value'])
+        for day in steps_data.get('activities-steps', [])
+    }
+
+def fetch_sleep_range(fitbit_client, start_date, end_date):
+    """Fetch sleep totals and stage minutes for a date range, keyed by date string."""
+    url = _api_url(
+        fitbit_client,
+        "sleep/date/{0}/{1}.json".format(format_date(start_date), format_date(end_date)),
+        version="1.2"
+    )
+    return parse_sleep_range(fitbit_client.make_request(url))
+
+def parse_sleep_range(sleep_data):
+    """Extract sleep totals and stage minutes per day from a sleep range response, keyed by date string."""
+    sleep_logs = {}
+    for sleep in sleep_data.get('sleep', []):
+        sleep_logs.setdefault(sleep['dateOfSleep'], []).append(sleep)
+    return {date_str: sleep_fields(logs) for date_str, logs in sleep_logs.items()}
+
+def fetch_heart_range(fitbit_client, start_date, end_date):
+    """Fetch resting heart rate and heart rate zone minutes for a date range, keyed by date string."""
+    heart_data = fitbit_client.time_series('activities/heart', base_date=start_date, end_date=end_date)
+    return parse_heart_range(heart_data)
+
+def parse_heart_range(heart_data):
+    """Extract resting heart rate and zone minutes from an activities/heart time series, keyed by date string."""
+    heart_days = {}
+    for day in heart_data.get('activities-heart', []):
+        value = day.get('value', {})
+        zones = {'fat_burn': 0, 'cardio': 0, 'peak': 0}
+        for zone in value.get('heartRateZones', []):
+            key = HEART_ZONE_KEYS.get(zone.get('name'))
+            if key:
+                zones[key] = zone.get('minutes', 0)
+        heart_days[day['dateTime']] = {
+            'rhr': value.get('restingHeartRate', 0),
+            'zones': zones
+        }
+    return heart_days
+
+def fetch_azm_range(fitbit_client, start_date, end_date):
+    """Fetch minutes in each heart rate zone for a date range from the Active Zone Minutes series."""
+    url = _api_url(
+        fitbit_client,
+        "activities/active-zone-minutes/date/{0}/{1}.json".format(format_date(start_date), format_date(end_date))
+    )
+    return parse_azm_range(fitbit_client.make_request(url))
+
+def parse_azm_range(azm_data):
+    """Extract zone minutes per day from an Active Zone Minutes time series, keyed by date string.
+
+    Days without any active minutes are left out of the series by Fitbit.
+    """
+    zone_days = {}
+    for day in azm_data.get('activities-active-zone-minutes', []):
+        zones = dict(NO_ZONE_MINUTES)
+        for field, (key, azm_per_minute) in AZM_FIELDS.items():
+            zones[key] = day.get('value', {}).get(field, 0) // azm_per_minute
+        zone_days[day['dateTime']] = zones
+    return zone_days
+
+def fetch_activities_range(fitbit_client, start_date, end_date):
+    """Fetch logged activities for a date range, grouped by date string."""
+    url = _api_url(
+        fitbit_client,
+        "activities/list.json?afterDate={0}&sort=asc&offset=0&limit=100".format(format_date(start_date))
+    )
+    end_str = format_date(end_date)
+    activities = {}
+    while url:
+        activity_data = fitbit_client.make_request(url)
+        for date_str, day_activities in parse_activities_list(activity_data).items():
+            if date_str > end_str:
+                return activities
+            activities.setdefault(date_str, []).extend(day_activities)
+        url = activity_data.get('pagination', {}).get('next')
+    return activities
+
+def parse_activities_list(activity_data):
+    """Extract activities from one page of the activity list, grouped by date string."""
+    activities = {}
+    for activity in activity_data.get('activities', []):
+        # startTime is local ISO time, e.g. 2024-01-03T12:08:00.000+10:00
+        date_str, time_str = activity['startTime'][:10], activity['startTime'][11:16]
+        activities.setdefault(date_str, []).append({
+            'name': activity['activityName'],
+            'duration': activity['duration'],
+            'calories': activity['calories'],
+            'distance': activity.get('distance', 0),
+            'start_time': time_str
+        })
+    return activities
@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+import time
+import logging
+from fitbit.exceptions import HTTPTooManyRequests
+
+logger = logging.getLogger(__name__)
+
+# Fitbit allows 150 requests per user per hour
+DEFAULT_REQUESTS_PER_HOUR = 150
+
+class RateLimitDeferred(Exception):
+    """Raised when the Fitbit quota is exhausted and the work should wait for a later run."""
+
+    def __init__(self, retry_after_secs):
+        super().__init__(f"Fitbit rate limit reached, retry in {int(retry_after_secs)}s")
+        self.retry_after_secs = retry_after_secs
+
+class RateLimiter(object):
+    """Token bucket pacing Fitbit requests, kept in sync with the rate-limit headers.
+
+    The bucket refills at requests_per_hour / 3600 tokens per second and is
+    capped by the Fitbit-Rate-Limit-Remaining header of the latest response.
+    The quota is saved to state_path so the next run starts from what is
+    actually left. Waits longer than max_wait seconds raise RateLimitDeferred
+    instead of sleeping, and so does setting stop_event during a wait.
+    """
+
+    def __init__(self, state_path, requests_per_hour=DEFAULT_REQUESTS_PER_HOUR, max_wait=60, max_retries=3,
+                 stop_event=None):
+        self.state_path = state_path
+        self.stop_event = stop_event
+        self.capacity = float(requests_per_hour)
+        self.refill_rate = self.capacity / 3600
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.tokens = self.capacity
+        self.remaining = None
+        self.reset_at = 0.0
+        self.updated_at = time.time()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """Restore the quota saved by a previous run, if its window has not reset yet."""
+        if not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable rate limit state: {e}")
+            return
+        if state.get("reset_at", 0) > time.time():
+            self.remaining = state.get("remaining")
+            self.reset_at = state["reset_at"]
+            self.tokens = min(self.capacity, float(self.remaining if self.remaining is not None else self.capacity))
+            logger.info(f"Restored Fitbit quota: {self.remaining} requests left until reset")
+
+    def _save(self):
+        state = {"remaining": self.remaining, "reset_at": self.reset_at, "updated_at": time.time()}
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _refill(self, now):
+        if self.reset_at and now >= self.reset_at:
+            # The server-side window has rolled over
+            self.remaining = None
+            self.reset_at = 0.0
+            self.tokens = self.capacity
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        if self.remaining is not None:
+            self.tokens = min(self.tokens, float(self.remaining))
+        self.updated_at = now
+
+    def acquire(self):
+        """Take one request token, sleeping briefly if needed or deferring if the wait is too long."""
+        while True:
+            with self._lock:
+                now = time.time()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    if self.remaining is not None:
+                        self.remaining -= 1
+                    return
+                if self.remaining is not None and self.remaining <= 0:
+                    wait = self.reset_at - now
+                else:
+                    wait = (1 - self.tokens) / self.refill_rate
+            if wait > self.max_wait:
+                raise RateLimitDeferred(wait)
+            if self.stop_event is None:
+                time.sleep(max(wait, 0))
+            elif self.stop_event.wait(max(wait, 0)):
+                raise RateLimitDeferred(wait)
+
+    def update_from_headers(self, headers):
+        """Record the quota reported by a Fitbit response."""
+        remaining = headers.get("Fitbit-Rate-Limit-Remaining")
+        reset = headers.get("Fitbit-Rate-Limit-Reset")
+        if remaining is None or reset is None:
+            return
+        with self._lock:
+            now = time.time()
+            self.remaining = int(remaining)
+            self.reset_at = now + int(reset)
+            self.tokens = min(self.tokens, float(self.remaining))
+            self.updated_at = now
+            self._save()
+
+    def throttled(self, retry_after_secs):
+        """Record an HTTP 429: nothing is left until retry_after_secs from now."""
+        with self._lock:
+            self.remaining = 0
+            self.tokens = 0.0
+            self.reset_at = time.time() + retry_after_secs
+            self._save()
+
+    def install(self, fitbit_client):
+        """Pace and retry every request made by the client, and track its rate-limit headers."""
+        make_request = fitbit_client.make_request
+
+        def response_hook(response, *args, **kwargs):
+            self.update_from_headers(response.headers)
+
+        def scheduled_make_request(*args, **kwargs):
+            for attempt in range(self.max_retries + 1):
+                self.acquire()
+                try:
+                    return make_request(*args, **kwargs)
+                except HTTPTooManyRequests as e:
+                    retry_after = float(getattr(e, "retry_after_secs", 0) or self.max_wait + 1)
+                    self.throttled(retry_after)
+                    if retry_after > self.max_wait or attempt == self.max_retries:
+                        raise RateLimitDeferred(retry_after)
+                    # acquire() on the next attempt waits out the reset window
+                    logger.warning(f"Fitbit returned 429, backing off for {int(retry_after)}s")
+
+        fitbit_client.client.session.hooks["response"].append(response_hook)
+        fitbit_client.make_request = scheduled_make_request
+        fitbit_client.rate_limiter = self
+        return fitbit_client
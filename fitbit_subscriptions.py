@@ -0,0 +1,397 @@
+"""Push-driven sync from Fitbit subscription notifications.
+
+Fitbit POSTs a notification to the subscriber endpoint whenever a user's
+device syncs new data for a collection. Bursts of notifications for the same
+(user, date, collection) are coalesced in a debounced queue, and each job
+fetches only the collections that changed before merging them into the stored
+day row, so fresh data lands within minutes for a couple of API calls.
+
+    python fitbit_subscriptions.py subscribe --all-users
+    python fitbit_subscriptions.py serve --workers 4
+    python fitbit_subscriptions.py notify --user-id <uuid> --collection sleep --date 2024-05-01
+
+The endpoint must be reachable over HTTPS at the subscriber URL configured at
+dev.fitbit.com (e.g. behind a reverse proxy); `notify` posts a signed test
+notification to a local server.
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import sys
+import threading
+import time
+import traceback
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import cherrypy
+from fitbit_auth import load_config, get_fitbit_instance
+from fitbit_daily_data import (
+    fetch_steps_yesterday,
+    fetch_sleep_yesterday,
+    fetch_azm_range,
+    parse_activity_summary,
+    parse_activities,
+    sleep_fields,
+    NO_ZONE_MINUTES
+)
+from fitbit_rate_limit import RateLimitDeferred
+from http_transport import get_session
+from fitbit_utils import convert_str_to_date, get_yesterday_date, format_date
+from sync_metrics import get_run_report
+from supabase_utils import (
+    get_supabase_client,
+    authenticate_supabase,
+    list_fitbit_users,
+    get_fitbit_days,
+    make_fitbit_row,
+    write_days,
+    cleanup_supabase_client,
+    FITBIT_DATA_COLUMNS
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Collections the sync subscribes to; activities covers steps, resting heart rate and zone minutes
+SUBSCRIBED_COLLECTIONS = ("activities", "sleep")
+
+# Longest wait for due jobs between stop checks
+MAX_IDLE_SECS = 5
+
+def sign_notification(body, client_secret):
+    """Return the X-Fitbit-Signature value for a notification body (bytes)."""
+    digest = hmac.new((client_secret + "&").encode(), body, hashlib.sha1).digest()
+    return base64.b64encode(digest).decode()
+
+def notification_user_id(notification):
+    """Return the Supabase user ID of a notification, taken from its subscription ID."""
+    # Subscriptions are created as "<user_id>-<collection>"
+    subscription_id = notification.get("subscriptionId", "")
+    suffix = "-" + notification.get("collectionType", "")
+    return subscription_id[:-len(suffix)] if subscription_id.endswith(suffix) else subscription_id
+
+def sync_collections(fitbit_client, supabase, user_id, date_str, collections):
+    """Fetch only the changed collections for one day and merge them into the stored row."""
+    date = convert_str_to_date(date_str)
+    report = get_run_report()
+    fields = {}
+    activities_by_date = None
+    if "activities" in collections:
+        # One daily activities response holds steps, resting heart rate and logged activities
+        with report.span("fetch", data_type="Activities"):
+            activities_data = fetch_steps_yesterday(fitbit_client, date)
+        fields.update(parse_activity_summary(activities_data))
+        activities_by_date = {date_str: parse_activities(activities_data)}
+        with report.span("fetch", data_type="Active Zone Minutes"):
+            zones = fetch_azm_range(fitbit_client, date, date).get(date_str, NO_ZONE_MINUTES)
+        fields.update({f"{zone}_minutes": minutes for zone, minutes in zones.items()})
+    if "sleep" in collections:
+        with report.span("fetch", data_type="Sleep"):
+            fields.update(fetch_sleep_yesterday(fitbit_client, date) or sleep_fields([]))
+
+    # Columns of collections that did not change keep their stored values
+    stored = get_fitbit_days(supabase, user_id, [date_str]).get(date_str, {})
+    merged = {column: stored[column] for column in FITBIT_DATA_COLUMNS if stored.get(column) is not None}
+    merged.update(fields)
+    return write_days(supabase, user_id, [make_fitbit_row(user_id, date_str, **merged)], activities_by_date)
+
+class CoalescingQueue(object):
+    """Debounced job queue keyed (user_id, date, collection).
+
+    A key becomes due debounce_secs after its last notification, but never
+    later than max_delay_secs after its first, so a steady stream of
+    notifications cannot starve it.
+    """
+
+    def __init__(self, debounce_secs=60, max_delay_secs=600):
+        self.debounce_secs = debounce_secs
+        self.max_delay_secs = max_delay_secs
+        self.received = 0
+        self.coalesced = 0
+        self._due = {}
+        self._deadline = {}
+        self._cond = threading.Condition()
+
+    def put(self, key, delay=None):
+        """Queue key, or push back its due time; delay schedules a retry instead of debouncing."""
+        now = time.time()
+        with self._cond:
+            if delay is not None:
+                self._due[key] = self._deadline[key] = max(now + delay, self._due.get(key, 0))
+            elif key in self._due:
+                self.received += 1
+                self.coalesced += 1
+                self._due[key] = min(now + self.debounce_secs, self._deadline[key])
+            else:
+                self.received += 1
+                self._deadline[key] = now + self.max_delay_secs
+                self._due[key] = min(now + self.debounce_secs, self._deadline[key])
+            self._cond.notify()
+
+    def take_due(self, timeout):
+        """Wait up to timeout for keys to come due, then remove and return every due key."""
+        with self._cond:
+            now = time.time()
+            next_due = min(self._due.values(), default=now + timeout)
+            if next_due > now:
+                self._cond.wait(min(next_due - now, timeout))
+                now = time.time()
+            due = sorted(key for key, due_at in self._due.items() if due_at <= now)
+            for key in due:
+                del self._due[key]
+                del self._deadline[key]
+            return due
+
+    def __len__(self):
+        with self._cond:
+            return len(self._due)
+
+class Subscriber(object):
+    """Runs queued notification jobs on a worker pool with warm per-user Fitbit clients."""
+
+    def __init__(self, config, supabase, workers=1):
+        self.config = config
+        self.supabase = supabase
+        self.queue = CoalescingQueue(
+            config["subscriptions"]["debounce_secs"],
+            config["subscriptions"]["max_delay_secs"]
+        )
+        self.executor = ThreadPoolExecutor(max_workers=max(workers, 1))
+        self.stop_event = threading.Event()
+        self.clients = {}
+        self._user_locks = {}
+        self._lock = threading.Lock()
+        self._dispatcher = None
+
+    def notify(self, notifications):
+        """Queue a batch of notifications; returns how many were accepted."""
+        accepted = 0
+        for notification in notifications:
+            collection = notification.get("collectionType")
+            if collection == "userRevokedAccess":
+                logger.warning(f"Fitbit user {notification.get('ownerId')} revoked access")
+                continue
+            if collection not in SUBSCRIBED_COLLECTIONS or not notification.get("date"):
+                logger.debug(f"Ignoring {collection} notification")
+                continue
+            self.queue.put((notification_user_id(notification), notification["date"], collection))
+            accepted += 1
+        return accepted
+
+    def _user_lock(self, user_id):
+        with self._lock:
+            return self._user_locks.setdefault(user_id, threading.Lock())
+
+    def process(self, user_id, date_str, collections):
+        """Sync one user's day for the changed collections, requeueing it if rate limited."""
+        # One job per user at a time: they share a client, rate limiter and stored row
+        with self._user_lock(user_id):
+            if self.stop_event.is_set():
+                return
+            try:
+                client = self.clients.get(user_id)
+                if client is None:
+                    client = self.clients[user_id] = get_fitbit_instance(self.config, self.supabase, user_id)
+                else:
+                    client.response_cache.clear()
+                    client.token_manager.ensure_fresh(client)
+                result = sync_collections(client, self.supabase, user_id, date_str, collections)
+                logger.info(
+                    f"Synced {', '.join(sorted(collections))} for user {user_id} on {date_str} "
+                    f"({result['written']} row(s) written)"
+                )
+            except RateLimitDeferred as e:
+                logger.warning(f"Rate limited syncing user {user_id} on {date_str}, retrying in {e.retry_after_secs:.0f}s")
+                for collection in collections:
+                    self.queue.put((user_id, date_str, collection), delay=e.retry_after_secs)
+            except Exception as e:
+                # The nightly sync still covers the day; build a fresh client next time
+                logger.error(f"Error syncing user {user_id} on {date_str}: {type(e).__name__}")
+                logger.debug(f"Error details: {traceback.format_exc()}")
+                self.clients.pop(user_id, None)
+
+    def dispatch(self):
+        """Hand due jobs to the workers, one per (user, date) with its changed collections."""
+        while not self.stop_event.is_set():
+            due = self.queue.take_due(MAX_IDLE_SECS)
+            if not due:
+                continue
+            jobs = {}
+            for user_id, date_str, collection in due:
+                jobs.setdefault((user_id, date_str), set()).add(collection)
+            logger.info(
+                f"Running {len(jobs)} job(s) for {len(due)} collection change(s) "
+                f"({self.queue.received} notifications received, {self.queue.coalesced} coalesced so far)"
+            )
+            for (user_id, date_str), collections in sorted(jobs.items()):
+                self.executor.submit(self.process, user_id, date_str, collections)
+
+    def start(self):
+        self._dispatcher = threading.Thread(target=self.dispatch, name="subscription-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def stop(self):
+        """Stop dispatching and wait for in-flight jobs; queued ones are left to the nightly sync."""
+        if self.stop_event.is_set():
+            return
+        logger.info("Stop requested, finishing in-flight jobs...")
+        self.stop_event.set()
+        if self._dispatcher:
+            self._dispatcher.join()
+        self.executor.shutdown(wait=True)
+        if len(self.queue):
+            logger.info(f"{len(self.queue)} queued change(s) not synced; the nightly sync will pick them up")
+
+class NotificationEndpoint(object):
+    """Cherrypy handler for Fitbit's verification requests and notifications."""
+
+    def __init__(self, client_secret, verify_code, subscriber):
+        self.client_secret = client_secret
+        self.verify_code = verify_code
+        self.subscriber = subscriber
+
+    @cherrypy.expose
+    def index(self, verify=None, **params):
+        if cherrypy.request.method == "POST":
+            return self.receive()
+        # Fitbit checks the endpoint with the right code (expects 204) and a wrong one (expects 404)
+        if verify is not None and self.verify_code and hmac.compare_digest(verify, self.verify_code):
+            cherrypy.response.status = 204
+            return b""
+        raise cherrypy.NotFound()
+
+    def receive(self):
+        body = cherrypy.request.body.read()
+        signature = cherrypy.request.headers.get("X-Fitbit-Signature", "")
+        if not hmac.compare_digest(signature, sign_notification(body, self.client_secret)):
+            logger.warning("Rejecting notification with an invalid signature")
+            raise cherrypy.NotFound()
+        try:
+            notifications = json.loads(body)
+        except ValueError:
+            raise cherrypy.HTTPError(400)
+        # Fitbit expects an answer within 5 seconds, so the fetches happen later on the workers
+        self.subscriber.notify(notifications)
+        cherrypy.response.status = 204
+        return b""
+
+def subscribe_users(config, supabase, user_ids):
+    """Create an activities and a sleep subscription for each user; returns the number created."""
+    subscriber_id = config["subscriptions"]["subscriber_id"]
+    if not subscriber_id:
+        raise ValueError("FITBIT_SUBSCRIBER_ID is not set")
+    created = 0
+    for user_id in user_ids:
+        try:
+            client = get_fitbit_instance(config, supabase, user_id)
+            for collection in SUBSCRIBED_COLLECTIONS:
+                client.subscription(user_id, subscriber_id, collection=collection)
+                created += 1
+            logger.info(f"Subscribed user {user_id} to {', '.join(SUBSCRIBED_COLLECTIONS)}")
+        except Exception as e:
+            logger.error(f"Error subscribing user {user_id}: {type(e).__name__}")
+            logger.debug(f"Error details: {traceback.format_exc()}")
+    return created
+
+def post_notification(url, client_secret, notifications):
+    """Sign and POST notifications to a subscriber endpoint, as Fitbit would; returns the status code."""
+    body = json.dumps(notifications).encode()
+    response = get_session().post(url, data=body, headers={
+        "Content-Type": "application/json",
+        "X-Fitbit-Signature": sign_notification(body, client_secret)
+    })
+    return response.status_code
+
+def serve(config, supabase, workers, port):
+    """Run the subscriber endpoint until SIGINT/SIGTERM."""
+    subscriber = Subscriber(config, supabase, workers)
+    endpoint = NotificationEndpoint(
+        config["fitbit_api_keys"]["client_secret"],
+        config["subscriptions"]["verify_code"],
+        subscriber
+    )
+    cherrypy.config.update({
+        "server.socket_host": "0.0.0.0",
+        "server.socket_port": port,
+        "engine.autoreload.on": False,
+        "checker.on": False
+    })
+    cherrypy.tree.mount(endpoint, "/")
+    cherrypy.engine.subscribe("stop", subscriber.stop)
+    cherrypy.engine.signals.subscribe()
+    subscriber.start()
+    cherrypy.engine.start()
+    cherrypy.engine.block()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Sync Fitbit data as subscription notifications arrive.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="run the subscriber endpoint")
+    serve_parser.add_argument("--port", type=int, default=None, help="listen port (default: FITBIT_SUBSCRIBER_PORT)")
+    serve_parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="number of jobs run in parallel (default: FITBIT_USER_CONCURRENCY)"
+    )
+
+    subscribe_parser = commands.add_parser("subscribe", help="subscribe users to activities and sleep notifications")
+    group = subscribe_parser.add_mutually_exclusive_group()
+    group.add_argument("--user-id", help="user to subscribe (default: the signed-in user)")
+    group.add_argument("--all-users", action="store_true", help="subscribe every user with a row in fitbit_tokens")
+
+    notify_parser = commands.add_parser("notify", help="post a signed test notification to a subscriber endpoint")
+    notify_parser.add_argument("--url", default=None, help="endpoint URL (default: http://127.0.0.1:<port>/)")
+    notify_parser.add_argument("--user-id", required=True, help="user the notification is for")
+    notify_parser.add_argument(
+        "--collection",
+        choices=SUBSCRIBED_COLLECTIONS,
+        action="append",
+        help="changed collection (repeatable, default: all)"
+    )
+    notify_parser.add_argument("--date", help="changed date (YYYY-MM-DD, default: yesterday)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = load_config()
+
+    if args.command == "notify":
+        url = args.url or f"http://127.0.0.1:{config['subscriptions']['port']}/"
+        date_str = args.date or format_date(get_yesterday_date())
+        notifications = [{
+            "collectionType": collection,
+            "date": date_str,
+            "ownerId": "-",
+            "ownerType": "user",
+            "subscriptionId": f"{args.user_id}-{collection}"
+        } for collection in args.collection or SUBSCRIBED_COLLECTIONS]
+        status = post_notification(url, config["fitbit_api_keys"]["client_secret"], notifications)
+        logger.info(f"Endpoint answered {status}")
+        return 0 if status == 204 else 1
+
+    supabase = get_supabase_client()
+    try:
+        if args.command == "subscribe":
+            if args.all_users:
+                user_ids = list_fitbit_users(supabase)
+            else:
+                user_ids = [args.user_id or authenticate_supabase(supabase)]
+            created = subscribe_users(config, supabase, user_ids)
+            return 0 if created == len(user_ids) * len(SUBSCRIBED_COLLECTIONS) else 1
+
+        serve(
+            config,
+            supabase,
+            args.workers or config["sync"]["user_concurrency"],
+            args.port or config["subscriptions"]["port"]
+        )
+        return 0
+    finally:
+        cleanup_supabase_client()
+
+if __name__ == "__main__":
+    sys.exit(main())
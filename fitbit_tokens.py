@@ -0,0 +1,233 @@
+import json
+import os
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from fitbit.api import FitbitOauth2Client
+from fitbit.exceptions import HTTPUnauthorized
+from oauthlib.oauth2 import InvalidGrantError
+from supabase_utils import get_fitbit_tokens, update_fitbit_tokens, swap_fitbit_tokens
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Refresh tokens that expire within this many seconds before using them
+REFRESH_MARGIN_SECS = 600
+
+class TokenManager(object):
+    """Loads, caches and refreshes one user's Fitbit tokens.
+
+    Tokens are cached in <cache_dir>/<user_id>.json, encrypted with a key
+    derived from `secret` like the Supabase session, and used without a
+    database round trip until shortly before they expire. Refreshes happen under a file
+    lock, and the stored row is only replaced if it still holds the refresh
+    token we started from (compare-and-swap), so parallel runs cannot
+    invalidate each other's tokens.
+    """
+
+    def __init__(self, supabase, user_id, cache_dir, secret):
+        self.supabase = supabase
+        self.user_id = user_id
+        self.secret = secret.encode("utf8")
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_path = os.path.join(cache_dir, f"{user_id}.json")
+        self.lock_path = os.path.join(cache_dir, f"{user_id}.lock")
+        self.tokens = None
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+
+    @staticmethod
+    def _from_row(row):
+        return {
+            "access_token": row["access_token"],
+            "refresh_token": row["refresh_token"],
+            "expires_at": float(row.get("fitbit_expires_at") or row.get("expires_at") or 0)
+        }
+
+    def _read_cache(self):
+        # cryptography is only loaded once tokens are actually read, not on import
+        from cryptography.fernet import InvalidToken
+        from supabase_session import unseal
+        try:
+            with open(self.cache_path) as f:
+                return unseal(json.load(f), self.secret)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, InvalidToken) as e:
+            # Includes plaintext caches from older versions; they are replaced on the next write
+            logger.warning(f"Ignoring unreadable Fitbit token cache: {type(e).__name__}")
+            return None
+
+    def _write_cache(self, tokens):
+        from supabase_session import write_sealed
+        write_sealed(self.cache_path, tokens, self.secret)
+
+    def _clear_cache(self):
+        try:
+            os.remove(self.cache_path)
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def _locked(self):
+        """Hold the in-process lock and, where available, an exclusive file lock.
+
+        Re-entrant: the refresh callback runs while ensure_fresh holds the lock.
+        """
+        with self._lock:
+            if fcntl is None or self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            with open(self.lock_path, "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def is_fresh(tokens):
+        return tokens is not None and tokens.get("expires_at", 0) - time.time() > REFRESH_MARGIN_SECS
+
+    def load(self):
+        """Return usable tokens, from the local cache when possible, otherwise from Supabase."""
+        tokens = self._read_cache()
+        if self.is_fresh(tokens):
+            logger.info("Using cached Fitbit tokens")
+            self.tokens = tokens
+            return tokens
+
+        row = get_fitbit_tokens(self.supabase, self.user_id)
+        if not row:
+            return None
+        self.tokens = self._from_row(row)
+        self._write_cache(self.tokens)
+        return self.tokens
+
+    def ensure_fresh(self, fitbit_client):
+        """Refresh the client's tokens if they are about to expire."""
+        if self.is_fresh(self.tokens):
+            return
+        with self._locked():
+            # Another thread may have refreshed while we waited for the lock
+            if self.is_fresh(self.tokens):
+                fitbit_client.client.session.token = dict(self.tokens)
+                return
+            # Another run may have refreshed while we waited for the lock, or before our cache was written
+            row = get_fitbit_tokens(self.supabase, self.user_id)
+            if row and (self.tokens is None or self._from_row(row)["refresh_token"] != self.tokens["refresh_token"]):
+                self.tokens = self._from_row(row)
+                self._write_cache(self.tokens)
+                fitbit_client.client.session.token = dict(self.tokens)
+                logger.info("Using Fitbit tokens refreshed by another run")
+            if self.is_fresh(self.tokens):
+                return
+            logger.info("Fitbit tokens are about to expire, refreshing")
+            self._refresh(fitbit_client)
+
+    def refresh(self, fitbit_client):
+        """Refresh after Fitbit reported the access token expired, unless another thread already replaced it."""
+        rejected = fitbit_client.client.session.token.get("access_token")
+        with self._locked():
+            if self.tokens and self.tokens["access_token"] != rejected:
+                fitbit_client.client.session.token = dict(self.tokens)
+                return
+            logger.info("Fitbit reported the access token expired, refreshing")
+            self._refresh(fitbit_client)
+
+    def _refresh(self, fitbit_client):
+        """Spend the refresh token; callers hold the lock. The client's refresh callback calls store()."""
+        try:
+            # The class method, since install() routes the client's own refresh_token through refresh()
+            FitbitOauth2Client.refresh_token(fitbit_client.client)
+        except InvalidGrantError:
+            # The grant was revoked; never start from these tokens again
+            self._clear_cache()
+            raise
+
+    def reload(self, fitbit_client):
+        """Drop the cached tokens and take the stored row, e.g. after Fitbit rejected ours.
+
+        Returns False if the stored row holds the same tokens, so retrying with
+        them would be rejected again.
+        """
+        with self._locked():
+            self._clear_cache()
+            row = get_fitbit_tokens(self.supabase, self.user_id)
+            if not row:
+                return False
+            tokens = self._from_row(row)
+            if self.tokens and tokens["access_token"] == self.tokens["access_token"] \
+                    and tokens["refresh_token"] == self.tokens["refresh_token"]:
+                return False
+            self.tokens = tokens
+            self._write_cache(tokens)
+            fitbit_client.client.session.token = dict(tokens)
+            logger.info("Reloaded Fitbit tokens from Supabase")
+            return True
+
+    def install(self, fitbit_client):
+        """Keep the client's tokens fresh, and retry a request once with the stored tokens if ours are rejected.
+
+        A 401 or a revoked grant usually means the cached tokens are stale (for
+        example another process refreshed them), so the cache is dropped either way.
+        Every refresh runs under the lock: the session's own auto-refresh is
+        turned off, and the client's refresh on an expired_token 401 goes
+        through refresh(), so concurrent fetch threads spend the single-use
+        refresh token once.
+        """
+        make_request = fitbit_client.make_request
+        oauth_client = fitbit_client.client
+        oauth_client.session.auto_refresh_url = None
+        oauth_client.refresh_token = lambda: self.refresh(fitbit_client)
+
+        def authorized_make_request(*args, **kwargs):
+            try:
+                self.ensure_fresh(fitbit_client)
+                return make_request(*args, **kwargs)
+            except (HTTPUnauthorized, InvalidGrantError) as e:
+                logger.warning(f"Fitbit rejected the tokens ({type(e).__name__}), reloading them from Supabase")
+                if not self.reload(fitbit_client):
+                    raise
+            self.ensure_fresh(fitbit_client)
+            return make_request(*args, **kwargs)
+
+        fitbit_client.make_request = authorized_make_request
+        fitbit_client.token_manager = self
+        return fitbit_client
+
+    def store(self, new_tokens):
+        """Persist refreshed tokens; used as the Fitbit client's refresh callback."""
+        with self._locked():
+            previous_refresh_token = self.tokens["refresh_token"] if self.tokens else None
+            tokens = {
+                "access_token": new_tokens["access_token"],
+                "refresh_token": new_tokens["refresh_token"],
+                "expires_at": float(new_tokens["expires_at"])
+            }
+            if previous_refresh_token is None:
+                update_fitbit_tokens(
+                    self.supabase, self.user_id, tokens["access_token"], tokens["refresh_token"], tokens["expires_at"]
+                )
+            elif not swap_fitbit_tokens(
+                self.supabase, self.user_id, previous_refresh_token,
+                tokens["access_token"], tokens["refresh_token"], tokens["expires_at"]
+            ):
+                logger.warning("Stored Fitbit tokens changed during refresh, keeping the newer row")
+                row = get_fitbit_tokens(self.supabase, self.user_id)
+                if row:
+                    tokens = self._from_row(row)
+            self.tokens = tokens
+            self._write_cache(tokens)
+            logger.info("Fitbit tokens stored")
@@ -1,6 +1,6 @@
 import datetime
+import os
 from datetime import timedelta
-import pytz
 
 def calculate_sleep_metrics(sleep_data):
     # Extract metrics from the API response
@@ -15,23 +15,56 @@ def calculate_sleep_metrics(sleep_data):
 
     return formatted_sleep_time
 
+# Timezone whose day boundaries are used when a user's own timezone is not known
+DEFAULT_TIMEZONE = 'Australia/Sydney'
+
+def get_local_now(tz=None):
+    """Get current time in the named timezone (AEST by default)."""
+    import pytz
+    return datetime.datetime.now(pytz.timezone(tz or DEFAULT_TIMEZONE))
+
 def get_aest_now():
     """Get current time in AEST timezone."""
-    aest = pytz.timezone('Australia/Sydney')
-    return datetime.datetime.now(aest)
+    return get_local_now()
 
-def get_yesterday_date():
-    """Get yesterday's date in AEST timezone."""
-    now = get_aest_now()
+def get_yesterday_date(tz=None):
+    """Get yesterday's date in the named timezone (AEST by default)."""
+    now = get_local_now(tz)
     yesterday = now.date() - timedelta(days=1)
     return yesterday
 
-def get_todays_date():
-    """Get today's date in AEST timezone."""
-    return get_aest_now().date()
+def get_todays_date(tz=None):
+    """Get today's date in the named timezone (AEST by default)."""
+    return get_local_now(tz).date()
 
 def convert_str_to_date(date_str):
     """Convert string to date in AEST timezone."""
-    aest = pytz.timezone('Australia/Sydney')
     date = datetime.datetime.strptime(date_str, "%Y-%m-%d").date()
-    return date
\ No newline at end of file
+    return date
+
+def format_date(date):
+    """Format a date as the YYYY-MM-DD string used by Fitbit and Supabase."""
+    return date.strftime('%Y-%m-%d')
+
+def iter_dates(start_date, end_date):
+    """Yield every date from start_date to end_date inclusive."""
+    current = start_date
+    while current <= end_date:
+        yield current
+        current += timedelta(days=1)
+
+def split_date_range(start_date, end_date, max_days):
+    """Split an inclusive date range into chunks of at most max_days days."""
+    chunks = []
+    chunk_start = start_date
+    while chunk_start <= end_date:
+        chunk_end = min(chunk_start + timedelta(days=max_days - 1), end_date)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end + timedelta(days=1)
+    return chunks
+
+def get_state_dir():
+    """Return the directory used for state kept between runs, creating it if needed."""
+    state_dir = os.getenv("FITBIT_STATE_DIR", ".fitbit_state")
+    os.makedirs(state_dir, exist_ok=True)
+    return state_dir
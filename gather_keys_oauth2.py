@@ -6,7 +6,7 @@ import webbrowser
 from oauthlib.oauth2 import WebApplicationClient
 from requests_oauthlib import OAuth2Session
 from requests.auth import HTTPBasicAuth
-import requests
+from http_transport import get_session
 
 class OAuth2Server(object):
     def __init__(self, client_id, client_secret, redirect_uri="http://127.0.0.1:8080/"):
@@ -36,7 +36,7 @@ class OAuth2Server(object):
         }
         auth = HTTPBasicAuth(self.client_id, self.client_secret)
 
-        response = requests.post(token_url, data=data, auth=auth, headers={
+        response = get_session().post(token_url, data=data, auth=auth, headers={
             'Content-Type': 'application/x-www-form-urlencoded'
         })
 
@@ -0,0 +1,90 @@
+import numpy as np
+
+# Zones counted towards active zone minutes, in ascending order
+ZONE_NAMES = ('Fat Burn', 'Cardio', 'Peak')
+ZONE_KEYS = ('fat_burn', 'cardio', 'peak')
+
+# Lower bounds (bpm) used when a response carries no heartRateZones
+DEFAULT_ZONE_BOUNDARIES = (100, 120, 140)
+
+# Longest gap (seconds) a single 1sec sample is allowed to stand for
+MAX_SAMPLE_SECONDS = 60
+
+def zone_boundaries(heart_rate_zones):
+    """Return the Fat Burn, Cardio and Peak lower bounds from a heartRateZones list."""
+    zones_by_name = {zone.get('name'): zone for zone in heart_rate_zones or []}
+    try:
+        return tuple(int(zones_by_name[name]['min']) for name in ZONE_NAMES)
+    except (KeyError, TypeError, ValueError):
+        return DEFAULT_ZONE_BOUNDARIES
+
+def dataset_to_arrays(dataset):
+    """Convert an intraday dataset to (seconds since midnight, bpm) arrays."""
+    if not dataset:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int16)
+    values = np.fromiter((sample['value'] for sample in dataset), dtype=np.int16, count=len(dataset))
+    # Times are fixed-width "HH:MM:SS" strings, so parse all of them at once as digits
+    digits = np.frombuffer(
+        ''.join(sample['time'] for sample in dataset).encode('ascii'), dtype=np.uint8
+    ).reshape(-1, 8).astype(np.int32) - ord('0')
+    seconds = (digits[:, 0] * 10 + digits[:, 1]) * 3600 \
+        + (digits[:, 3] * 10 + digits[:, 4]) * 60 \
+        + digits[:, 6] * 10 + digits[:, 7]
+    return seconds, values
+
+def sample_minutes(seconds, detail_level):
+    """Return how many minutes each sample stands for."""
+    if detail_level != '1sec':
+        return np.ones(len(seconds), dtype=np.float64)
+    # 1sec data is irregular: each sample lasts until the next one, within reason
+    durations = np.diff(seconds, append=seconds[-1] + 1) if len(seconds) else seconds
+    return np.clip(durations, 0, MAX_SAMPLE_SECONDS) / 60.0
+
+def zone_minutes_many(days, detail_level='1min'):
+    """Count minutes in each zone for many days in a single vectorized pass.
+
+    `days` is a sequence of (dataset, heart_rate_zones) pairs as found in an
+    activities/heart intraday response. Returns an (n_days, 3) array of Fat Burn,
+    Cardio and Peak minutes, each day binned against its own zone boundaries.
+    """
+    n_days = len(days)
+    if n_days == 0:
+        return np.zeros((0, len(ZONE_KEYS)))
+
+    boundaries = np.array([zone_boundaries(zones) for _, zones in days], dtype=np.int16)
+    arrays = [dataset_to_arrays(dataset) for dataset, _ in days]
+    day_index = np.repeat(np.arange(n_days), [len(values) for _, values in arrays])
+    values = np.concatenate([values for _, values in arrays])
+    weights = np.concatenate([sample_minutes(seconds, detail_level) for seconds, _ in arrays])
+
+    # Boundaries are ascending, so the number passed is the zone index (0 = below Fat Burn)
+    zone_index = (values[:, None] >= boundaries[day_index]).sum(axis=1)
+    totals = np.bincount(
+        day_index * (len(ZONE_KEYS) + 1) + zone_index,
+        weights=weights,
+        minlength=n_days * (len(ZONE_KEYS) + 1)
+    ).reshape(n_days, len(ZONE_KEYS) + 1)
+    return totals[:, 1:]
+
+def zone_minutes(dataset, heart_rate_zones, detail_level='1min'):
+    """Count minutes in each zone for one day, returned as a fat_burn/cardio/peak dict."""
+    totals = zone_minutes_many([(dataset, heart_rate_zones)], detail_level)[0]
+    return {key: int(round(total)) for key, total in zip(ZONE_KEYS, totals)}
+
+def zone_minutes_for_responses(heart_responses, detail_level='1min'):
+    """Count zone minutes for many activities/heart intraday responses at once.
+
+    Each response is binned against the heartRateZones it carries. Returns one
+    fat_burn/cardio/peak dict per response, in order.
+    """
+    days = []
+    for heart_data in heart_responses:
+        summary = (heart_data.get('activities-heart') or [{}])[0]
+        days.append((
+            heart_data.get('activities-heart-intraday', {}).get('dataset', []),
+            summary.get('value', {}).get('heartRateZones')
+        ))
+    return [
+        {key: int(round(total)) for key, total in zip(ZONE_KEYS, totals)}
+        for totals in zone_minutes_many(days, detail_level)
+    ]
@@ -0,0 +1,173 @@
+"""Shared HTTP transport for every requests-based client of the sync.
+
+One HTTPAdapter is mounted on each Fitbit client's OAuth2 session and on a
+plain shared session (token exchange, test notifications), so connections to
+a host are kept alive and reused across users and runs of a long-lived
+process instead of paying a TLS handshake per client. The adapter applies
+default timeouts, retries requests that could not connect, asks for gzip, and revalidates GETs that came with an ETag or
+Last-Modified header instead of downloading them again.
+
+Settings come from the environment: HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT,
+HTTP_RETRIES, HTTP_POOL_SIZE and HTTP_CONDITIONAL_CACHE_SIZE (0 turns
+conditional requests off).
+"""
+import hashlib
+import os
+import threading
+import logging
+from collections import OrderedDict
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+from sync_metrics import get_run_report
+
+logger = logging.getLogger(__name__)
+
+def load_transport_config():
+    """Load HTTP transport settings from environment variables."""
+    return {
+        "connect_timeout": float(os.getenv("HTTP_CONNECT_TIMEOUT", "10")),
+        "read_timeout": float(os.getenv("HTTP_READ_TIMEOUT", "30")),
+        "retries": int(os.getenv("HTTP_RETRIES", "3")),
+        # Connections kept per host; cover user workers x fetch concurrency
+        "pool_size": int(os.getenv("HTTP_POOL_SIZE", "32")),
+        "conditional_cache_size": int(os.getenv("HTTP_CONDITIONAL_CACHE_SIZE", "256"))
+    }
+
+class ConditionalCache(object):
+    """Bounded LRU of GET responses that carried an ETag or Last-Modified validator.
+
+    Entries are keyed on the URL and a hash of the Authorization header, so one
+    user's response is never revived for another.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(request):
+        auth = request.headers.get("Authorization", "")
+        return request.url, hashlib.sha256(auth.encode()).hexdigest() if auth else ""
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def store(self, key, response):
+        """Keep a 200 response if it can be revalidated later."""
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if not (etag or last_modified):
+            return
+        entry = {
+            "etag": etag,
+            "last_modified": last_modified,
+            "headers": CaseInsensitiveDict(response.headers),
+            "content": response.content
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+class TransportAdapter(HTTPAdapter):
+    """Pooled keep-alive adapter with default timeouts, connection retries and conditional GETs."""
+
+    def __init__(self, timeout, conditional_cache=None, **kwargs):
+        self.timeout = timeout
+        self.conditional_cache = conditional_cache
+        super().__init__(**kwargs)
+
+    def send(self, request, stream=False, timeout=None, **kwargs):
+        timeout = timeout if timeout is not None else self.timeout
+        key = entry = None
+        if self.conditional_cache is not None and request.method == "GET" and not stream:
+            key = self.conditional_cache.make_key(request)
+            entry = self.conditional_cache.get(key)
+            if entry is not None:
+                if entry["etag"]:
+                    request.headers["If-None-Match"] = entry["etag"]
+                if entry["last_modified"]:
+                    request.headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = super().send(request, stream=stream, timeout=timeout, **kwargs)
+
+        if key is None:
+            return response
+        if response.status_code == 304 and entry is not None:
+            return self._revive(entry, response)
+        if response.status_code == 200:
+            self.conditional_cache.store(key, response)
+        return response
+
+    @staticmethod
+    def _revive(entry, response):
+        """Turn a 304 into the cached 200, keeping the fresh headers (e.g. rate limits)."""
+        headers = CaseInsensitiveDict(entry["headers"])
+        headers.update(response.headers)
+        response.status_code = 200
+        response.reason = "OK"
+        response.headers = headers
+        response._content = entry["content"]
+        get_run_report().increment("http_not_modified_total")
+        return response
+
+# Process-wide adapter and session, created on first use
+_adapter = None
+_session = None
+_lock = threading.Lock()
+
+def get_adapter() -> TransportAdapter:
+    """Return the shared adapter, building it from the environment on first use."""
+    global _adapter
+    with _lock:
+        if _adapter is None:
+            config = load_transport_config()
+            # Only retry requests that never reached the server: anything that did
+            # counts against the Fitbit quota, so responses (5xx, 429 and their
+            # Retry-After) are left to the rate limiter and its max wait
+            retries = Retry(
+                total=config["retries"],
+                connect=config["retries"],
+                read=False,
+                status=0,
+                other=0,
+                redirect=False,
+                backoff_factor=0.5,
+                raise_on_status=False
+            )
+            cache_size = config["conditional_cache_size"]
+            _adapter = TransportAdapter(
+                timeout=(config["connect_timeout"], config["read_timeout"]),
+                conditional_cache=ConditionalCache(cache_size) if cache_size > 0 else None,
+                pool_connections=4,
+                pool_maxsize=config["pool_size"],
+                max_retries=retries
+            )
+        return _adapter
+
+def mount(session):
+    """Route a requests session (e.g. a client's OAuth2Session) through the shared adapter."""
+    adapter = get_adapter()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # requests already offers gzip; make it explicit so no client drops it
+    session.headers["Accept-Encoding"] = "gzip, deflate"
+    return session
+
+def get_session() -> requests.Session:
+    """Return the shared session for requests outside a Fitbit client, e.g. the token exchange."""
+    global _session
+    if _session is None:
+        session = mount(requests.Session())
+        with _lock:
+            if _session is None:
+                _session = session
+    return _session
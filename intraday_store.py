@@ -0,0 +1,143 @@
+import base64
+import os
+import re
+import threading
+import zlib
+import logging
+from datetime import date as date_type
+import numpy as np
+from fitbit_cache import ResponseCache
+from heart_zones import dataset_to_arrays
+
+logger = logging.getLogger(__name__)
+
+MINUTES_PER_DAY = 1440
+DAYS_PER_YEAR_FILE = 366
+
+# Encoding name stored alongside uploaded series
+ENCODING = "int16-delta-zlib"
+
+INTRADAY_HEART_PATH = re.compile(r"/activities/heart/date/(\d{4}-\d{2}-\d{2})/1d/1min\.json$")
+
+def encode_day(values):
+    """Delta-encode one day of per-minute bpm values (0 = no reading) as int16."""
+    return np.diff(values.astype(np.int16), prepend=np.int16(0)).astype(np.int16)
+
+def decode_days(deltas):
+    """Decode delta-encoded rows back to per-minute bpm values."""
+    return np.cumsum(deltas, axis=-1, dtype=np.int16)
+
+def dataset_to_minutes(dataset):
+    """Place a 1min intraday dataset on a fixed 1,440-minute grid, 0 where there is no reading."""
+    seconds, values = dataset_to_arrays(dataset)
+    minutes = np.zeros(MINUTES_PER_DAY, dtype=np.int16)
+    minutes[seconds // 60] = values
+    return minutes
+
+class IntradayStore(object):
+    """Per-user store of 1-minute heart rate series.
+
+    Each year is one .npy file of shape (366, 1440) holding int16 delta-encoded
+    rows (about 2.8 KB a day against roughly 45 KB of JSON). Files are opened as
+    memory maps, so a range read only touches the days it returns.
+    """
+
+    def __init__(self, store_dir, user_id):
+        self.user_dir = os.path.join(store_dir, user_id)
+        os.makedirs(self.user_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # Days written since they were last handed out by take_new_dates()
+        self._new_dates = set()
+
+    def _path(self, year):
+        return os.path.join(self.user_dir, f"heart_{year}.npy")
+
+    def _open(self, year, writable=False):
+        path = self._path(year)
+        if os.path.exists(path):
+            return np.load(path, mmap_mode="r+" if writable else "r")
+        if not writable:
+            return None
+        return np.lib.format.open_memmap(
+            path, mode="w+", dtype=np.int16, shape=(DAYS_PER_YEAR_FILE, MINUTES_PER_DAY)
+        )
+
+    def install(self, fitbit_client):
+        """Store every 1min intraday heart response the client receives."""
+        make_request = fitbit_client.make_request
+
+        def storing_make_request(url, *args, **kwargs):
+            response = make_request(url, *args, **kwargs)
+            match = INTRADAY_HEART_PATH.search(ResponseCache.make_key(url))
+            if match and isinstance(response, dict):
+                dataset = response.get('activities-heart-intraday', {}).get('dataset')
+                if dataset:
+                    try:
+                        self.write_day(date_type.fromisoformat(match.group(1)), dataset)
+                    except (OSError, ValueError) as e:
+                        logger.warning(f"Could not store intraday heart rate: {e}")
+            return response
+
+        fitbit_client.make_request = storing_make_request
+        fitbit_client.intraday_store = self
+        return fitbit_client
+
+    def write_day(self, date, dataset):
+        """Store one day's 1min intraday dataset."""
+        encoded = encode_day(dataset_to_minutes(dataset))
+        with self._lock:
+            days = self._open(date.year, writable=True)
+            days[date.timetuple().tm_yday - 1] = encoded
+            days.flush()
+            self._new_dates.add(date)
+
+    def take_new_dates(self):
+        """Return the days written since the last call, in order, and forget them."""
+        with self._lock:
+            dates, self._new_dates = sorted(self._new_dates), set()
+        return dates
+
+    def put_back_dates(self, dates):
+        """Hand days from take_new_dates() back, e.g. when their upload failed."""
+        with self._lock:
+            self._new_dates.update(dates)
+
+    def has_day(self, date):
+        """Return True if any reading is stored for date."""
+        days = self._open(date.year)
+        # A delta-encoded row is all zeros exactly when the day has no readings
+        return days is not None and bool(days[date.timetuple().tm_yday - 1].any())
+
+    def read_range(self, start_date, end_date):
+        """Return per-minute bpm for every day from start_date to end_date as an (n_days, 1440) array."""
+        rows = []
+        year = start_date.year
+        while year <= end_date.year:
+            first = max(start_date, date_type(year, 1, 1))
+            last = min(end_date, date_type(year, 12, 31))
+            n_days = (last - first).days + 1
+            days = self._open(year)
+            if days is None:
+                rows.append(np.zeros((n_days, MINUTES_PER_DAY), dtype=np.int16))
+            else:
+                start = first.timetuple().tm_yday - 1
+                rows.append(decode_days(days[start:start + n_days]))
+            year += 1
+        if not rows:
+            return np.zeros((0, MINUTES_PER_DAY), dtype=np.int16)
+        return np.concatenate(rows)
+
+    def upload_rows(self, user_id, dates):
+        """Build zlib-compressed, base64-encoded fitbit_intraday_heart rows for the given days, skipping empty ones."""
+        rows = []
+        for date in dates:
+            values = self.read_range(date, date)[0]
+            if not values.any():
+                continue
+            rows.append({
+                "user_id": user_id,
+                "date": date.isoformat(),
+                "encoding": ENCODING,
+                "data": base64.b64encode(zlib.compress(encode_day(values).tobytes())).decode("ascii")
+            })
+        return rows
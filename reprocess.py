@@ -0,0 +1,251 @@
+import argparse
+import os
+import re
+import sys
+import logging
+from urllib.parse import parse_qsl, urlencode, urlsplit
+from fitbit_auth import load_config
+from fitbit_archive import ResponseArchive
+from fitbit_utils import convert_str_to_date, format_date, iter_dates
+from fitbit_daily_data import (
+    parse_sleep_fields,
+    sleep_fields,
+    parse_rhr,
+    parse_activities,
+    parse_steps_range,
+    parse_sleep_range,
+    parse_heart_range,
+    parse_azm_range,
+    parse_activities_list,
+    NO_ZONE_MINUTES
+)
+from heart_zones import zone_minutes_for_responses
+from supabase_utils import (
+    get_supabase_client,
+    authenticate_supabase,
+    write_days,
+    ingest_activities,
+    make_fitbit_row,
+    cleanup_supabase_client
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Day rows (and their activities) are written in batches of this many days
+UPSERT_BATCH_DAYS = 500
+
+# Every field group a day needs before its row can be rebuilt without guessing
+REQUIRED_FIELDS = ("steps", "heart_rate", "sleep", "fat_burn_minutes")
+
+DATE = r"(\d{4}-\d{2}-\d{2})"
+
+def _zone_fields(zones):
+    return {
+        "fat_burn_minutes": zones.get('fat_burn', 0),
+        "cardio_minutes": zones.get('cardio', 0),
+        "peak_minutes": zones.get('peak', 0)
+    }
+
+def _range_dates(match):
+    """Every date string from the start to the end date of a matched range path."""
+    start, end = convert_str_to_date(match.group(1)), convert_str_to_date(match.group(2))
+    return [format_date(date) for date in iter_dates(start, end)]
+
+def _steps_range(match, response):
+    return {date_str: {"steps": steps} for date_str, steps in parse_steps_range(response).items()}, {}
+
+def _heart_range(match, response):
+    return {
+        date_str: {"heart_rate": day['rhr'], **_zone_fields(day['zones'])}
+        for date_str, day in parse_heart_range(response).items()
+    }, {}
+
+def _azm_range(match, response):
+    # Fitbit leaves days without active minutes out of the series; the live sync stores zeros for them
+    zone_days = {date_str: NO_ZONE_MINUTES for date_str in _range_dates(match)}
+    zone_days.update(parse_azm_range(response))
+    return {date_str: _zone_fields(zones) for date_str, zones in zone_days.items()}, {}
+
+def _sleep_range(match, response):
+    # Days without a sleep log are complete with zero minutes, as the live sync stores them
+    days = {date_str: sleep_fields([]) for date_str in _range_dates(match)}
+    days.update(parse_sleep_range(response))
+    return days, {}
+
+def _sleep_day(match, response):
+    # A day without sleep still counts as complete, with zero minutes
+    return {match.group(1): parse_sleep_fields(response) or sleep_fields([])}, {}
+
+def _activities_day(match, response):
+    steps = response.get('summary', {}).get('steps', 0)
+    return {match.group(1): {"steps": steps}}, {match.group(1): parse_activities(response)}
+
+# Archived request paths and how to turn their responses into per-day values.
+# Intraday heart responses are handled separately so their zones are binned in one pass.
+PATH_HANDLERS = [
+    (re.compile(rf"/activities/active-zone-minutes/date/{DATE}/{DATE}\.json$"), _azm_range),
+    (re.compile(rf"/activities/steps/date/{DATE}/{DATE}\.json$"), _steps_range),
+    (re.compile(rf"/activities/heart/date/{DATE}/{DATE}\.json$"), _heart_range),
+    (re.compile(rf"/sleep/date/{DATE}/{DATE}\.json$"), _sleep_range),
+    (re.compile(rf"/sleep/date/{DATE}\.json$"), _sleep_day),
+    (re.compile(rf"/activities/date/{DATE}\.json$"), _activities_day)
+]
+INTRADAY_HEART_PATH = re.compile(rf"/activities/heart/date/{DATE}/1d/1min(?:/.*)?\.json$")
+ACTIVITY_LIST_PATH = re.compile(r"/activities/list\.json")
+
+def _list_page(path):
+    """Split an activity list path into the key shared by every page of one fetch and the page offset."""
+    parts = urlsplit(path)
+    query = parse_qsl(parts.query)
+    offset = int(dict(query).get("offset", 0))
+    return parts.path + "?" + urlencode(sorted((k, v) for k, v in query if k != "offset")), offset
+
+def _activity_list_fetches(pages):
+    """Merge archived activity list pages into one update per list fetch.
+
+    pages holds (fetched_at, path, response) records. Pages of one fetch share
+    their path apart from the offset, and a fetch starts again at offset 0. A
+    day split across pages keeps the activities of all of them. When a fetch
+    stopped with more pages left, its last day may continue on a page that was
+    never fetched, so that day is left out rather than replacing a complete one.
+    """
+    fetches = {}
+    for fetched_at, path, response in sorted(pages, key=lambda page: page[0]):
+        key, offset = _list_page(path)
+        runs = fetches.setdefault(key, [])
+        if offset == 0 or not runs:
+            runs.append([])
+        runs[-1].append((fetched_at, response))
+
+    updates = []
+    for runs in fetches.values():
+        for run in runs:
+            activities = {}
+            for _, response in run:
+                for date_str, day_activities in parse_activities_list(response).items():
+                    activities.setdefault(date_str, []).extend(day_activities)
+            if run[-1][1].get('pagination', {}).get('next') and activities:
+                del activities[max(activities)]
+            updates.append((run[0][0], {}, activities))
+    return updates
+
+def rebuild_days(records, start_date=None, end_date=None):
+    """Rebuild per-day field values and activities from archived records.
+
+    When several records cover the same day the most recently fetched value wins,
+    except that Active Zone Minutes always win over zones from heart series. A
+    day's activities come whole from the latest complete fetch that covers it.
+    Returns (fields_by_date, activities_by_date).
+    """
+    updates = []
+    azm_updates = []
+    intraday = []
+    list_pages = []
+    for record in records:
+        path, response = record["path"], record["response"]
+        match = INTRADAY_HEART_PATH.search(path)
+        if match:
+            intraday.append((record["fetched_at"], match.group(1), response))
+            continue
+        if ACTIVITY_LIST_PATH.search(path):
+            list_pages.append((record["fetched_at"], path, response))
+            continue
+        for pattern, handler in PATH_HANDLERS:
+            match = pattern.search(path)
+            if match:
+                fields, activities = handler(match, response)
+                (azm_updates if handler is _azm_range else updates).append((record["fetched_at"], fields, activities))
+                break
+
+    updates.extend(_activity_list_fetches(list_pages))
+
+    zones = zone_minutes_for_responses([response for _, _, response in intraday])
+    for (fetched_at, date_str, response), day_zones in zip(intraday, zones):
+        updates.append((fetched_at, {date_str: {"heart_rate": parse_rhr(response), **_zone_fields(day_zones)}}, {}))
+
+    fields_by_date = {}
+    activities_by_date = {}
+    # Active Zone Minutes override zones derived from heart series, whenever they were fetched
+    ordered = sorted(updates, key=lambda update: update[0]) + sorted(azm_updates, key=lambda update: update[0])
+    for fetched_at, fields, activities in ordered:
+        for date_str, values in fields.items():
+            fields_by_date.setdefault(date_str, {}).update(values)
+        activities_by_date.update(activities)
+
+    def in_range(date_str):
+        return (not start_date or date_str >= start_date) and (not end_date or date_str <= end_date)
+
+    return (
+        {date_str: values for date_str, values in fields_by_date.items() if in_range(date_str)},
+        {date_str: items for date_str, items in activities_by_date.items() if in_range(date_str) and items}
+    )
+
+def reprocess_user(supabase, archive_dir, user_id, start_date=None, end_date=None):
+    """Rebuild a user's fitbit_data and fitbit_activities rows from the archive, with no API calls."""
+    archive = ResponseArchive(archive_dir, user_id)
+    fields_by_date, activities_by_date = rebuild_days(archive.iter_records(end_date), start_date, end_date)
+
+    rows = []
+    incomplete = []
+    for date_str in sorted(fields_by_date):
+        values = fields_by_date[date_str]
+        if not all(field in values for field in REQUIRED_FIELDS):
+            incomplete.append(date_str)
+            continue
+        rows.append(make_fitbit_row(user_id, date_str, **values))
+    if incomplete:
+        logger.warning(f"Skipping {len(incomplete)} days with incomplete archived data for user {user_id}")
+
+    written = 0
+    activities_inserted = 0
+    remaining_activities = dict(activities_by_date)
+    for i in range(0, len(rows), UPSERT_BATCH_DAYS):
+        batch = rows[i:i + UPSERT_BATCH_DAYS]
+        batch_activities = {
+            row["date"]: remaining_activities.pop(row["date"])
+            for row in batch if row["date"] in remaining_activities
+        }
+        result = write_days(supabase, user_id, batch, batch_activities or None)
+        written += result["written"]
+        activities_inserted += result["activities"]["inserted"] if result["activities"] else 0
+    # Activities of days whose row could not be rebuilt
+    if remaining_activities:
+        activities_inserted += ingest_activities(supabase, user_id, remaining_activities)["inserted"]
+    logger.info(
+        f"Reprocessed {len(rows)} days for user {user_id}: {written} rows written, "
+        f"{activities_inserted} activities inserted"
+    )
+    return {"days": len(rows), "written": written, "activities_inserted": activities_inserted}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild fitbit_data from the raw response archive.")
+    parser.add_argument("--start", help="first date to rebuild (YYYY-MM-DD)")
+    parser.add_argument("--end", help="last date to rebuild (YYYY-MM-DD)")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--user-id", help="user to rebuild (default: the signed-in user)")
+    group.add_argument("--all-users", action="store_true", help="rebuild every user found in the archive")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    archive_dir = load_config()["sync"]["archive_dir"]
+    if not archive_dir or not os.path.isdir(archive_dir):
+        logger.error("No response archive found (is FITBIT_ARCHIVE turned off?)")
+        return 1
+
+    supabase = get_supabase_client()
+    try:
+        if args.all_users:
+            user_ids = sorted(os.listdir(archive_dir))
+        else:
+            user_ids = [args.user_id or authenticate_supabase(supabase)]
+
+        for user_id in user_ids:
+            reprocess_user(supabase, archive_dir, user_id, args.start, args.end)
+        return 0
+    finally:
+        cleanup_supabase_client()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""Weekly and monthly rollups of fitbit_data.
+
+The sync keeps fitbit_rollups current: whenever day rows are written, the
+weeks (Monday to Sunday) and calendar months they fall in are recomputed from
+just those periods' days. To fill the table for existing history:
+
+    python rollups.py
+    python rollups.py --all-users
+"""
+import argparse
+import sys
+import logging
+from datetime import timedelta
+from fitbit_utils import convert_str_to_date, format_date
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ("week", "month")
+
+# Rollup metric -> the fitbit_data columns summed into its daily value
+ROLLUP_METRICS = {
+    "steps": ("steps",),
+    "rhr": ("heart_rate",),
+    "azm": ("fat_burn_minutes", "cardio_minutes", "peak_minutes"),
+    "sleep": ("sleep_minutes",)
+}
+
+# Metrics where 0 means "no reading" and is left out of the mean and min
+SKIP_ZERO_METRICS = ("rhr", "sleep")
+
+# fitbit_data columns a rollup is computed from
+SOURCE_COLUMNS = ["date"] + sorted({column for columns in ROLLUP_METRICS.values() for column in columns})
+
+def period_start(date, period):
+    """Return the first day of the week or month containing date."""
+    if period == "week":
+        return date - timedelta(days=date.weekday())
+    return date.replace(day=1)
+
+def period_end(start, period):
+    """Return the last day of the period starting on start."""
+    if period == "week":
+        return start + timedelta(days=6)
+    next_month = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return next_month - timedelta(days=1)
+
+def affected_periods(dates):
+    """Return the (period, start date) pairs covering the given date strings."""
+    return {
+        (period, period_start(convert_str_to_date(date_str), period))
+        for date_str in dates
+        for period in PERIODS
+    }
+
+def compute_rollup(user_id, period, start, day_rows):
+    """Aggregate one period's fitbit_data rows into a fitbit_rollups row."""
+    rollup = {
+        "user_id": user_id,
+        "period": period,
+        "period_start": format_date(start),
+        "period_end": format_date(period_end(start, period)),
+        "days": len(day_rows)
+    }
+    for metric, columns in ROLLUP_METRICS.items():
+        values = [sum(row.get(column) or 0 for column in columns) for row in day_rows]
+        if metric in SKIP_ZERO_METRICS:
+            values = [value for value in values if value]
+        rollup[f"{metric}_sum"] = sum(values)
+        rollup[f"{metric}_mean"] = round(sum(values) / len(values), 1) if values else None
+        rollup[f"{metric}_min"] = min(values) if values else None
+        rollup[f"{metric}_max"] = max(values) if values else None
+    return rollup
+
+def build_rollups(user_id, periods, day_rows):
+    """Compute a rollup row for every (period, start date) pair from the day rows covering them."""
+    rows_by_period = {key: [] for key in periods}
+    for row in day_rows:
+        date = convert_str_to_date(row["date"])
+        for period in PERIODS:
+            key = (period, period_start(date, period))
+            if key in rows_by_period:
+                rows_by_period[key].append(row)
+    return [
+        compute_rollup(user_id, period, start, rows)
+        for (period, start), rows in sorted(rows_by_period.items())
+    ]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild weekly and monthly rollups from fitbit_data.")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--user-id", help="user to rebuild (default: the signed-in user)")
+    group.add_argument("--all-users", action="store_true", help="rebuild every user with a row in fitbit_tokens")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    from supabase_utils import (
+        get_supabase_client,
+        authenticate_supabase,
+        list_fitbit_users,
+        rebuild_rollups,
+        cleanup_supabase_client
+    )
+
+    args = parse_args(argv)
+    supabase = get_supabase_client()
+    try:
+        if args.all_users:
+            user_ids = list_fitbit_users(supabase)
+        else:
+            user_ids = [args.user_id or authenticate_supabase(supabase)]
+
+        for user_id in user_ids:
+            count = rebuild_rollups(supabase, user_id)
+            logger.info(f"Rebuilt {count} rollups for user {user_id}")
+        return 0
+    finally:
+        cleanup_supabase_client()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -3,24 +3,47 @@ import warnings
 import time
 import sys
 import signal
-import os
+import threading
 import traceback
-from fitbit_utils import convert_str_to_date, get_todays_date, get_yesterday_date
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from fitbit_utils import (
+    convert_str_to_date,
+    format_date,
+    get_todays_date,
+    get_yesterday_date,
+    iter_dates,
+    split_date_range
+)
 from fitbit_auth import load_config, get_fitbit_instance
+from fitbit_rate_limit import RateLimitDeferred
+from sync_metrics import get_run_report
+from sync_journal import get_journal, WRITTEN
 from fitbit_daily_data import (
     fetch_sleep_yesterday, 
     fetch_steps_yesterday, 
     fetch_rhr_yesterday,
     fetch_active_zone_minutes,
-    fetch_activities
+    fetch_activities,
+    fetch_sleep_range,
+    fetch_steps_range,
+    fetch_heart_range,
+    fetch_azm_range,
+    fetch_activities_range,
+    fetch_intraday_heart,
+    MAX_RANGE_DAYS
 )
 from supabase_utils import (
     get_supabase_client, 
-    insert_fitbit_data, 
+    make_fitbit_row,
+    write_days,
+    upsert_intraday_heart,
     get_last_recorded_date,
+    get_first_missing_date,
     authenticate_supabase,
-    insert_activities,
-    cleanup_supabase_client
+    cleanup_supabase_client,
+    list_fitbit_users
 )
 import logging
 
@@ -30,26 +53,38 @@ logger = logging.getLogger(__name__)
 
 warnings.filterwarnings("ignore", category=UserWarning, module="urllib3")
 
+# Exit code of a run stopped by SIGINT/SIGTERM
+EXIT_INTERRUPTED = 130
+
+# Set by the first SIGINT/SIGTERM: no new fetches start, but fetched data is still written
+stop_requested = threading.Event()
+
 def signal_handler(signum, frame):
-    """Handle exit signals gracefully."""
-    logger.info("Received exit signal, cleaning up...")
-    cleanup_supabase_client()
-    os._exit(0)  # Force exit immediately
+    """Stop gracefully on the first signal, right away on the second."""
+    if stop_requested.is_set():
+        raise KeyboardInterrupt
+    logger.info("Received exit signal, writing fetched data before exiting (signal again to abort)...")
+    stop_requested.set()
 
-# Register signal handlers
-signal.signal(signal.SIGINT, signal_handler)
-signal.signal(signal.SIGTERM, signal_handler)
+# Returned by the *_safely fetchers when the rate limit or a stop request pushed the work to a later run
+DEFERRED = object()
 
 def fetch_data_safely(fetch_func, fitbit_client, date, data_type):
     """Safely fetch data with error handling."""
+    if stop_requested.is_set():
+        return DEFERRED
     try:
-        data = fetch_func(fitbit_client, date)
+        with get_run_report().span("fetch", data_type=data_type):
+            data = fetch_func(fitbit_client, date)
         if data:
             logger.info(f"{data_type} data fetched successfully")
             return data
         else:
             logger.warning(f"No {data_type} data available for {date}")
             return None
+    except RateLimitDeferred as e:
+        logger.warning(f"Deferring {data_type} data: {e}")
+        return DEFERRED
     except Exception as e:
         logger.error(f"Error fetching {data_type} data: {type(e).__name__}")
         return None
@@ -57,85 +92,443 @@ def fetch_data_safely(fetch_func, fitbit_client, date, data_type):
 def insert_data_safely(insert_func, *args, data_type):
     """Safely insert data with error handling."""
     try:
-        insert_func(*args)
+        with get_run_report().span("insert", data_type=data_type):
+            insert_func(*args)
         logger.info(f"{data_type} data inserted successfully")
         return True
     except Exception as e:
         logger.error(f"Error inserting {data_type} data: {type(e).__name__}")
         return False
 
-def main():
+def fetch_range_safely(fetch_func, fitbit_client, start_date, end_date, data_type):
+    """Safely fetch data for a date range with error handling."""
+    if stop_requested.is_set():
+        return DEFERRED
     try:
-        # Initialize Supabase client and authenticate
-        supabase = get_supabase_client()
-        user_id = authenticate_supabase(supabase)
-        logger.info("Successfully authenticated with Supabase")
-        
-        # Load config and get Fitbit client
-        config = load_config()
-        fitbit_client = get_fitbit_instance(config, supabase, user_id)
-        
+        with get_run_report().span("fetch", data_type=data_type):
+            data = fetch_func(fitbit_client, start_date, end_date)
+        logger.info(f"{data_type} data fetched successfully for {start_date} to {end_date}")
+        return data
+    except RateLimitDeferred as e:
+        logger.warning(f"Deferring {data_type} data: {e}")
+        return DEFERRED
+    except Exception as e:
+        logger.error(f"Error fetching {data_type} data: {type(e).__name__}")
+        return None
+
+def fetch_day_journaled(journal, user_id, fetch_func, fitbit_client, date, data_type):
+    """fetch_data_safely, reusing a value an earlier run fetched but did not write, and checkpointing new ones.
+
+    A single day is always inside the trailing re-sync window, so values that
+    were already written are fetched again to pick up late device syncs.
+    """
+    resource = f"day/{data_type}"
+    date_str = format_date(date)
+    entry = journal.lookup(user_id, resource, date_str, date_str).get(date_str) if journal else None
+    if entry and entry["status"] != WRITTEN:
+        logger.info(f"{data_type} data for {date_str} restored from the sync journal")
+        return entry["value"]
+    data = fetch_data_safely(fetch_func, fitbit_client, date, data_type)
+    if journal and data is not None and data is not DEFERRED:
+        journal.record_fetched(user_id, resource, {date_str: data})
+    return data
+
+def fetch_range_journaled(journal, user_id, fetch_func, fitbit_client, start_date, end_date, data_type,
+                          resync_from=None):
+    """fetch_range_safely for only the days not in the journal yet, checkpointing what it fetches.
+
+    Days from resync_from on are re-fetched once written, like sync_day does.
+    """
+    resource = f"range/{data_type}"
+    entries = journal.lookup(user_id, resource, format_date(start_date), format_date(end_date)) if journal else {}
+    if resync_from:
+        entries = {
+            date: entry for date, entry in entries.items()
+            if entry["status"] != WRITTEN or date < format_date(resync_from)
+        }
+    missing = [date for date in iter_dates(start_date, end_date) if format_date(date) not in entries]
+    data = {}
+    if missing:
+        data = fetch_range_safely(fetch_func, fitbit_client, missing[0], missing[-1], data_type)
+        if data is None or data is DEFERRED:
+            return data
+        if journal:
+            # Days without data are checkpointed too, so they are not fetched again either
+            journal.record_fetched(user_id, resource, {
+                format_date(date): data.get(format_date(date)) for date in iter_dates(missing[0], missing[-1])
+            })
+    else:
+        logger.info(f"{data_type} data for {start_date} to {end_date} restored from the sync journal")
+    restored = {date: entry["value"] for date, entry in entries.items() if entry["value"] is not None}
+    return dict(restored, **data)
+
+def run_fetches(fetches, concurrency=1):
+    """Run independent fetches, up to `concurrency` at a time, and return their results.
+
+    `fetches` maps a key to a zero-argument callable, normally a partial of
+    fetch_data_safely or fetch_range_safely, so a failure in one resource is
+    still isolated from the others.
+    """
+    if concurrency <= 1:
+        return {key: fetch() for key, fetch in fetches.items()}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {key: executor.submit(fetch) for key, fetch in fetches.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+# Daily fetchers used by sync_day, keyed by data type
+DAY_FETCHERS = {
+    "Sleep": fetch_sleep_yesterday,
+    "Steps": fetch_steps_yesterday,
+    "RHR": fetch_rhr_yesterday,
+    "Active Zone Minutes": fetch_active_zone_minutes,
+    "Activities": fetch_activities
+}
+
+def sync_day(fitbit_client, supabase, user_id, date, concurrency=1, journal=None):
+    """Fetch and store a single day of data using the daily endpoints."""
+    date_str = format_date(date)
+    resources = [f"day/{data_type}" for data_type in DAY_FETCHERS]
+
+    # Fetch sleep, steps, RHR, Active Zone Minutes and activities data
+    logger.info(f"Fetching data for {date_str}...")
+    results = run_fetches({
+        data_type: partial(fetch_day_journaled, journal, user_id, fetch_func, fitbit_client, date, data_type)
+        for data_type, fetch_func in DAY_FETCHERS.items()
+    }, concurrency)
+    deferred = [data_type for data_type, data in results.items() if data is DEFERRED]
+    if deferred:
+        # Writing now would record zeros; the journal keeps what was fetched for the next run
+        logger.warning(f"Deferred fetching {', '.join(deferred)}, leaving {date_str} for a later run")
+        return False
+
+    sleep_data = results["Sleep"]
+    steps_data = results["Steps"]
+    rhr_data = results["RHR"]
+    azm_data = results["Active Zone Minutes"]
+    activities_data = results["Activities"]
+
+    rows = []
+    if any([sleep_data, steps_data, rhr_data, azm_data]):
+        rows.append(make_fitbit_row(
+            user_id,
+            date_str,
+            steps=steps_data.get('summary', {}).get('steps', 0) if steps_data else 0,
+            heart_rate=rhr_data if rhr_data else 0,
+            fat_burn_minutes=azm_data.get('fat_burn', 0) if azm_data else 0,
+            cardio_minutes=azm_data.get('cardio', 0) if azm_data else 0,
+            peak_minutes=azm_data.get('peak', 0) if azm_data else 0,
+            **(sleep_data or {})
+        ))
+
+    # Insert all data at once, skipping anything whose content hash is unchanged
+    activities_by_date = {date_str: activities_data} if activities_data else None
+    if rows or activities_by_date:
+        if insert_data_safely(write_days, supabase, user_id, rows, activities_by_date, data_type="Fitbit") \
+                and journal:
+            journal.mark_written(user_id, resources, [date_str])
+    return True
+
+# Range fetchers used by sync_range, keyed by data type
+RANGE_FETCHERS = {
+    "Sleep": fetch_sleep_range,
+    "Steps": fetch_steps_range,
+    "Heart Rate": fetch_heart_range,
+    "Active Zone Minutes": fetch_azm_range,
+    "Activities": fetch_activities_range
+}
+
+def sync_range(fitbit_client, supabase, user_id, start_date, end_date, concurrency=1, resync_until=None,
+               journal=None, resync_from=None):
+    """Backfill or re-sync every day in a date range using one range call per resource per chunk.
+
+    Returns False if the rate limit cut the backfill short. Chunks are written in
+    order and writing stops at the first deferred chunk, so the next run resumes
+    from the last recorded date. Days up to resync_until are already stored and
+    are only rewritten when every resource was fetched, so a failed fetch never
+    overwrites good data with zeros. With a journal, days fetched by an earlier
+    interrupted run are not fetched again, and chunks it already wrote are skipped,
+    except from resync_from on: the trailing re-sync window is always fetched again.
+    """
+    chunks = split_date_range(start_date, end_date, MAX_RANGE_DAYS)
+    resources = [f"range/{data_type}" for data_type in RANGE_FETCHERS]
+    written_chunks = {
+        chunk for chunk in chunks
+        if journal and not (resync_from and chunk[1] >= resync_from) and journal.is_written(user_id, resources, [format_date(date) for date in iter_dates(*chunk)])
+    }
+
+    # Every (chunk, resource) fetch is independent, so they can all run in parallel
+    logger.info(f"Fetching {len(chunks) - len(written_chunks)} chunk(s) from {start_date} to {end_date}...")
+    results = run_fetches({
+        (chunk, data_type): partial(
+            fetch_range_journaled, journal, user_id, fetch_func, fitbit_client, chunk[0], chunk[1], data_type,
+            resync_from
+        )
+        for chunk in chunks if chunk not in written_chunks
+        for data_type, fetch_func in RANGE_FETCHERS.items()
+    }, concurrency)
+
+    for chunk in chunks:
+        chunk_start, chunk_end = chunk
+        if chunk in written_chunks:
+            logger.info(f"Data from {chunk_start} to {chunk_end} was already fetched and written by a recent run")
+            continue
+        if any(results[(chunk, data_type)] is DEFERRED for data_type in RANGE_FETCHERS):
+            logger.warning(f"Deferred fetching, leaving {chunk_start} to {end_date} for a later run")
+            return False
+
+        logger.info(f"Storing data from {chunk_start} to {chunk_end}...")
+        sleep_days = results[(chunk, "Sleep")]
+        steps_days = results[(chunk, "Steps")]
+        heart_days = results[(chunk, "Heart Rate")]
+        azm_days = results[(chunk, "Active Zone Minutes")]
+        activities_days = results[(chunk, "Activities")]
+
+        failed = [data_type for data_type in ("Sleep", "Steps", "Heart Rate") if results[(chunk, data_type)] is None]
+        rows = []
+        skipped_dates = set()
+        for date in iter_dates(chunk_start, chunk_end):
+            date_str = format_date(date)
+            if failed and resync_until and date <= resync_until:
+                skipped_dates.add(date_str)
+                continue
+            heart_day = (heart_days or {}).get(date_str, {})
+            # Zone minutes come from the Active Zone Minutes series, or the heart series if that failed
+            zones = azm_days.get(date_str, {}) if azm_days is not None else heart_day.get('zones', {})
+            rows.append(make_fitbit_row(
+                user_id,
+                date_str,
+                steps=(steps_days or {}).get(date_str, 0),
+                heart_rate=heart_day.get('rhr', 0),
+                fat_burn_minutes=zones.get('fat_burn', 0),
+                cardio_minutes=zones.get('cardio', 0),
+                peak_minutes=zones.get('peak', 0),
+                **(sleep_days or {}).get(date_str, {})
+            ))
+        if failed and resync_until and chunk_start <= resync_until:
+            logger.warning(f"Not re-syncing stored days up to {resync_until}: {', '.join(failed)} fetch failed")
+
+        # The activity list covers the whole chunk, so a day missing from it has no activities.
+        # Skipped days are left alone too: their row, which holds the activity hash, is not rewritten
+        activities_by_date = None
+        if activities_days is not None:
+            activities_by_date = {
+                format_date(date): activities_days.get(format_date(date), [])
+                for date in iter_dates(chunk_start, chunk_end)
+                if format_date(date) not in skipped_dates
+            }
+        if not any([sleep_days, steps_days, heart_days]):
+            rows = []
+        if rows or activities_by_date:
+            if insert_data_safely(write_days, supabase, user_id, rows, activities_by_date, data_type="Fitbit") \
+                    and journal:
+                journal.mark_written(user_id, resources, [format_date(date) for date in iter_dates(*chunk)])
+    return True
+
+def sync_user(config, supabase, user_id, fitbit_client=None, timezone=None):
+    """Sync every missing day for one user and return a summary of the outcome.
+
+    Failures are caught and reported in the summary so one user cannot stop
+    the others in a multi-user run. A long-lived caller can pass a warm
+    fitbit_client, and the user's timezone to decide which day is yesterday
+    (AEST by default).
+    """
+    summary = {"user_id": user_id, "status": "ok", "start_date": None, "end_date": None}
+    report = get_run_report()
+    if stop_requested.is_set():
+        summary["status"] = "interrupted"
+        report.increment("users_synced_total", status=summary["status"])
+        return summary
+    try:
+        journal = get_journal(config)
+        if fitbit_client is None:
+            fitbit_client = get_fitbit_instance(config, supabase, user_id, stop_requested)
+        else:
+            # Responses cached by the previous sync are stale by now
+            fitbit_client.response_cache.clear()
+            with report.span("token_refresh", user_id=user_id):
+                fitbit_client.token_manager.ensure_fresh(fitbit_client)
+
         # Get last recorded date from Supabase
         last_recorded_date = get_last_recorded_date(supabase, user_id)
-        yesterday = get_yesterday_date()
+        yesterday = get_yesterday_date(timezone)
 
         if last_recorded_date is None:
-            logger.info("No previous data found. Starting fresh data collection.")
-            last_recorded_date = yesterday
+            logger.info(f"No previous data found for user {user_id}. Starting fresh data collection.")
+            start_date = yesterday
         else:
-            logger.info(f"Last recorded date: {last_recorded_date}")
-
-        # Fetch and store data for yesterday
-        logger.info("Fetching yesterday's data...")
-        date_str = yesterday.strftime('%Y-%m-%d')
-        
-        # Fetch sleep data
-        logger.info("Fetching sleep data...")
-        sleep_data = fetch_data_safely(fetch_sleep_yesterday, fitbit_client, yesterday, "Sleep")
-        
-        # Fetch steps data
-        logger.info("Fetching steps data...")
-        steps_data = fetch_data_safely(fetch_steps_yesterday, fitbit_client, yesterday, "Steps")
-        
-        # Fetch RHR data
-        logger.info("Fetching RHR data...")
-        rhr_data = fetch_data_safely(fetch_rhr_yesterday, fitbit_client, yesterday, "RHR")
-        
-        # Fetch Active Zone Minutes data
-        logger.info("Fetching Active Zone Minutes data...")
-        azm_data = fetch_data_safely(fetch_active_zone_minutes, fitbit_client, yesterday, "Active Zone Minutes")
-        
-        # Insert all data at once
-        if any([sleep_data, steps_data, rhr_data, azm_data]):
-            insert_data_safely(
-                insert_fitbit_data,
-                supabase,
-                user_id,
-                date_str,
-                steps_data.get('summary', {}).get('steps', 0) if steps_data else 0,
-                rhr_data if rhr_data else 0,
-                sleep_data if sleep_data else "0h0min",
-                azm_data.get('fat_burn', 0) if azm_data else 0,
-                azm_data.get('cardio', 0) if azm_data else 0,
-                azm_data.get('peak', 0) if azm_data else 0,
-                data_type="Fitbit"
+            logger.info(f"Last recorded date for user {user_id}: {last_recorded_date}")
+            start_date = convert_str_to_date(last_recorded_date) + timedelta(days=1)
+
+        backfill_max_days = config["sync"]["backfill_max_days"]
+        backfill_start = yesterday - timedelta(days=backfill_max_days - 1)
+        if start_date < backfill_start:
+            start_date = backfill_start
+            logger.warning(f"Gap exceeds {backfill_max_days} days, backfilling from {start_date} only")
+        elif last_recorded_date is not None:
+            # Push syncs can record later days while an older gap is still open
+            first_missing = get_first_missing_date(
+                supabase, user_id, format_date(backfill_start), last_recorded_date
+            )
+            if first_missing is not None:
+                logger.info(f"Backfilling gap from {first_missing}")
+                start_date = convert_str_to_date(first_missing)
+
+        # Fitbit keeps updating recent days after late device syncs, so re-pull a trailing window too
+        resync_start = yesterday - timedelta(days=max(config["sync"]["resync_days"], 1) - 1)
+        resync_until = convert_str_to_date(last_recorded_date) if last_recorded_date else None
+        if resync_start < start_date:
+            logger.info(f"Re-syncing stored days from {resync_start}")
+            start_date = resync_start
+
+        concurrency = config["sync"]["fetch_concurrency"]
+        if start_date < yesterday:
+            # Missed and recent days are fetched with range calls; unchanged days are not rewritten
+            logger.info(f"Syncing data from {start_date} to {yesterday}...")
+            completed = sync_range(
+                fitbit_client, supabase, user_id, start_date, yesterday, concurrency, resync_until, journal,
+                resync_start
             )
+        else:
+            # Fetch and store data for yesterday
+            start_date = yesterday
+            logger.info("Fetching yesterday's data...")
+            completed = sync_day(fitbit_client, supabase, user_id, yesterday, concurrency, journal)
+
+        summary["start_date"] = format_date(start_date)
+        summary["end_date"] = format_date(yesterday)
+
+        if completed and hasattr(fitbit_client, "intraday_store") \
+                and not fitbit_client.intraday_store.has_day(yesterday):
+            # The 1-minute series is only needed for the intraday store; the rows come from summary series
+            fetch_data_safely(fetch_intraday_heart, fitbit_client, yesterday, "Intraday heart rate")
+        if config["sync"]["intraday_upload"] and hasattr(fitbit_client, "intraday_store"):
+            # Only days fetched since the last upload; stored days were uploaded by the run that fetched them
+            intraday_store = fitbit_client.intraday_store
+            new_dates = intraday_store.take_new_dates()
+            if new_dates and not insert_data_safely(
+                upsert_intraday_heart,
+                supabase,
+                intraday_store.upload_rows(user_id, new_dates),
+                data_type="Intraday heart rate"
+            ):
+                intraday_store.put_back_dates(new_dates)
+        if not completed:
+            summary["status"] = "interrupted" if stop_requested.is_set() else "deferred"
+
+        cache_stats = fitbit_client.response_cache.stats()
+        summary["cache"] = cache_stats
+        report.increment("fitbit_cache_hits_total", cache_stats["hits"])
+        report.increment("fitbit_cache_misses_total", cache_stats["misses"])
+        logger.info(f"Fitbit response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    except Exception as e:
+        logger.error(f"Error syncing user {user_id}: {type(e).__name__}")
+        logger.debug(f"Error details: {traceback.format_exc()}")
+        summary["status"] = "failed"
+        summary["error"] = type(e).__name__
+    report.increment("users_synced_total", status=summary["status"])
+    return summary
+
+def sync_all_users(config, supabase, workers):
+    """Sync every user with stored Fitbit tokens in parallel and return their summaries."""
+    user_ids = list_fitbit_users(supabase)
+    logger.info(f"Syncing {len(user_ids)} users with {workers} workers...")
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        return list(executor.map(partial(sync_user, config, supabase), user_ids))
+
+def log_summary(summaries):
+    """Log one summary report for all synced users."""
+    counts = {}
+    for summary in summaries:
+        counts[summary["status"]] = counts.get(summary["status"], 0) + 1
+        if summary["status"] != "ok":
+            logger.warning(f"User {summary['user_id']}: {summary['status']} {summary.get('error', '')}".rstrip())
+    logger.info(
+        f"Sync summary: {len(summaries)} users, "
+        + ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+    )
+
+def write_run_report(config):
+    """Write the run report as JSON and, if configured, as a Prometheus textfile."""
+    report = get_run_report()
+    try:
+        if config["sync"]["report_path"]:
+            report.write_json(config["sync"]["report_path"])
+            logger.info(f"Run report written to {config['sync']['report_path']}")
+        if config["sync"]["prometheus_textfile"]:
+            report.write_prometheus(config["sync"]["prometheus_textfile"])
+    except OSError as e:
+        logger.error(f"Error writing run report: {e}")
 
-        # Fetch and insert Activities data
-        logger.info("Fetching Activities data...")
-        activities_data = fetch_data_safely(fetch_activities, fitbit_client, yesterday, "Activities")
-        if activities_data:
-            insert_data_safely(insert_activities, supabase, user_id, yesterday, activities_data, data_type="Activities")
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Sync Fitbit data into Supabase.")
+    parser.add_argument(
+        "--all-users",
+        action="store_true",
+        help="sync every user with a row in fitbit_tokens instead of the signed-in user"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="number of users synced in parallel with --all-users (default: FITBIT_USER_CONCURRENCY)"
+    )
+    parser.add_argument(
+        "--resync-days",
+        type=int,
+        default=None,
+        help="trailing days to re-fetch and rewrite where changed (default: FITBIT_RESYNC_DAYS)"
+    )
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Register signal handlers
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+    config = None
+    try:
+        # Initialize Supabase client
+        supabase = get_supabase_client()
+        config = load_config()
+        if args.resync_days is not None:
+            config["sync"]["resync_days"] = args.resync_days
+
+        if args.all_users:
+            # The service role key can read every user's tokens, no sign-in needed
+            workers = args.workers or config["sync"]["user_concurrency"]
+            summaries = sync_all_users(config, supabase, workers)
+        else:
+            with get_run_report().span("auth"):
+                user_id = authenticate_supabase(supabase)
+            logger.info("Successfully authenticated with Supabase")
+            summaries = [sync_user(config, supabase, user_id)]
+
+        log_summary(summaries)
+        write_run_report(config)
+        if any(summary["status"] == "failed" for summary in summaries):
+            logger.error("Script completed with errors")
+            return 1
+        if stop_requested.is_set():
+            logger.warning("Script stopped early, the next run resumes from the sync journal")
+            return EXIT_INTERRUPTED
 
         logger.info("Script completed successfully")
-        cleanup_supabase_client()
-        os._exit(0)  # Force exit immediately
+        return 0
 
+    except KeyboardInterrupt:
+        logger.warning("Script aborted, the next run resumes from the sync journal")
+        if config:
+            write_run_report(config)
+        return EXIT_INTERRUPTED
     except Exception as e:
         logger.error(f"An error occurred during script execution: {type(e).__name__}")
         logger.debug(f"Error details: {traceback.format_exc()}")
+        if config:
+            write_run_report(config)
+        return 1
+    finally:
         cleanup_supabase_client()
-        os._exit(1)  # Force exit with error code
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
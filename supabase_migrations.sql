@@ -0,0 +1,63 @@
+-- Schema changes required by the sync script.
+-- Safe to re-run: every statement is idempotent.
+
+-- Bulk upserts resolve conflicts on (user_id, date)
+CREATE UNIQUE INDEX IF NOT EXISTS fitbit_data_user_id_date_key
+    ON fitbit_data (user_id, date);
+
+-- Optional upload target for 1-minute heart rate series (FITBIT_INTRADAY_UPLOAD=1).
+-- data is base64 of zlib-compressed int16 per-minute deltas (encoding int16-delta-zlib).
+CREATE TABLE IF NOT EXISTS fitbit_intraday_heart (
+    user_id uuid NOT NULL,
+    date date NOT NULL,
+    encoding text NOT NULL,
+    data text NOT NULL,
+    PRIMARY KEY (user_id, date)
+);
+
+-- One token row per user: keep only the newest row, then enforce uniqueness
+-- so token refreshes upsert in place.
+DELETE FROM fitbit_tokens t
+USING fitbit_tokens newer
+WHERE t.user_id = newer.user_id
+  AND t.created_at < newer.created_at;
+
+CREATE UNIQUE INDEX IF NOT EXISTS fitbit_tokens_user_id_key
+    ON fitbit_tokens (user_id);
+
+-- Content hashes used to skip unchanged days when recent days are re-synced:
+-- content_hash covers the day's values, activities_hash its activity set.
+ALTER TABLE fitbit_data ADD COLUMN IF NOT EXISTS content_hash text;
+ALTER TABLE fitbit_data ADD COLUMN IF NOT EXISTS activities_hash text;
+
+-- Numeric sleep totals and stage minutes (the formatted `sleep` column is kept).
+ALTER TABLE fitbit_data ADD COLUMN IF NOT EXISTS sleep_minutes integer;
+ALTER TABLE fitbit_data ADD COLUMN IF NOT EXISTS deep_sleep_minutes integer;
+ALTER TABLE fitbit_data ADD COLUMN IF NOT EXISTS light_sleep_minutes integer;
+ALTER TABLE fitbit_data ADD COLUMN IF NOT EXISTS rem_sleep_minutes integer;
+ALTER TABLE fitbit_data ADD COLUMN IF NOT EXISTS wake_minutes integer;
+
+-- Existing rows only have the formatted total, e.g. 7h32min
+UPDATE fitbit_data
+SET sleep_minutes = split_part(sleep, 'h', 1)::integer * 60 + rtrim(split_part(sleep, 'h', 2), 'min')::integer
+WHERE sleep_minutes IS NULL AND sleep ~ '^[0-9]+h[0-9]+min$';
+
+-- Weekly (Monday start) and monthly rollups, kept current by the sync.
+-- Fill them for existing history with `python rollups.py --all-users`.
+-- rhr and sleep means/minimums leave out days without a reading.
+CREATE TABLE IF NOT EXISTS fitbit_rollups (
+    user_id uuid NOT NULL,
+    period text NOT NULL CHECK (period IN ('week', 'month')),
+    period_start date NOT NULL,
+    period_end date NOT NULL,
+    days integer NOT NULL,
+    steps_sum bigint, steps_mean numeric, steps_min integer, steps_max integer,
+    rhr_sum bigint, rhr_mean numeric, rhr_min integer, rhr_max integer,
+    azm_sum bigint, azm_mean numeric, azm_min integer, azm_max integer,
+    sleep_sum bigint, sleep_mean numeric, sleep_min integer, sleep_max integer,
+    PRIMARY KEY (user_id, period, period_start)
+);
+
+-- Keyset pagination (export, activity diffs) reads activities by (user_id, date)
+CREATE INDEX IF NOT EXISTS fitbit_activities_user_id_date_idx
+    ON fitbit_activities (user_id, date);
@@ -0,0 +1,78 @@
+import base64
+import json
+import os
+import logging
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+logger = logging.getLogger(__name__)
+
+PBKDF2_ITERATIONS = 100_000
+
+def _fernet(secret, salt):
+    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=PBKDF2_ITERATIONS)
+    return Fernet(base64.urlsafe_b64encode(kdf.derive(secret)))
+
+def seal(payload, secret):
+    """Encrypt a JSON-serializable payload with a key derived from secret (bytes) and a fresh salt."""
+    salt = os.urandom(16)
+    return {
+        "salt": base64.b64encode(salt).decode("ascii"),
+        "session": _fernet(secret, salt).encrypt(json.dumps(payload).encode("utf8")).decode("ascii")
+    }
+
+def unseal(stored, secret):
+    """Decrypt a payload sealed by seal(); raises ValueError, KeyError or InvalidToken if it cannot."""
+    salt = base64.b64decode(stored["salt"])
+    return json.loads(_fernet(secret, salt).decrypt(stored["session"].encode("ascii")))
+
+def write_sealed(path, payload, secret):
+    """Seal payload and write it atomically to a file only the owner can read."""
+    tmp_path = path + ".tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(seal(payload, secret), f)
+    os.replace(tmp_path, path)
+
+class SessionStore(object):
+    """Encrypted on-disk store for a Supabase access/refresh token pair.
+
+    The file holds a random salt and a Fernet token; the encryption key is
+    derived from `secret` with PBKDF2, so the session is unreadable without it.
+    """
+
+    def __init__(self, path, secret):
+        self.path = path
+        self.secret = secret.encode("utf8")
+
+    def load(self, email):
+        """Return the stored session for email as a dict, or None."""
+        try:
+            with open(self.path) as f:
+                session = unseal(json.load(f), self.secret)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, InvalidToken) as e:
+            logger.warning(f"Ignoring unreadable Supabase session: {type(e).__name__}")
+            return None
+        if session.get("email") != email:
+            return None
+        return session
+
+    def save(self, session, email):
+        """Encrypt and store a gotrue Session for email."""
+        if session is None:
+            return
+        write_sealed(self.path, {
+            "email": email,
+            "access_token": session.access_token,
+            "refresh_token": session.refresh_token,
+            "expires_at": session.expires_at
+        }, self.secret)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
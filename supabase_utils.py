@@ -1,9 +1,18 @@
+from __future__ import annotations
+import hashlib
+import json
 import os
 from dotenv import load_dotenv
-from supabase import create_client, Client
 import logging
 from datetime import datetime
+from typing import TYPE_CHECKING
 import atexit
+from fitbit_utils import get_state_dir, format_date, convert_str_to_date, iter_dates
+from rollups import SOURCE_COLUMNS, affected_periods, build_rollups, period_end
+from sync_metrics import get_run_report
+
+if TYPE_CHECKING:
+    from supabase import Client
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -18,11 +27,10 @@ def load_supabase_config():
     if not os.getenv('GITHUB_ACTIONS'):
         load_dotenv()
     
+    # The user credentials are only needed to sign in, which multi-user runs skip
     required_vars = [
         "SUPABASE_URL",
-        "SUPABASE_SERVICE_ROLE_KEY",
-        "SUPABASE_USER_EMAIL",
-        "SUPABASE_USER_PASSWORD"
+        "SUPABASE_SERVICE_ROLE_KEY"
     ]
     
     # Check if all required variables are present
@@ -39,8 +47,21 @@ def get_supabase_client() -> Client:
     """Initialize and return a Supabase client."""
     global _supabase_client
     if _supabase_client is None:
+        # Importing supabase pulls in every sub-client, so defer it until needed
+        import httpx
+        from supabase import create_client
+        from supabase.lib.client_options import ClientOptions
+        from http_transport import load_transport_config
         config = load_supabase_config()
-        _supabase_client = create_client(config["url"], config["key"])
+        transport = load_transport_config()
+        # postgrest keeps one pooled keep-alive httpx client (gzip by default); its 5s default
+        # read timeout is too short for bulk upserts
+        timeout = httpx.Timeout(transport["read_timeout"], connect=transport["connect_timeout"])
+        _supabase_client = create_client(
+            config["url"],
+            config["key"],
+            options=ClientOptions(postgrest_client_timeout=timeout, storage_client_timeout=timeout)
+        )
         # Register cleanup function
         atexit.register(cleanup_supabase_client)
     return _supabase_client
@@ -53,13 +74,29 @@ def cleanup_supabase_client():
             # Close any open connections
             if hasattr(_supabase_client, 'rest') and hasattr(_supabase_client.rest, 'close'):
                 _supabase_client.rest.close()
+            # The session refresh timer is a non-daemon thread that would keep the process alive
+            refresh_timer = getattr(getattr(_supabase_client, 'auth', None), '_refresh_token_timer', None)
+            if refresh_timer is not None:
+                refresh_timer.cancel()
             _supabase_client = None
             logger.info("Supabase client connection closed")
         except Exception as e:
             logger.error(f"Error closing Supabase client: {e}")
 
+def _record_round_trip(table: str, rows_written: int = 0):
+    """Count one PostgREST request (and the rows it wrote) in the run report."""
+    report = get_run_report()
+    report.increment("supabase_round_trips_total", table=table)
+    if rows_written:
+        report.increment("supabase_rows_written_total", rows_written, table=table)
+
 def authenticate_supabase(supabase: Client) -> str:
-    """Authenticate with Supabase and return the user ID."""
+    """Authenticate with Supabase and return the user ID.
+
+    A session saved by a previous run is reused (and silently refreshed if it
+    has expired); a password sign-in only happens when there is no usable
+    saved session.
+    """
     try:
         # Get credentials from environment variables
         email = os.getenv("SUPABASE_USER_EMAIL")
@@ -67,12 +104,35 @@ def authenticate_supabase(supabase: Client) -> str:
         
         if not email or not password:
             raise ValueError("Supabase credentials not found in environment variables")
+
+        from supabase_session import SessionStore
+        session_store = SessionStore(
+            os.path.join(get_state_dir(), "supabase_session.json"),
+            os.getenv("SUPABASE_SESSION_KEY") or password
+        )
+        # Keep the stored session current when the client refreshes it mid-run
+        supabase.auth.on_auth_state_change(
+            lambda event, session: session_store.save(session, email) if event == "TOKEN_REFRESHED" else None
+        )
+
+        saved_session = session_store.load(email)
+        if saved_session:
+            try:
+                response = supabase.auth.set_session(saved_session["access_token"], saved_session["refresh_token"])
+                if response.user:
+                    # set_session reports TOKEN_REFRESHED, so the callback above re-saves it
+                    logger.info("Reused saved Supabase session")
+                    return response.user.id
+            except Exception as e:
+                logger.warning(f"Saved Supabase session rejected, signing in again: {type(e).__name__}")
+            session_store.clear()
         
         # Sign in
         response = supabase.auth.sign_in_with_password({
             "email": email,
             "password": password
         })
+        session_store.save(response.session, email)
         
         logger.info("Successfully authenticated with Supabase")
         return response.user.id
@@ -80,82 +140,319 @@ def authenticate_supabase(supabase: Client) -> str:
         logger.error(f"Error authenticating with Supabase: {e}")
         raise
 
+# Content columns of fitbit_data covered by its content_hash
+FITBIT_DATA_COLUMNS = [
+    "steps",
+    "heart_rate",
+    "sleep",
+    "sleep_minutes",
+    "deep_sleep_minutes",
+    "light_sleep_minutes",
+    "rem_sleep_minutes",
+    "wake_minutes",
+    "fat_burn_minutes",
+    "cardio_minutes",
+    "peak_minutes"
+]
+
+# Stored per day and compared to decide whether a day changed
+HASH_COLUMNS = ("content_hash", "activities_hash")
+
+def content_hash(value) -> str:
+    """Return a stable hash of JSON-serialisable content."""
+    encoded = json.dumps(value, sort_keys=True, separators=(",", ":")).encode("utf8")
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+def hash_fitbit_row(row) -> str:
+    """Hash the content columns of a fitbit_data row."""
+    return content_hash([row.get(column) for column in FITBIT_DATA_COLUMNS])
+
+def hash_activities(activities) -> str:
+    """Hash one day's activity set, independent of the order Fitbit returned it in."""
+    return content_hash(sorted(
+        [activity['name'], activity['duration'], activity['calories'], activity.get('distance', 0), activity['start_time']]
+        for activity in activities
+    ))
+
+def get_day_hashes(supabase: Client, user_id: str, start_date: str, end_date: str):
+    """Get the stored content and activity hashes of every day in a date span, keyed by date.
+
+    Paged, so spans longer than the PostgREST row cap are read in full.
+    """
+    rows = iter_user_rows(supabase, "fitbit_data", user_id, "date," + ",".join(HASH_COLUMNS), start_date, end_date)
+    return {record["date"]: record for record in rows}
+
+def get_fitbit_days(supabase: Client, user_id: str, dates):
+    """Get the stored fitbit_data rows for the given dates, keyed by date."""
+    result = supabase.table("fitbit_data")\
+        .select("date," + ",".join(FITBIT_DATA_COLUMNS))\
+        .eq("user_id", user_id)\
+        .in_("date", list(dates))\
+        .execute()
+    _record_round_trip("fitbit_data")
+    return {record["date"]: record for record in result.data}
+
 def insert_fitbit_data(supabase: Client, user_id: str, date: str, steps: int, heart_rate: int, sleep: str, 
                       fat_burn_minutes: int = 0, cardio_minutes: int = 0, peak_minutes: int = 0):
     """Insert or update Fitbit data in the Supabase table."""
-    # Check if data already exists for this date
-    existing_data = supabase.table("fitbit_data")\
-        .select("*")\
-        .eq("user_id", user_id)\
-        .eq("date", date)\
-        .execute()
-    
-    data = {
+    data = make_fitbit_row(user_id, date, steps, heart_rate, sleep, fat_burn_minutes, cardio_minutes, peak_minutes)
+    return upsert_fitbit_data(supabase, user_id, [data])
+
+def make_fitbit_row(user_id: str, date: str, steps: int = 0, heart_rate: int = 0, sleep: str = "0h0min",
+                    fat_burn_minutes: int = 0, cardio_minutes: int = 0, peak_minutes: int = 0,
+                    sleep_minutes: int = 0, deep_sleep_minutes: int = 0, light_sleep_minutes: int = 0,
+                    rem_sleep_minutes: int = 0, wake_minutes: int = 0):
+    """Build a fitbit_data row for one day."""
+    return {
         "user_id": user_id,
         "date": date,
         "steps": steps,
         "heart_rate": heart_rate,
         "sleep": sleep,
+        "sleep_minutes": sleep_minutes,
+        "deep_sleep_minutes": deep_sleep_minutes,
+        "light_sleep_minutes": light_sleep_minutes,
+        "rem_sleep_minutes": rem_sleep_minutes,
+        "wake_minutes": wake_minutes,
         "fat_burn_minutes": fat_burn_minutes,
         "cardio_minutes": cardio_minutes,
         "peak_minutes": peak_minutes
     }
-    
-    if existing_data.data:
-        existing_record = existing_data.data[0]
-        if existing_record["steps"] == steps:
-            logger.info(f"Data for {date} already exists with same steps, skipping...")
-            return existing_data
-        
-        # Update existing record with new data
-        logger.info(f"Updating existing data for {date} with new values")
-        result = supabase.table("fitbit_data")\
-            .update(data)\
-            .eq("user_id", user_id)\
-            .eq("date", date)\
-            .execute()
-    else:
-        # Insert new record
-        logger.info(f"Inserting new data for {date}")
-        result = supabase.table("fitbit_data").insert(data).execute()
-    
-    return result
+
+def upsert_fitbit_data(supabase: Client, user_id: str, rows, existing_hashes=None):
+    """Bulk upsert day rows into fitbit_data, writing only rows whose content hash changed.
+
+    Stored hashes for the whole date span are read in one query (unless passed in
+    as existing_hashes) and all changed rows are written in one upsert resolving
+    conflicts on (user_id, date). Rows without an activities_hash keep the stored
+    one. Returns the rows that were written.
+    """
+    if not rows:
+        return []
+
+    dates = sorted(row["date"] for row in rows)
+    if existing_hashes is None:
+        existing_hashes = get_day_hashes(supabase, user_id, dates[0], dates[-1])
+
+    changed_rows = []
+    for row in rows:
+        stored = existing_hashes.get(row["date"], {})
+        row = dict(row, content_hash=hash_fitbit_row(row))
+        # Every row carries the column so the bulk upsert has uniform keys
+        row.setdefault("activities_hash", stored.get("activities_hash"))
+        if stored and all(stored.get(column) == row[column] for column in HASH_COLUMNS):
+            continue
+        changed_rows.append(row)
+
+    skipped = len(rows) - len(changed_rows)
+    if not changed_rows:
+        logger.info(f"All {len(rows)} days from {dates[0]} to {dates[-1]} are unchanged, skipping...")
+        return []
+
+    logger.info(f"Upserting {len(changed_rows)} changed days ({skipped} unchanged) from {dates[0]} to {dates[-1]}")
+    supabase.table("fitbit_data")\
+        .upsert(changed_rows, on_conflict="user_id,date")\
+        .execute()
+    _record_round_trip("fitbit_data", len(changed_rows))
+    return changed_rows
 
 def insert_activities(supabase: Client, user_id: str, date, activities):
     """Insert activities into the Supabase table."""
-    for activity in activities:
-        try:
-            start_time = datetime.strptime(activity['start_time'], '%H:%M')
-            full_datetime = datetime.combine(date, start_time.time())
-            formatted_time = full_datetime.isoformat()
-        except Exception as e:
-            logger.error(f"Error formatting time for activity {activity['name']}: {e}")
+    return ingest_activities(supabase, user_id, {date.strftime('%Y-%m-%d'): activities})
+
+def ingest_activities(supabase: Client, user_id: str, activities_by_date, existing_hashes=None):
+    """Store the activity set of each date, rewriting only days whose set changed.
+
+    Each day's set is hashed and compared with the activities_hash stored on its
+    fitbit_data row (read in one query unless passed in as existing_hashes).
+    Changed days are replaced with one bulk delete and one bulk insert. Returns
+    counts of inserted and skipped activities and the hash of every day's set,
+    which the caller stores with the day rows (see write_days).
+    """
+    counts = {"inserted": 0, "skipped": 0, "hashes": {}}
+    if not activities_by_date:
+        return counts
+
+    dates = sorted(activities_by_date)
+    if existing_hashes is None:
+        existing_hashes = get_day_hashes(supabase, user_id, dates[0], dates[-1])
+
+    changed_dates = []
+    rows = []
+    for date_str in dates:
+        activities = activities_by_date[date_str]
+        day_hash = hash_activities(activities)
+        counts["hashes"][date_str] = day_hash
+        if existing_hashes.get(date_str, {}).get("activities_hash") == day_hash:
+            counts["skipped"] += len(activities)
             continue
 
-        # Check if activity already exists
-        existing_activity = supabase.table("fitbit_activities")\
-            .select("*")\
+        changed_dates.append(date_str)
+        date = datetime.strptime(date_str, '%Y-%m-%d')
+        for activity in activities:
+            try:
+                start_time = datetime.strptime(activity['start_time'], '%H:%M')
+                formatted_time = datetime.combine(date, start_time.time()).isoformat()
+            except Exception as e:
+                logger.error(f"Error formatting time for activity {activity['name']}: {e}")
+                counts["skipped"] += 1
+                continue
+
+            rows.append({
+                "user_id": user_id,
+                "date": date_str,
+                "activity_name": activity['name'],
+                "duration": activity['duration'],
+                "calories": activity['calories'],
+                "distance": activity['distance'],
+                "start_time": formatted_time
+            })
+
+    if changed_dates:
+        supabase.table("fitbit_activities")\
+            .delete()\
             .eq("user_id", user_id)\
-            .eq("date", date.strftime('%Y-%m-%d'))\
-            .eq("activity_name", activity['name'])\
-            .eq("duration", activity['duration'])\
+            .in_("date", changed_dates)\
             .execute()
+        _record_round_trip("fitbit_activities")
+    if rows:
+        supabase.table("fitbit_activities").insert(rows).execute()
+        _record_round_trip("fitbit_activities", len(rows))
+    counts["inserted"] = len(rows)
+    logger.info(
+        f"Activities from {dates[0]} to {dates[-1]}: {len(changed_dates)} days rewritten "
+        f"({counts['inserted']} activities), {len(dates) - len(changed_dates)} days unchanged"
+    )
+    return counts
+
+def write_days(supabase: Client, user_id: str, rows, activities_by_date=None):
+    """Write day rows and per-day activity sets, skipping content whose hash is unchanged.
+
+    activities_by_date holds the complete set for each date it covers (an empty
+    list clears a day); pass None when activities were not fetched. Stored
+    hashes are read once for both tables. Returns the number of day rows
+    written and the activity counts.
+    """
+    dates = [row["date"] for row in rows] + list(activities_by_date or {})
+    if not dates:
+        return {"written": 0, "activities": None}
+    existing_hashes = get_day_hashes(supabase, user_id, min(dates), max(dates))
 
-        if existing_activity.data:
-            logger.info(f"Activity {activity['name']} already exists for {date.strftime('%Y-%m-%d')}, skipping...")
+    counts = None
+    if activities_by_date is not None:
+        # Activities go first so a day's hash is only stored once its set is written
+        counts = ingest_activities(supabase, user_id, activities_by_date, existing_hashes)
+        rows = [
+            dict(row, activities_hash=counts["hashes"][row["date"]]) if row["date"] in counts["hashes"] else row
+            for row in rows
+        ]
+    written = upsert_fitbit_data(supabase, user_id, rows, existing_hashes)
+    if written:
+        try:
+            update_rollups(supabase, user_id, [row["date"] for row in written])
+        except Exception as e:
+            # The day rows are stored; the next write in these periods recomputes them
+            logger.error(f"Error updating rollups: {type(e).__name__}")
+    return {"written": len(written), "activities": counts}
+
+def upsert_rollups(supabase: Client, rollups):
+    """Bulk upsert rows into fitbit_rollups."""
+    if not rollups:
+        return None
+    result = supabase.table("fitbit_rollups")\
+        .upsert(rollups, on_conflict="user_id,period,period_start")\
+        .execute()
+    _record_round_trip("fitbit_rollups", len(rollups))
+    return result
+
+def update_rollups(supabase: Client, user_id: str, dates):
+    """Recompute the weekly and monthly rollups containing the given dates.
+
+    Only the days of the affected periods are read back, paged past the
+    PostgREST row cap, so the cost depends on how many days changed, not on
+    the length of the history. Returns the rollup rows written.
+    """
+    periods = affected_periods(dates)
+    if not periods:
+        return []
+    start = min(start for _, start in periods)
+    end = max(period_end(start, period) for period, start in periods)
+    day_rows = list(iter_user_rows(
+        supabase, "fitbit_data", user_id, ",".join(SOURCE_COLUMNS), format_date(start), format_date(end)
+    ))
+
+    rollups = build_rollups(user_id, periods, day_rows)
+    upsert_rollups(supabase, rollups)
+    logger.info(f"Updated {len(rollups)} weekly/monthly rollups")
+    return rollups
+
+def iter_user_rows(supabase: Client, table: str, user_id: str, columns: str = "*", start_date: str = None,
+                   end_date: str = None, page_size: int = 1000, unique_dates: bool = True):
+    """Yield a user's rows of a per-date table in date order, paging by date (keyset pagination).
+
+    Only one page is held at a time. With unique_dates=False (several rows per
+    date, as in fitbit_activities) the last date of a full page may be cut off,
+    so its rows are dropped from the page and that date is read in one query.
+    """
+    def user_query():
+        return supabase.table(table).select(columns).eq("user_id", user_id)
+
+    last_date = None
+    while True:
+        query = user_query().order("date").limit(page_size)
+        if last_date:
+            query = query.gt("date", last_date)
+        elif start_date:
+            query = query.gte("date", start_date)
+        if end_date:
+            query = query.lte("date", end_date)
+        result = query.execute()
+        _record_round_trip(table)
+        if len(result.data) < page_size:
+            yield from result.data
+            return
+
+        last_date = result.data[-1]["date"]
+        if unique_dates:
+            yield from result.data
             continue
+        yield from (row for row in result.data if row["date"] != last_date)
+        result = user_query().eq("date", last_date).execute()
+        _record_round_trip(table)
+        yield from result.data
+
+def iter_table_users(supabase: Client, table: str):
+    """Yield every user ID with rows in a table, in order, with one indexed lookup per user."""
+    last_user_id = None
+    while True:
+        query = supabase.table(table).select("user_id").order("user_id").limit(1)
+        if last_user_id:
+            query = query.gt("user_id", last_user_id)
+        result = query.execute()
+        _record_round_trip(table)
+        if not result.data:
+            return
+        last_user_id = result.data[0]["user_id"]
+        yield last_user_id
 
-        data = {
-            "user_id": user_id,
-            "date": date.strftime('%Y-%m-%d'),
-            "activity_name": activity['name'],
-            "duration": activity['duration'],
-            "calories": activity['calories'],
-            "distance": activity['distance'],
-            "start_time": formatted_time
-        }
-        supabase.table("fitbit_activities").insert(data).execute()
-        logger.info(f"Inserted activity {activity['name']} for {date.strftime('%Y-%m-%d')}")
+def rebuild_rollups(supabase: Client, user_id: str, batch_size: int = 500):
+    """Recompute every rollup of a user from their whole fitbit_data history."""
+    day_rows = list(iter_user_rows(supabase, "fitbit_data", user_id, ",".join(SOURCE_COLUMNS)))
+    rollups = build_rollups(user_id, affected_periods(row["date"] for row in day_rows), day_rows)
+    for i in range(0, len(rollups), batch_size):
+        upsert_rollups(supabase, rollups[i:i + batch_size])
+    return len(rollups)
+
+def upsert_intraday_heart(supabase: Client, rows):
+    """Bulk upsert encoded intraday heart rate series into fitbit_intraday_heart."""
+    if not rows:
+        return None
+    logger.info(f"Uploading {len(rows)} days of intraday heart rate")
+    result = supabase.table("fitbit_intraday_heart")\
+        .upsert(rows, on_conflict="user_id,date")\
+        .execute()
+    _record_round_trip("fitbit_intraday_heart", len(rows))
+    return result
 
 def get_last_recorded_date(supabase: Client, user_id: str) -> str:
     """Get the last recorded date from the Supabase table for a specific user."""
@@ -165,26 +462,68 @@ def get_last_recorded_date(supabase: Client, user_id: str) -> str:
         .order("date", desc=True)\
         .limit(1)\
         .execute()
+    _record_round_trip("fitbit_data")
     
     if result.data:
         return result.data[0]["date"]
     return None
 
+def get_first_missing_date(supabase: Client, user_id: str, start_date: str, end_date: str) -> str:
+    """Get the first day from start_date to end_date without a fitbit_data row, or None.
+
+    Push syncs store single days ahead of the nightly run, so the last recorded
+    date alone can hide older gaps. Days before the user's first row are not
+    counted as missing.
+    """
+    stored = {row["date"] for row in iter_user_rows(supabase, "fitbit_data", user_id, "date", start_date, end_date)}
+    if start_date not in stored:
+        result = supabase.table("fitbit_data")\
+            .select("date")\
+            .eq("user_id", user_id)\
+            .lt("date", start_date)\
+            .limit(1)\
+            .execute()
+        _record_round_trip("fitbit_data")
+        if not result.data:
+            if not stored:
+                return None
+            start_date = min(stored)
+    for date in iter_dates(convert_str_to_date(start_date), convert_str_to_date(end_date)):
+        if format_date(date) not in stored:
+            return format_date(date)
+    return None
+
+def list_fitbit_users(supabase: Client, page_size: int = 1000):
+    """List every user ID with a row in fitbit_tokens, paging by user_id."""
+    user_ids = []
+    while True:
+        query = supabase.table("fitbit_tokens")\
+            .select("user_id")\
+            .order("user_id")\
+            .limit(page_size)
+        if user_ids:
+            query = query.gt("user_id", user_ids[-1])
+        result = query.execute()
+        _record_round_trip("fitbit_tokens")
+        user_ids.extend(record["user_id"] for record in result.data)
+        if len(result.data) < page_size:
+            return user_ids
+
 def get_fitbit_tokens(supabase: Client, user_id: str):
-    """Get the latest Fitbit tokens for a user."""
+    """Get the Fitbit tokens for a user (one row per user)."""
     result = supabase.table("fitbit_tokens")\
         .select("*")\
         .eq("user_id", user_id)\
-        .order("created_at", desc=True)\
         .limit(1)\
         .execute()
+    _record_round_trip("fitbit_tokens")
     
     if result.data:
         return result.data[0]
     return None
 
 def update_fitbit_tokens(supabase: Client, user_id: str, access_token: str, refresh_token: str, expires_at: float):
-    """Update Fitbit tokens in the database."""
+    """Update Fitbit tokens in the database, keeping a single row per user."""
     data = {
         "user_id": user_id,
         "access_token": access_token,
@@ -193,5 +532,26 @@ def update_fitbit_tokens(supabase: Client, user_id: str, access_token: str, refr
         "updated_at": datetime.now().isoformat()
     }
     
-    result = supabase.table("fitbit_tokens").insert(data).execute()
-    return result 
\ No newline at end of file
+    result = supabase.table("fitbit_tokens").upsert(data, on_conflict="user_id").execute()
+    _record_round_trip("fitbit_tokens", 1)
+    return result
+
+def swap_fitbit_tokens(supabase: Client, user_id: str, previous_refresh_token: str, access_token: str,
+                       refresh_token: str, expires_at: float) -> bool:
+    """Replace a user's tokens only if the stored refresh token is still previous_refresh_token.
+
+    Returns False if another run already replaced them.
+    """
+    data = {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "fitbit_expires_at": expires_at,
+        "updated_at": datetime.now().isoformat()
+    }
+    result = supabase.table("fitbit_tokens")\
+        .update(data)\
+        .eq("user_id", user_id)\
+        .eq("refresh_token", previous_refresh_token)\
+        .execute()
+    _record_round_trip("fitbit_tokens", len(result.data))
+    return bool(result.data)
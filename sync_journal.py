@@ -0,0 +1,114 @@
+import json
+import sqlite3
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal (
+    user_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    resource TEXT NOT NULL,
+    status TEXT NOT NULL,
+    value TEXT,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (user_id, date, resource)
+);
+CREATE INDEX IF NOT EXISTS journal_fetched_at ON journal (fetched_at);
+"""
+
+FETCHED = "fetched"
+WRITTEN = "written"
+
+class SyncJournal(object):
+    """Checkpoints of a sync, keyed (user_id, date, resource), kept in SQLite.
+
+    Each fetched value is recorded as soon as it arrives, and marked written
+    once it is stored in Supabase. A run that was interrupted or rate limited
+    picks up the values its predecessor already fetched instead of spending
+    quota on them again. Entries older than max_age_hours are ignored and
+    pruned, so later runs still re-fetch days Fitbit may have updated since.
+    """
+
+    def __init__(self, path, max_age_hours=6):
+        self.path = path
+        self.max_age_secs = max_age_hours * 3600
+        self._lock = threading.Lock()
+        # One connection shared by every sync thread, serialized by the lock; autocommit
+        # makes every checkpoint durable as soon as it is recorded
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self.prune()
+
+    def prune(self):
+        """Drop entries that are too old to be reused."""
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM journal WHERE fetched_at < ?", (time.time() - self.max_age_secs,)
+            ).rowcount
+        if deleted:
+            logger.debug(f"Pruned {deleted} expired journal entries")
+
+    def lookup(self, user_id, resource, start_date, end_date):
+        """Return the fresh entries for a resource between two date strings, keyed by date."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT date, status, value FROM journal"
+                " WHERE user_id = ? AND resource = ? AND date BETWEEN ? AND ? AND fetched_at >= ?",
+                (user_id, resource, start_date, end_date, time.time() - self.max_age_secs)
+            ).fetchall()
+        return {date: {"status": status, "value": json.loads(value)} for date, status, value in rows}
+
+    def record_fetched(self, user_id, resource, values_by_date):
+        """Checkpoint fetched values (None for a day without data), one entry per date string."""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO journal (user_id, date, resource, status, value, fetched_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (user_id, date, resource, FETCHED, json.dumps(value), now)
+                    for date, value in values_by_date.items()
+                ]
+            )
+
+    def mark_written(self, user_id, resources, dates):
+        """Record that the given resources of the given date strings are stored in Supabase."""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE journal SET status = ? WHERE user_id = ? AND resource = ? AND date = ?",
+                [(WRITTEN, user_id, resource, date) for resource in resources for date in dates]
+            )
+
+    def is_written(self, user_id, resources, dates):
+        """Whether every resource of every given date string was fetched and written recently."""
+        for resource in resources:
+            entries = self.lookup(user_id, resource, min(dates), max(dates))
+            if any(entries.get(date, {}).get("status") != WRITTEN for date in dates):
+                return False
+        return True
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# Journals of this process, keyed by path
+_journals = {}
+_journals_lock = threading.Lock()
+
+def get_journal(config):
+    """Return the process-wide journal for the configured path, or None when journaling is off."""
+    path = config["sync"]["journal_path"]
+    if not path:
+        return None
+    with _journals_lock:
+        journal = _journals.get(path)
+        if journal is None:
+            journal = _journals[path] = SyncJournal(path, config["sync"]["journal_max_age_hours"])
+            return journal
+    # A long-running process reuses the journal, so expired entries are dropped on each use
+    journal.prune()
+    return journal
@@ -0,0 +1,160 @@
+import json
+import os
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Labels kept in the JSON report but dropped from Prometheus output to bound cardinality
+HIGH_CARDINALITY_LABELS = ("user_id",)
+
+class RunReport(object):
+    """Timing spans, counters and gauges for one sync run.
+
+    Spans time each stage (auth, token load, every fetch and insert); counters
+    track Fitbit calls and bytes, Supabase round trips and rows written. The
+    report can be written as JSON and as a Prometheus textfile.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.spans = []
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """Time a block of work, recording whether it raised."""
+        record = {"stage": stage, "labels": labels, "start": time.time(), "status": "ok"}
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record["status"] = "error"
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            record["duration_secs"] = time.perf_counter() - start
+            with self._lock:
+                self.spans.append(record)
+
+    def increment(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def instrument_fitbit(self, fitbit_client, user_id):
+        """Count every Fitbit HTTP response, its size and the reported rate-limit headroom.
+
+        Counts go to the current report, so a long-lived client keeps reporting
+        after reset_run_report().
+        """
+
+        def response_hook(response, *args, **kwargs):
+            report = get_run_report()
+            report.increment("fitbit_requests_total", status=str(response.status_code))
+            report.increment("fitbit_response_bytes_total", len(response.content or b""))
+            remaining = response.headers.get("Fitbit-Rate-Limit-Remaining")
+            if remaining is not None:
+                report.set_gauge("fitbit_rate_limit_remaining", int(remaining), user_id=user_id)
+
+        fitbit_client.client.session.hooks["response"].append(response_hook)
+        return fitbit_client
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "started_at": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+                "duration_secs": time.time() - self.started_at,
+                "spans": list(self.spans),
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "gauges": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.gauges.items())
+                ]
+            }
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def write_prometheus(self, path):
+        """Write the report in the Prometheus textfile-collector format."""
+
+        def format_labels(labels):
+            labels = {k: v for k, v in labels if k not in HIGH_CARDINALITY_LABELS}
+            if not labels:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+        report = self.to_dict()
+        stage_totals = {}
+        for span in report["spans"]:
+            key = format_labels([("stage", span["stage"])] + list(span["labels"].items()))
+            total, count, errors = stage_totals.get(key, (0.0, 0, 0))
+            stage_totals[key] = (total + span["duration_secs"], count + 1, errors + (span["status"] != "ok"))
+
+        lines = [
+            "# TYPE fitbit_sync_run_duration_seconds gauge",
+            f"fitbit_sync_run_duration_seconds {report['duration_secs']:.3f}",
+            "# TYPE fitbit_sync_last_run_timestamp_seconds gauge",
+            f"fitbit_sync_last_run_timestamp_seconds {self.started_at:.0f}",
+            "# TYPE fitbit_sync_stage_duration_seconds summary"
+        ]
+        for key, (total, count, _) in sorted(stage_totals.items()):
+            lines.append(f"fitbit_sync_stage_duration_seconds_sum{key} {total:.3f}")
+            lines.append(f"fitbit_sync_stage_duration_seconds_count{key} {count}")
+        lines.append("# TYPE fitbit_sync_stage_errors_total counter")
+        for key, (_, _, errors) in sorted(stage_totals.items()):
+            lines.append(f"fitbit_sync_stage_errors_total{key} {errors}")
+
+        aggregated = {}
+        for kind, entries in (("counter", report["counters"]), ("gauge", report["gauges"])):
+            for entry in entries:
+                key = (kind, entry["name"], format_labels(entry["labels"].items()))
+                if kind == "gauge" and key in aggregated:
+                    # Collapsed per-user gauges report the lowest value
+                    aggregated[key] = min(aggregated[key], entry["value"])
+                else:
+                    aggregated[key] = aggregated.get(key, 0) + entry["value"]
+        declared = set()
+        for (kind, name, labels), value in sorted(aggregated.items()):
+            metric = f"fitbit_sync_{name}"
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} {kind}")
+                declared.add(metric)
+            lines.append(f"{metric}{labels} {value}")
+
+        # Write atomically so the node exporter never reads a partial file
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+# Global report for the current run
+_run_report = RunReport()
+
+def get_run_report() -> RunReport:
+    """Return the report for the current run."""
+    return _run_report
+
+def reset_run_report() -> RunReport:
+    """Start a fresh report, e.g. for the next sync of a long-running process."""
+    global _run_report
+    _run_report = RunReport()
+    return _run_report
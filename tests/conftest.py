@@ -0,0 +1,46 @@
+import os
+import re
+import sys
+import time
+import pytest
+import fitbit
+from supabase import create_client
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class StubFitbit(fitbit.Fitbit):
+    """fitbit.Fitbit answering make_request from canned responses instead of the API.
+
+    routes is a list of (regex, response) matched against the request URL in
+    order; response may be a callable taking the URL. Requested URLs are kept
+    in self.requests.
+    """
+
+    def __init__(self, routes, **kwargs):
+        kwargs.setdefault("access_token", "access")
+        kwargs.setdefault("refresh_token", "refresh")
+        kwargs.setdefault("expires_at", time.time() + 3600)
+        super().__init__("client-id", "client-secret", **kwargs)
+        self.routes = [(re.compile(pattern), response) for pattern, response in routes]
+        self.requests = []
+
+    def make_request(self, url, *args, **kwargs):
+        self.requests.append(url)
+        for pattern, response in self.routes:
+            if pattern.search(url):
+                return response(url) if callable(response) else response
+        raise AssertionError(f"Unexpected Fitbit request: {url}")
+
+@pytest.fixture
+def stub_fitbit():
+    return StubFitbit
+
+@pytest.fixture
+def fake_supabase():
+    """(server, client) for an in-memory Supabase stand-in from the benchmarks."""
+    from benchmarks.fake_supabase import FakeSupabase, make_jwt
+    server = FakeSupabase().start()
+    try:
+        yield server, create_client(server.url, make_jwt({"role": "service_role"}))
+    finally:
+        server.stop()
@@ -0,0 +1,165 @@
+import json
+import os
+import stat
+import threading
+import time
+import pytest
+from fitbit.api import FitbitOauth2Client
+from fitbit.exceptions import HTTPUnauthorized
+from oauthlib.oauth2 import InvalidGrantError
+from fitbit_tokens import TokenManager
+from supabase_utils import get_fitbit_tokens, swap_fitbit_tokens
+
+USER_ID = "user-1"
+
+def token_row(access_token="access", refresh_token="refresh", expires_in=3600):
+    return {
+        "user_id": USER_ID,
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "fitbit_expires_at": time.time() + expires_in
+    }
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / "tokens")
+
+def test_cache_is_encrypted(fake_supabase, cache_dir):
+    server, supabase = fake_supabase
+    server.seed("fitbit_tokens", [token_row()])
+    manager = TokenManager(supabase, USER_ID, cache_dir, "cache-key")
+    manager.load()
+
+    path = os.path.join(cache_dir, f"{USER_ID}.json")
+    with open(path) as f:
+        content = f.read()
+    assert "access" not in content and "refresh" not in content
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert TokenManager(supabase, USER_ID, cache_dir, "cache-key")._read_cache()["access_token"] == "access"
+    assert TokenManager(supabase, USER_ID, cache_dir, "other-key")._read_cache() is None
+
+def test_load_prefers_fresh_cache(fake_supabase, cache_dir):
+    server, supabase = fake_supabase
+    server.seed("fitbit_tokens", [token_row()])
+    TokenManager(supabase, USER_ID, cache_dir, "cache-key").load()
+
+    server.reset_stats()
+    tokens = TokenManager(supabase, USER_ID, cache_dir, "cache-key").load()
+    assert tokens["access_token"] == "access"
+    assert server.stats()["requests"] == 0
+
+def test_load_ignores_plaintext_and_expiring_cache(fake_supabase, cache_dir):
+    server, supabase = fake_supabase
+    server.seed("fitbit_tokens", [token_row(access_token="stored")])
+    os.makedirs(cache_dir)
+    with open(os.path.join(cache_dir, f"{USER_ID}.json"), "w") as f:
+        json.dump({"access_token": "plain", "refresh_token": "plain", "expires_at": time.time() + 3600}, f)
+    assert TokenManager(supabase, USER_ID, cache_dir, "cache-key").load()["access_token"] == "stored"
+
+    manager = TokenManager(supabase, USER_ID, cache_dir, "cache-key")
+    manager._write_cache({"access_token": "expiring", "refresh_token": "refresh", "expires_at": time.time() + 60})
+    assert manager.load()["access_token"] == "stored"
+
+def test_swap_fitbit_tokens_is_compare_and_swap(fake_supabase):
+    server, supabase = fake_supabase
+    server.seed("fitbit_tokens", [token_row()])
+
+    assert swap_fitbit_tokens(supabase, USER_ID, "refresh", "access-2", "refresh-2", time.time() + 28800)
+    # A second run still holding the old refresh token loses
+    assert not swap_fitbit_tokens(supabase, USER_ID, "refresh", "access-3", "refresh-3", time.time() + 28800)
+    assert get_fitbit_tokens(supabase, USER_ID)["refresh_token"] == "refresh-2"
+
+class FakeTokenEndpoint(object):
+    """Stands in for FitbitOauth2Client.refresh_token: refresh tokens are single use."""
+
+    def __init__(self, valid_refresh_token):
+        self.valid = valid_refresh_token
+        self.refreshes = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, oauth_client):
+        time.sleep(0.05)
+        with self._lock:
+            if oauth_client.session.token["refresh_token"] != self.valid:
+                raise InvalidGrantError()
+            self.refreshes += 1
+            self.valid = f"refresh-{self.refreshes + 1}"
+            token = {
+                "access_token": f"access-{self.refreshes + 1}",
+                "refresh_token": self.valid,
+                "expires_at": time.time() + 28800
+            }
+        oauth_client.session.token = token
+        oauth_client.session.token_updater(token)
+        return token
+
+def make_client(stub_fitbit, manager, routes):
+    tokens = manager.load()
+    client = stub_fitbit(
+        routes,
+        access_token=tokens["access_token"],
+        refresh_token=tokens["refresh_token"],
+        expires_at=tokens["expires_at"],
+        refresh_cb=manager.store
+    )
+    return manager.install(client)
+
+def test_concurrent_requests_refresh_once(fake_supabase, cache_dir, stub_fitbit, monkeypatch):
+    server, supabase = fake_supabase
+    server.seed("fitbit_tokens", [token_row(expires_in=60)])
+    endpoint = FakeTokenEndpoint("refresh")
+    monkeypatch.setattr(FitbitOauth2Client, "refresh_token", endpoint)
+    manager = TokenManager(supabase, USER_ID, cache_dir, "cache-key")
+    client = make_client(stub_fitbit, manager, [(r".", {})])
+
+    errors = []
+
+    def fetch():
+        try:
+            client.make_request("https://api.fitbit.com/1/user/-/profile.json")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=fetch) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert endpoint.refreshes == 1
+    assert get_fitbit_tokens(supabase, USER_ID)["refresh_token"] == "refresh-2"
+    assert client.client.session.token["access_token"] == "access-2"
+
+def test_rejected_tokens_are_reloaded_and_retried(fake_supabase, cache_dir, stub_fitbit):
+    server, supabase = fake_supabase
+    server.seed("fitbit_tokens", [token_row()])
+    manager = TokenManager(supabase, USER_ID, cache_dir, "cache-key")
+    manager.load()
+    # Another process refreshes; our cache still holds the old tokens
+    swap_fitbit_tokens(supabase, USER_ID, "refresh", "access-2", "refresh-2", time.time() + 28800)
+
+    class Unauthorized(object):
+        status_code = 401
+        content = b'{"errors": [{"errorType": "invalid_token"}]}'
+        headers = {}
+
+    def profile(url):
+        if client.client.session.token["access_token"] != "access-2":
+            raise HTTPUnauthorized(Unauthorized())
+        return {"user": {}}
+
+    client = make_client(stub_fitbit, TokenManager(supabase, USER_ID, cache_dir, "cache-key"), [(r".", profile)])
+    assert client.make_request("https://api.fitbit.com/1/user/-/profile.json") == {"user": {}}
+    assert TokenManager(supabase, USER_ID, cache_dir, "cache-key")._read_cache()["access_token"] == "access-2"
+
+def test_revoked_grant_is_raised_and_drops_cache(fake_supabase, cache_dir, stub_fitbit, monkeypatch):
+    server, supabase = fake_supabase
+    server.seed("fitbit_tokens", [token_row(expires_in=60)])
+    monkeypatch.setattr(FitbitOauth2Client, "refresh_token", FakeTokenEndpoint("revoked"))
+    manager = TokenManager(supabase, USER_ID, cache_dir, "cache-key")
+    client = make_client(stub_fitbit, manager, [(r".", {})])
+
+    with pytest.raises(InvalidGrantError):
+        client.make_request("https://api.fitbit.com/1/user/-/profile.json")
+    assert not os.path.exists(os.path.join(cache_dir, f"{USER_ID}.json"))
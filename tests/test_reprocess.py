@@ -0,0 +1,112 @@
+from datetime import date
+import pytest
+import script
+from fitbit_archive import ResponseArchive
+from reprocess import REQUIRED_FIELDS, rebuild_days
+from supabase_utils import FITBIT_DATA_COLUMNS, make_fitbit_row
+
+USER_ID = "user-1"
+DATES = ["2024-01-01", "2024-01-02", "2024-01-03"]
+
+def heart_day(date_str, rhr, fat_burn, cardio):
+    return {"dateTime": date_str, "value": {"restingHeartRate": rhr, "heartRateZones": [
+        {"name": "Fat Burn", "minutes": fat_burn},
+        {"name": "Cardio", "minutes": cardio},
+        {"name": "Peak", "minutes": 0}
+    ]}}
+
+# Three days where Fitbit leaves days out: no sleep and no active zone minutes on the 2nd and 3rd
+ROUTES = [
+    (r"/activities/steps/date/", {"activities-steps": [
+        {"dateTime": date_str, "value": str(1000 * (i + 1))} for i, date_str in enumerate(DATES)
+    ]}),
+    (r"/activities/heart/date/", {"activities-heart": [
+        heart_day(DATES[0], 58, 30, 4), heart_day(DATES[1], 60, 25, 3), heart_day(DATES[2], 61, 0, 0)
+    ]}),
+    (r"/activities/active-zone-minutes/date/", {"activities-active-zone-minutes": [
+        {"dateTime": DATES[0], "value": {"fatBurnActiveZoneMinutes": 20, "cardioActiveZoneMinutes": 8}}
+    ]}),
+    (r"/sleep/date/", {"sleep": [{
+        "dateOfSleep": DATES[0], "minutesAsleep": 420,
+        "levels": {"summary": {"deep": {"minutes": 80}, "light": {"minutes": 250}, "rem": {"minutes": 90}}}
+    }]}),
+    (r"/activities/list\.json", {"activities": [{
+        "activityName": "Walk", "duration": 1800000, "calories": 120, "distance": 2.1,
+        "startTime": f"{DATES[1]}T07:30:00.000+10:00"
+    }], "pagination": {}})
+]
+
+@pytest.fixture
+def synced(tmp_path, monkeypatch, stub_fitbit):
+    """Run the live range sync over an archiving stub client and capture what it writes."""
+    client = ResponseArchive(str(tmp_path), USER_ID).install(stub_fitbit(ROUTES))
+    written = {}
+
+    def capture_write_days(supabase, user_id, rows, activities_by_date=None):
+        written["rows"] = {row["date"]: row for row in rows}
+        written["activities"] = activities_by_date
+        return {"written": len(rows), "activities": None}
+
+    monkeypatch.setattr(script, "write_days", capture_write_days)
+    assert script.sync_range(client, None, USER_ID, date(2024, 1, 1), date(2024, 1, 3))
+    return written, ResponseArchive(str(tmp_path), USER_ID)
+
+def test_replay_matches_live_sync(synced):
+    written, archive = synced
+    fields_by_date, activities_by_date = rebuild_days(archive.iter_records())
+
+    assert sorted(fields_by_date) == DATES
+    for date_str in DATES:
+        values = fields_by_date[date_str]
+        assert all(field in values for field in REQUIRED_FIELDS)
+        replayed = make_fitbit_row(USER_ID, date_str, **values)
+        live = written["rows"][date_str]
+        assert {column: replayed[column] for column in FITBIT_DATA_COLUMNS} == \
+            {column: live[column] for column in FITBIT_DATA_COLUMNS}
+    assert activities_by_date == {date_str: items for date_str, items in written["activities"].items() if items}
+
+def test_replay_days_missing_from_range_series(synced):
+    _, archive = synced
+    fields_by_date, _ = rebuild_days(archive.iter_records())
+
+    # No sleep log: complete, with zero minutes
+    assert fields_by_date["2024-01-02"]["sleep"] == "0h0min"
+    # No Active Zone Minutes: zeros, not the heart series zones
+    assert fields_by_date["2024-01-02"]["fat_burn_minutes"] == 0
+    assert fields_by_date["2024-01-02"]["cardio_minutes"] == 0
+    assert fields_by_date["2024-01-01"]["fat_burn_minutes"] == 20
+    assert fields_by_date["2024-01-01"]["cardio_minutes"] == 4
+
+def list_record(fetched_at, offset, activities, has_next):
+    return {
+        "path": f"/1/user/-/activities/list.json?afterDate=2024-01-01&limit=100&offset={offset}&sort=asc",
+        "fetched_at": fetched_at,
+        "response": {
+            "activities": [
+                {"activityName": name, "duration": 600000, "calories": 50, "startTime": f"{date_str}T08:00:00.000"}
+                for date_str, name in activities
+            ],
+            "pagination": {"next": "https://api.fitbit.com/next" if has_next else ""}
+        }
+    }
+
+def activity_names(activities_by_date):
+    return {date_str: [item["name"] for item in items] for date_str, items in activities_by_date.items()}
+
+def test_activity_list_pages_merge_per_fetch():
+    records = [
+        list_record("2024-01-05T00:00:00", 0, [("2024-01-01", "Walk"), ("2024-01-02", "Run")], True),
+        list_record("2024-01-05T00:00:01", 100, [("2024-01-02", "Bike")], False)
+    ]
+    _, activities_by_date = rebuild_days(records)
+    assert activity_names(activities_by_date) == {"2024-01-01": ["Walk"], "2024-01-02": ["Run", "Bike"]}
+
+def test_activity_list_fetch_cut_short_keeps_complete_days():
+    records = [
+        list_record("2024-01-05T00:00:00", 0, [("2024-01-01", "Walk"), ("2024-01-02", "Run")], True),
+        list_record("2024-01-05T00:00:01", 100, [("2024-01-02", "Bike")], False),
+        # A later fetch that stopped after its first page: its last day may be incomplete
+        list_record("2024-01-06T00:00:00", 0, [("2024-01-01", "Swim"), ("2024-01-02", "Run")], True)
+    ]
+    _, activities_by_date = rebuild_days(records)
+    assert activity_names(activities_by_date) == {"2024-01-01": ["Swim"], "2024-01-02": ["Run", "Bike"]}
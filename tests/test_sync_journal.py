@@ -0,0 +1,95 @@
+import re
+import time
+from datetime import date, timedelta
+import pytest
+import script
+import sync_journal
+from fitbit_utils import format_date, iter_dates
+from sync_journal import SyncJournal
+
+USER_ID = "user-1"
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = SyncJournal(str(tmp_path / "journal.sqlite"), max_age_hours=6)
+    yield journal
+    journal.close()
+
+def test_written_once_every_resource_is_marked(journal):
+    resources = ["range/Steps", "range/Sleep"]
+    journal.record_fetched(USER_ID, "range/Steps", {"2024-01-01": 100, "2024-01-02": None})
+    journal.record_fetched(USER_ID, "range/Sleep", {"2024-01-01": {"sleep": "7h0min"}, "2024-01-02": None})
+    assert journal.lookup(USER_ID, "range/Steps", "2024-01-01", "2024-01-02") == {
+        "2024-01-01": {"status": "fetched", "value": 100},
+        "2024-01-02": {"status": "fetched", "value": None}
+    }
+    assert not journal.is_written(USER_ID, resources, ["2024-01-01", "2024-01-02"])
+
+    journal.mark_written(USER_ID, ["range/Steps"], ["2024-01-01", "2024-01-02"])
+    assert not journal.is_written(USER_ID, resources, ["2024-01-01", "2024-01-02"])
+    journal.mark_written(USER_ID, ["range/Sleep"], ["2024-01-01", "2024-01-02"])
+    assert journal.is_written(USER_ID, resources, ["2024-01-01", "2024-01-02"])
+
+def test_entries_expire(journal, monkeypatch):
+    journal.record_fetched(USER_ID, "range/Steps", {"2024-01-01": 100})
+    journal.mark_written(USER_ID, ["range/Steps"], ["2024-01-01"])
+
+    later = time.time() + 6 * 3600 + 1
+    monkeypatch.setattr(sync_journal.time, "time", lambda: later)
+    assert journal.lookup(USER_ID, "range/Steps", "2024-01-01", "2024-01-01") == {}
+    assert not journal.is_written(USER_ID, ["range/Steps"], ["2024-01-01"])
+    journal.prune()
+    with journal._lock:
+        assert journal._conn.execute("SELECT COUNT(*) FROM journal").fetchone()[0] == 0
+
+RANGE = re.compile(r"/date/(\d{4}-\d{2}-\d{2})/(\d{4}-\d{2}-\d{2})\.json")
+
+def steps_series(url):
+    match = RANGE.search(url)
+    start, end = date.fromisoformat(match.group(1)), date.fromisoformat(match.group(2))
+    return {"activities-steps": [{"dateTime": format_date(day), "value": "1000"} for day in iter_dates(start, end)]}
+
+ROUTES = [
+    (r"/activities/steps/date/", steps_series),
+    (r"/activities/heart/date/", {"activities-heart": []}),
+    (r"/activities/active-zone-minutes/date/", {"activities-active-zone-minutes": []}),
+    (r"/sleep/date/", {"sleep": []}),
+    (r"/activities/list\.json", {"activities": [], "pagination": {}})
+]
+
+@pytest.fixture
+def sync(monkeypatch, stub_fitbit, journal):
+    """Run sync_range with the journal over a stub client and return the dates each run wrote."""
+    monkeypatch.setattr(
+        script, "write_days",
+        lambda supabase, user_id, rows, activities_by_date=None: {"written": len(rows), "activities": None}
+    )
+
+    def run(start_date, end_date, resync_from=None):
+        client = stub_fitbit(ROUTES)
+        assert script.sync_range(client, None, USER_ID, start_date, end_date, journal=journal, resync_from=resync_from)
+        return client.requests
+    return run
+
+def test_rerun_skips_written_chunks_but_not_the_resync_window(sync):
+    # 150 days: one full 100-day chunk and a 50-day chunk holding the 7-day re-sync window
+    start_date, end_date = date(2024, 1, 1), date(2024, 5, 29)
+    resync_from = end_date - timedelta(days=6)
+    assert len(sync(start_date, end_date, resync_from)) == 10
+
+    # Only the window is fetched again; the rest of its chunk comes from the journal
+    rerun = sync(start_date, end_date, resync_from)
+    assert len(rerun) == 5
+    assert all(format_date(resync_from) in url for url in rerun)
+
+    # Without a re-sync window every written chunk is skipped
+    assert sync(start_date, end_date) == []
+
+def test_interrupted_run_reuses_fetched_values(sync, journal):
+    start_date, end_date = date(2024, 1, 1), date(2024, 1, 7)
+    # Fetched but never written, as after a crash between fetching and writing
+    for data_type in script.RANGE_FETCHERS:
+        journal.record_fetched(USER_ID, f"range/{data_type}", {
+            format_date(day): None for day in iter_dates(start_date, end_date)
+        })
+    assert sync(start_date, end_date, resync_from=start_date) == []